@@ -1,4 +1,6 @@
 from distr.core.signals import signal_manager
+from distr.core.phrases import phrase
+from distr.core.tts import stream_sentences
 import pyautogui
 import re
 
@@ -41,13 +43,22 @@ def response(chat_manager, action, data):
             pass
         else:
             print(f"Refined response: {prompt_response}")
-            ai_response = chat_manager.process_prompt(prompt_response)
-            prompt_response = ai_response["message"]["content"]
-            
-            print(f"Original AI response: {prompt_response}")  # Add this line
-            cleaned_response = cleanup_response(prompt_response)
-            print(f"Cleaned AI response: {cleaned_response}")
-            prompt_response = cleaned_response
+            # sentences are spoken while the rest of the response is still generating
+            speech = chat_manager.start_tts_stream() if speak else None
+            sentences = []
+            try:
+                for sentence in stream_sentences(chat_manager.stream_prompt(prompt_response)):
+                    cleaned_sentence = cleanup_response(sentence)
+                    sentences.append(cleaned_sentence)
+                    if speech and cleaned_sentence:
+                        speech.feed(cleaned_sentence)
+            finally:
+                if speech:
+                    speech.close()
+
+            prompt_response = " ".join(sentences)
+            print(f"Cleaned AI response: {prompt_response}")
+            return
 
     if speak:
         chat_manager.start_tts(prompt_response)
@@ -58,11 +69,17 @@ def get_prompt(chat_manager, action, data):
     transcription = data['transcription']
     end_words = action.get('end', {}).get('words', [])
 
-    # Use ChatManager to refine the prompt
-    refined_content = chat_manager.refine_prompt(action, trigger_sentence, transcription, end_words)
+    if data.get('trimmed', False):
+        # the trigger and end phrases were cut out of the audio before Whisper
+        # saw it, only a stray end phrase can be left over
+        refined_content = chat_manager.strip_end_words(transcription.strip(), end_words)
+        refined_content = refined_content if refined_content else "<unrecognised>"
+    else:
+        # Use ChatManager to refine the prompt
+        refined_content = chat_manager.refine_prompt(action, trigger_sentence, transcription, end_words)
 
     if refined_content == "<unrecognised>":
-        return "I'm sorry, I couldn't understand that. Could you please rephrase?"
+        return phrase("unrecognised")
 
     print(f"Refined content: {refined_content}")
 
@@ -1,4 +1,3 @@
-from PyQt6.QtCore import QObject, pyqtSignal
 from PyQt6.QtCore import QThreadPool, QTimer
 from transformers import logging as transformers_logging
 from distr.core.voice import ContinuousListener
@@ -10,19 +9,18 @@ from distr.gui.oracle import OracleWindow
 from distr.gui.about import AboutWindow
 from distr.gui.settings import SettingsWindow
 
-from distr.core.constants import TMP_DIR
 from distr.core.chat import ChatManager
 
 from distr.core.sound import SoundPlayer
+from distr.core.tts import initialize_tts_manager
 from distr.core.db import get_session
+from distr.core.utils import load_preferences_config, save_preferences_config
+from distr.core.constants import PERSISTED_SETTINGS
 
 from PyQt6 import QtWidgets
-import threading
 import warnings
 import logging
 import AppKit
-import hashlib
-import torch
 import sys
 import os
 
@@ -36,43 +34,6 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.WARNING)
 logging.getLogger("vosk").setLevel(logging.ERROR)
 
-tts_model_ready = threading.Event()
-
-class TTSManager(QObject):
-    tts_completed = pyqtSignal(str)
-    tts_error = pyqtSignal(str)
-
-    def __init__(self, sound_player):
-        super().__init__()
-        self.tts_model = None
-        self.sound_player = sound_player  # Use the provided SoundPlayer instance
-        self.initialize_tts_model()
-
-    def initialize_tts_model(self):
-        from TTS.api import TTS
-        print("Initializing TTS model...")
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.tts_model = TTS("tts_models/en/vctk/vits").to(device)
-        tts_model_ready.set()  # Signal that the TTS model is ready
-        print("TTS model initialized.")
-
-    def start_tts(self, text):
-        try:
-            output_file = f"{TMP_DIR}/output_{hashlib.md5(text.encode()).hexdigest()}.wav"
-            # Specify a default speaker (e.g., "p225")
-            self.tts_model.tts_to_file(text=text, file_path=output_file, speaker="p225")
-            self.tts_completed.emit(output_file)
-            signal_manager.voice_set_is_speaking.emit(True)
-            signal_manager.action_set_is_speaking.emit(True)
-            self.sound_player.play_sound(output_file)
-        except Exception as e:
-            print(f"TTS Error: {str(e)}")
-            self.tts_error.emit(str(e))
-
-def initialize_tts_manager(sound_player):
-    return TTSManager(sound_player)
-
-
 
 class Application(QtWidgets.QApplication):
     def __init__(self, argv):
@@ -97,14 +58,17 @@ class Application(QtWidgets.QApplication):
 
         self.action_handler = ActionHandler()
         self.chat_manager = ChatManager()
+        self.chat_manager.set_model_resident(True)  # listening starts on, preload the LLM
 
         self.setup_oracle_window()
 
-        # if the settings file's TTS is set to Conque-AI, then initialize the Conque-AI TTS
+        # returns straight away, the TTS model loads in the background
         self.tts_manager = initialize_tts_manager(self.sound_player)  # Initialize TTSManager with the shared SoundPlayer
 
         self.chat_manager.set_tts_manager(self.tts_manager)
 
+        self.settings_window.settings_changed.connect(self.on_settings_changed)
+
         QTimer.singleShot(100, self.initialize_app)
 
 
@@ -119,6 +83,12 @@ class Application(QtWidgets.QApplication):
         self.listener.start()
 
 
+    def on_settings_changed(self, settings):
+        preferences = load_preferences_config()
+        preferences.update({key: settings[key] for key in PERSISTED_SETTINGS if settings.get(key) is not None})
+        save_preferences_config(preferences)
+        self.tts_manager.apply_settings(preferences)
+
     def setup_oracle_window(self):
         self.oracle_window = OracleWindow(self.settings_window, self.about_window, self.voice_box, self.chat_manager)
         self.voice_box.set_oracle_window(self.oracle_window) 
@@ -129,6 +99,9 @@ class Application(QtWidgets.QApplication):
             self.chat_manager.chat_created.connect(self.oracle_window.chat_window.on_chat_created)
             self.chat_manager.chat_updated.connect(self.oracle_window.chat_window.on_chat_updated)
             self.chat_manager.chat_deleted.connect(self.oracle_window.chat_window.on_chat_deleted)
+            self.chat_manager.response_started.connect(self.oracle_window.chat_window.on_response_started)
+            self.chat_manager.response_token.connect(self.oracle_window.chat_window.on_response_token)
+            self.chat_manager.response_finished.connect(self.oracle_window.chat_window.on_response_finished)
 
 
     def quit(self):
@@ -139,6 +112,8 @@ class Application(QtWidgets.QApplication):
                 self.listener.stop()
             if self.action_handler:
                 self.action_handler.stop()
+            self.tts_manager.shutdown()
+            self.sound_player.close()
 
             QThreadPool.globalInstance().waitForDone(5000)
             for window in self.topLevelWindows():
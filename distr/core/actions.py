@@ -1,10 +1,16 @@
 from sentence_transformers import SentenceTransformer
-from distr.core.utils import load_actions_config
+from distr.core.utils import load_actions_config, save_learned_trigger
 from distr.core.signals import signal_manager
+from distr.core.constants import NBEST_CONFIDENCE_WEIGHT
+from distr.core.constants import LLM_INTENT_FALLBACK, LLM_INTENT_MIN_CONFIDENCE, LLM_INTENT_MAX_WORDS
+from distr.core.constants import LLM_INTENT_LEARN_AFTER, LLM_INTENT_LEARN_MIN_WORDS
+from distr.core.metrics import metrics
 from fuzzywuzzy import fuzz
 import importlib
+import threading
 import logging
 import pyaudio
+import queue
 import torch
 import time
 
@@ -17,11 +23,25 @@ class ActionHandler:
         self.actions = self.load_actions()
         self.action = {} # stores the current action being executed
         self.previous_action = {} 
+        self.last_match = None # the trigger and text that matched the last command
 
         # this model is used to compare the similarity of the input text to the trigger words
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
         self.trigger_words, self.trigger_descriptions = self.load_triggers()
 
+        # the trigger embeddings are encoded once; learned variants are appended
+        self.trigger_lock = threading.Lock()
+        self.all_triggers, self.trigger_to_action = self.index_triggers()
+        self.trigger_embeddings = torch.tensor(self.model.encode(self.all_triggers))
+
+        # unmatched utterances are mapped onto an action by the LLM, one at a time
+        self.intent_fallback = LLM_INTENT_FALLBACK
+        self.fallback_lock = threading.Lock()
+        self.unresolved = set()  # utterances the LLM couldn't map, not asked again
+        self.resolved_intents = queue.Queue()  # (action, utterance, commands_started), started by the listener
+        self.intent_evidence = {}  # (utterance, trigger) -> times the LLM resolved it so
+        self.commands_started = 0
+
         self.is_listening = True
         self.is_transcribing = False
         self.is_speaking = False
@@ -74,15 +94,7 @@ class ActionHandler:
         return config["actions"]
 
 
-    def find_action(self, input_text, threshold=0.5): # get the closest trigger and action
-        # Check for exact match first (including variants)
-        for action in self.actions:
-            if input_text == action['trigger'] or input_text in action.get('trigger_variants', []):
-                return action['trigger'], action, 1.0
-
-            if input_text.split(" ")[0] == action['trigger'] or input_text.split(" ")[0] in action.get('trigger_variants', []):
-                return action['trigger'], action, 1.0
-
+    def index_triggers(self):
         # Prepare all triggers and variants for embedding
         all_triggers = []
         trigger_to_action = {}
@@ -92,35 +104,162 @@ class ActionHandler:
             for variant in action.get('trigger_variants', []):
                 all_triggers.append(variant)
                 trigger_to_action[variant] = action
+        return all_triggers, trigger_to_action
+
+    def learn_trigger(self, action, variant):
+        # indexes the new variant straight away and persists it in the overlay file
+        embedding = torch.tensor(self.model.encode([variant]))
+        with self.trigger_lock:
+            if variant in self.trigger_to_action:
+                return
+            action.setdefault('trigger_variants', []).append(variant)
+            self.trigger_embeddings = torch.cat([self.trigger_embeddings, embedding])
+            self.all_triggers = self.all_triggers + [variant]
+            self.trigger_to_action[variant] = action
+            self.trigger_words.append(variant)
+            self.trigger_descriptions[variant] = action.get("method", "")
+        save_learned_trigger(action['trigger'], variant)
+        metrics.increment("action.fallback.learned")
+        print(f"Learned \"{variant}\" as a variant of \"{action['trigger']}\"")
+
+    def resolve_with_llm(self, chat_manager, speech, commands_started):
+        # runs on its own thread, the listener keeps going meanwhile and
+        # starts the action when it picks it up from resolved_intents
+        try:
+            start_time = time.perf_counter()
+            action, confidence = chat_manager.resolve_intent(speech, self.actions)
+            metrics.record("action.fallback", time.perf_counter() - start_time)
+
+            if not action or confidence < LLM_INTENT_MIN_CONFIDENCE:
+                self.unresolved.add(speech)
+                metrics.increment("action.fallback.unresolved")
+                print(f"LLM fallback found no action for: {speech}")
+                return
+
+            metrics.increment("action.fallback.resolved")
+            print(f"LLM fallback: \"{speech}\" -> {action['trigger']} ({confidence:.2f})")
+            self.resolved_intents.put((action, speech, commands_started))
+        except Exception as e:
+            self.logger.error(f"LLM intent fallback failed: {str(e)}")
+        finally:
+            self.fallback_lock.release()
+
+    def run_resolved_intents(self, chat_manager):
+        # called from the listener thread, which also starts every matched command
+        while True:
+            try:
+                action, speech, commands_started = self.resolved_intents.get_nowait()
+            except queue.Empty:
+                return
+            if commands_started != self.commands_started or self.is_transcribing or self.is_speaking:
+                metrics.increment("action.fallback.dropped")
+                print(f"Dropped LLM fallback for \"{speech}\", another command came first")
+                continue
+            if self.start_action(chat_manager, action, speech):
+                self.record_intent_evidence(action, speech)
+
+    def record_intent_evidence(self, action, speech):
+        # a phrasing is learned once the LLM keeps mapping it onto the same
+        # action; single words never are, find_exact_action would match them
+        # as the first word of any utterance
+        if len(speech.split()) < LLM_INTENT_LEARN_MIN_WORDS:
+            return
+        key = (speech, action['trigger'])
+        self.intent_evidence[key] = self.intent_evidence.get(key, 0) + 1
+        if self.intent_evidence[key] >= LLM_INTENT_LEARN_AFTER:
+            del self.intent_evidence[key]
+            self.learn_trigger(action, speech)
+
+    def find_exact_action(self, input_text):
+        # Check for exact match first (including variants)
+        for action in self.actions:
+            if input_text == action['trigger'] or input_text in action.get('trigger_variants', []):
+                return action
 
-        # Compute embeddings
-        input_embedding = self.model.encode([input_text])[0]
-        trigger_embeddings = self.model.encode(all_triggers)
-        
-        # Compute cosine similarities
+            if input_text.split(" ")[0] == action['trigger'] or input_text.split(" ")[0] in action.get('trigger_variants', []):
+                return action
+        return None
+
+    def score_triggers(self, input_texts):
+        # Compute embeddings for all the texts in one batch
+        input_embeddings = torch.tensor(self.model.encode(input_texts))
+
+        # Compute cosine similarities, one row per input text
         similarities = torch.nn.functional.cosine_similarity(
-            torch.tensor(input_embedding).unsqueeze(0),
-            torch.tensor(trigger_embeddings)
+            input_embeddings.unsqueeze(1),
+            self.trigger_embeddings.unsqueeze(0),
+            dim=-1
         )
-        
+
         # Adjust similarities based on fuzzy string matching and word order
-        for i, trigger in enumerate(all_triggers):
-            fuzzy_ratio = fuzz.ratio(input_text.lower(), trigger.lower()) / 100
-            word_order_ratio = fuzz.token_sort_ratio(input_text.lower(), trigger.lower()) / 100
-            similarities[i] = similarities[i] * 0.5 + fuzzy_ratio * 0.3 + word_order_ratio * 0.2
-        
+        for row, input_text in enumerate(input_texts):
+            for i, trigger in enumerate(self.all_triggers):
+                fuzzy_ratio = fuzz.ratio(input_text.lower(), trigger.lower()) / 100
+                word_order_ratio = fuzz.token_sort_ratio(input_text.lower(), trigger.lower()) / 100
+                similarities[row, i] = similarities[row, i] * 0.5 + fuzzy_ratio * 0.3 + word_order_ratio * 0.2
+
+        return similarities
+
+    def find_action(self, input_text, threshold=0.5): # get the closest trigger and action
+        with self.trigger_lock:
+            return self._find_action(input_text, threshold)
+
+    def _find_action(self, input_text, threshold):
+        action = self.find_exact_action(input_text)
+        if action:
+            return action['trigger'], action, 1.0
+
+        similarities = self.score_triggers([input_text])[0]
+
         # Get the index of the highest similarity
         best_match_index = similarities.argmax().item()
         best_match_similarity = similarities[best_match_index].item()
         
         # Return the best match and associated action if it's above the threshold, otherwise return None
         if best_match_similarity >= threshold:
-            best_trigger = all_triggers[best_match_index]
-            best_action = trigger_to_action[best_trigger]
+            best_trigger = self.all_triggers[best_match_index]
+            best_action = self.trigger_to_action[best_trigger]
             return best_trigger, best_action, best_match_similarity
         else:
             return None, None, 0.0
 
+    def find_action_nbest(self, hypotheses, threshold=0.5):
+        # hypotheses is the n-best list from the recognizer, best first:
+        # [{"text": ..., "confidence": ...}, ...] where confidence is in 0..1
+        with self.trigger_lock:
+            return self._find_action_nbest(hypotheses, threshold)
+
+    def _find_action_nbest(self, hypotheses, threshold):
+        hypotheses = [h for h in hypotheses if h.get("text")]
+        if not hypotheses:
+            return None, None, 0.0, None
+
+        texts = [h["text"] for h in hypotheses]
+        similarities = self.score_triggers(texts)
+
+        best = (None, None, 0.0, None)
+        best_joint = -1.0
+        for row, hypothesis in enumerate(hypotheses):
+            exact_action = self.find_exact_action(hypothesis["text"])
+            if exact_action:
+                trigger, action, match_score = exact_action['trigger'], exact_action, 1.0
+            else:
+                index = similarities[row].argmax().item()
+                trigger = self.all_triggers[index]
+                action = self.trigger_to_action[trigger]
+                match_score = similarities[row, index].item()
+
+            if match_score < threshold:
+                continue
+
+            confidence = hypothesis.get("confidence", 1.0)
+            joint_score = (1 - NBEST_CONFIDENCE_WEIGHT) * match_score + NBEST_CONFIDENCE_WEIGHT * confidence
+            if joint_score > best_joint:
+                best_joint = joint_score
+                best = (trigger, action, match_score, hypothesis["text"])
+
+        return best
+
     def check_trigger_words(self, speech, word_type):
         # Get the appropriate words based on the word_type
         if word_type == "stop_speaking":
@@ -161,6 +300,11 @@ class ActionHandler:
         else:
             return False, best_match_similarity
 
+    def check_end_of_transcription(self, speech):
+        end_words = self.action.get("end", {}).get("words", [])
+        speech = speech.lower().strip()
+        return any(speech.endswith(word.lower()) for word in end_words)
+
     def check_stop_speaking_trigger_words(self, speech):
         return self.check_trigger_words(speech, "stop_speaking")
 
@@ -183,7 +327,7 @@ class ActionHandler:
     # THE MEAT STARTS HERE!
     # This is where the speech is processed and the appropriate action is executed
 
-    def process_speech(self, chat_manager, speech):
+    def process_speech(self, chat_manager, speech, hypotheses=None):
         if isinstance(speech, bytes):
             speech = speech.decode('utf-8')
 
@@ -195,29 +339,34 @@ class ActionHandler:
             print(f"Processing Speech: {speech}")
             signal_manager.voice_update_last_speech_time.emit()
 
-            check_action, action, score = self.find_action(speech)
+            with metrics.timer("action.match"):
+                if hypotheses and len(hypotheses) > 1:
+                    check_action, action, score, matched_speech = self.find_action_nbest(hypotheses)
+                    if check_action and matched_speech != speech:
+                        print(f"Matched alternative hypothesis: {matched_speech} (best was: {speech})")
+                        speech = matched_speech
+                else:
+                    check_action, action, score = self.find_action(speech)
+            self.last_match = {"trigger": check_action, "text": speech, "score": score} if check_action else None
             if check_action:
-                self.previous_action = self.action
-                self.action = action
-
                 print(f"Found Action: {score} - (from: {speech})")
-                print(f"Action Config:\n{self.action}")
-
-                self.transcription_buffer = [speech]
-
-                signal_manager.voice_set_action.emit(self.action)
-
-                if self.action.get("transcribe", False):
-                    self.start_new_transcription()
-                else:
-                    print("EXECUTE ACTION")
-                    self.execute_action(chat_manager, speech)
+                self.start_action(chat_manager, action, speech, self.matched_words(hypotheses, speech))
             else:
+                metrics.increment("action.no_match")
                 print(f"No action found for: {speech}")
-                #todo: we need to try and detect if the user had any other intention
+                # ask the LLM what the user meant; the first miss of a phrasing
+                # pays for the call, after that it is a learned trigger variant
+                if (self.intent_fallback and chat_manager and speech.strip()
+                        and len(speech.split()) <= LLM_INTENT_MAX_WORDS and speech not in self.unresolved
+                        and self.fallback_lock.acquire(blocking=False)):
+                    threading.Thread(target=self.resolve_with_llm, args=(chat_manager, speech, self.commands_started),
+                                     daemon=True).start()
         else:
             if not self.is_speaking:
-                self.transcription_buffer.append(speech)           
+                self.transcription_buffer.append(speech)
+                if self.is_transcribing and chat_manager:
+                    # get the LLM going on the prompt while it is still being dictated
+                    chat_manager.speculate(self.action, self.transcription_buffer)
 
             # todo: 
             # use check_silence and detect if the sound is coming from the speaker or the user
@@ -225,6 +374,12 @@ class ActionHandler:
             # if the user continues to speak, 
             # 
             # stop the speaking, and restart transcription
+            if self.is_transcribing and self.check_end_of_transcription(speech):
+                # the end phrase closes the transcription, the listener trims it
+                # off the audio using the word timings
+                self.stop_transcribing(hypotheses)
+                return speech
+
             if self.is_transcribing:
                 # otherwise, Check for end trigger words, and start a new transcription
                 is_end, similarity = self.check_stop_speaking_trigger_words(speech)
@@ -237,9 +392,39 @@ class ActionHandler:
         return speech
       
 
-    def start_new_transcription(self):
+    def matched_words(self, hypotheses, text):
+        # word timings of the hypothesis that matched, the listener trims the trigger with them
+        for hypothesis in hypotheses or []:
+            if hypothesis["text"] == text and hypothesis.get("words"):
+                return hypothesis["words"]
+        return hypotheses[0].get("words", []) if hypotheses else []
+
+    def start_action(self, chat_manager, action, speech, words=None):
+        # a new command abandons the answer that is still generating
+        if chat_manager:
+            chat_manager.cancel_generation()
+
+        self.commands_started += 1
+        self.previous_action = self.action
+        self.action = action
+
+        print(f"Action Config:\n{self.action}")
+
+        self.transcription_buffer = [speech]
+
+        signal_manager.voice_set_action.emit(self.action)
+
+        if self.action.get("transcribe", False):
+            self.start_new_transcription(words)
+            return True
+
+        print("EXECUTE ACTION")
+        with metrics.timer("action.execute"):
+            return self.execute_action(chat_manager, speech)
+
+    def start_new_transcription(self, words=None):
         print("EMIT TO VOICE: START TRANSCRIPTION")
-        signal_manager.voice_start_transcribing.emit()
+        signal_manager.voice_start_transcribing.emit(words or [])
 
 
     def execute_action(self, chat_manager, speech):       
@@ -252,6 +437,7 @@ class ActionHandler:
                 module = importlib.import_module(f"distr.actions.{module_name}")
                 function = getattr(module, function_name)
                 function(chat_manager, self.action, {"text": speech, "transcription": self.transcription_buffer})
+                return True
             except ImportError as e:
                 self.logger.error(f"Error importing module {module_name}: {str(e)}")
             except AttributeError as e:
@@ -266,11 +452,12 @@ class ActionHandler:
         signal_manager.voice_stop_speaking.emit()
 
 
-    def stop_transcribing(self):
+    def stop_transcribing(self, hypotheses=None):
         self.is_transcribing = False
         print("EMIT TO VOICE: STOP TRANSCRIPTION")
         signal_manager.voice_set_transcription_buffer.emit(self.transcription_buffer)
-        signal_manager.voice_stop_transcribing.emit()
+        # the hypotheses travel with the signal, the listener may have heard more by the time it runs
+        signal_manager.voice_stop_transcribing.emit(hypotheses or [])
         print("Action Stop Transcription Executed")
 
     def cut_transcribing(self):
@@ -279,6 +466,7 @@ class ActionHandler:
         print("Action Cut Transcription Executed")
         self.transcription_buffer = []
         signal_manager.voice_set_transcription_buffer.emit(self.transcription_buffer)
+        signal_manager.voice_cut_transcribing.emit()
 
     def stop(self):
         self.is_running = False
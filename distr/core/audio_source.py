@@ -0,0 +1,182 @@
+"""
+Audio sources for the continuous listener.
+
+The listener only needs something that hands it 16 kHz / 16-bit mono chunks:
+- PyAudioSource: the live microphone (the default)
+- FileAudioSource: replays a WAV (or FLAC, if soundfile is installed)
+  recording, in real time or faster
+- SyntheticAudioSource: generated silence, tones or noise
+
+File and synthetic sources return b'' once they are exhausted, which ends the
+listener's run loop, so the whole voice pipeline can run without a microphone.
+"""
+from abc import ABC, abstractmethod
+import numpy as np
+import pyaudio
+import wave
+import time
+import os
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+class AudioSource(ABC):
+    sample_rate = SAMPLE_RATE
+    is_live = False
+
+    def open(self):
+        pass
+
+    @abstractmethod
+    def read(self, frames):
+        """Returns up to `frames` frames of 16-bit mono audio, b'' once exhausted."""
+
+    def is_active(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class PyAudioSource(AudioSource):
+    is_live = True
+
+    def __init__(self, frames_per_buffer=1024, input_device_index=None):
+        self.frames_per_buffer = frames_per_buffer
+        self.input_device_index = input_device_index
+        self.audio = None
+        self.stream = None
+
+    def open(self):
+        self.close()
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=self.sample_rate,
+            input=True,
+            frames_per_buffer=self.frames_per_buffer,
+            input_device_index=self.input_device_index
+        )
+
+    def read(self, frames):
+        return self.stream.read(frames, exception_on_overflow=False)
+
+    def is_active(self):
+        return self.stream is not None and self.stream.is_active()
+
+    def close(self):
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.audio:
+            self.audio.terminate()
+            self.audio = None
+
+
+class PacedAudioSource(AudioSource):
+    """
+    Base for sources that serve pre-computed samples. `speed` paces delivery:
+    1.0 is real time, 4.0 four times faster, 0 as fast as possible.
+    """
+    # trailing silence so the recognizer finalises the last utterance
+    tail_seconds = 1.0
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.samples = np.zeros(0, dtype=np.int16)
+        self.position = 0
+        self.start_time = None
+
+    @abstractmethod
+    def load(self):
+        """Returns the int16 samples to serve."""
+
+    def open(self):
+        samples = self.load()
+        tail = np.zeros(int(self.tail_seconds * self.sample_rate), dtype=np.int16)
+        self.samples = np.concatenate([samples, tail])
+        self.position = 0
+        self.start_time = time.perf_counter()
+
+    def read(self, frames):
+        if self.position >= len(self.samples):
+            return b''
+
+        chunk = self.samples[self.position:self.position + frames]
+        self.position += len(chunk)
+
+        if self.speed > 0:
+            due_time = self.start_time + self.position / self.sample_rate / self.speed
+            delay = due_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        return chunk.tobytes()
+
+    def is_active(self):
+        return self.start_time is not None
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+
+class FileAudioSource(PacedAudioSource):
+    def __init__(self, path, speed=1.0):
+        super().__init__(speed)
+        self.path = path
+
+    def load(self):
+        extension = os.path.splitext(self.path)[1].lower()
+        if extension == ".flac":
+            try:
+                import soundfile
+            except ImportError:
+                raise RuntimeError("FLAC replay needs the 'soundfile' package")
+            data, rate = soundfile.read(self.path, dtype="float32", always_2d=True)
+            samples = data.mean(axis=1)
+        else:
+            with wave.open(self.path, "rb") as wf:
+                rate = wf.getframerate()
+                channels = wf.getnchannels()
+                if wf.getsampwidth() != SAMPLE_WIDTH:
+                    raise RuntimeError(f"Only 16-bit WAV files are supported: {self.path}")
+                raw = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+            samples = raw.reshape(-1, channels).mean(axis=1) / 32768.0
+
+        return to_pcm16(resample(samples, rate, self.sample_rate))
+
+
+class SyntheticAudioSource(PacedAudioSource):
+    def __init__(self, duration=5.0, kind="silence", frequency=440.0, amplitude=0.1, speed=1.0, seed=0):
+        super().__init__(speed)
+        self.kind = kind
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.seed = seed
+        self.length = int(duration * self.sample_rate)
+
+    def load(self):
+        if self.kind == "tone":
+            t = np.arange(self.length) / self.sample_rate
+            samples = self.amplitude * np.sin(2 * np.pi * self.frequency * t)
+        elif self.kind == "noise":
+            samples = self.amplitude * np.random.default_rng(self.seed).standard_normal(self.length)
+        else:
+            samples = np.zeros(self.length)
+        return to_pcm16(samples)
+
+
+def resample(samples, source_rate, target_rate):
+    if source_rate == target_rate or len(samples) == 0:
+        return samples
+    length = int(round(len(samples) * target_rate / source_rate))
+    positions = np.linspace(0, len(samples) - 1, length)
+    return np.interp(positions, np.arange(len(samples)), samples)
+
+
+def to_pcm16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
@@ -0,0 +1,325 @@
+"""
+Shared, pooled clients for the model backends.
+
+Every caller gets the same client for a host, so connections to Ollama are
+kept alive between calls and a request doesn't pay for TCP/HTTP setup.
+Calls that fail to connect, or that the backend turns away as overloaded,
+are retried a bounded number of times with exponential backoff.
+
+Requests to one backend go through a scheduler with two priority classes:
+interactive requests (what the user is waiting for) and background ones
+(summaries, speculative prefill, loading the model). It caps how many run at
+once, queued interactive requests always go first, and background work is
+held to fewer slots so it can never crowd out the user. A streamed call holds
+its slot until the stream is exhausted or closed. The time spent queued is
+recorded per class as llm.queue_wait.<class>.
+
+A streamed call can be closed from any thread. Closing shuts down the socket
+under the thread reading it, even while it is still waiting for the first
+token. Ollama then sees the client go away, stops evaluating the prompt and
+frees the model at once.
+
+    client = get_backend()
+    client.chat(model=OLLAMA_MODEL, messages=messages, stream=True)
+    client.generate(model=OLLAMA_MODEL, prompt=prompt, priority=BACKGROUND)
+"""
+from distr.core.constants import (BACKEND_MAX_CONNECTIONS, BACKEND_KEEPALIVE_SECONDS, BACKEND_CONNECT_TIMEOUT,
+                                  BACKEND_READ_TIMEOUT, BACKEND_RETRIES, BACKEND_RETRY_BACKOFF, BACKEND_RETRY_STATUS,
+                                  BACKEND_MAX_CONCURRENCY, BACKEND_BACKGROUND_MAX_IN_FLIGHT)
+from distr.core.metrics import metrics
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ollama import Client
+import threading
+import requests
+import logging
+import itertools
+import httpcore
+import socket
+import httpx
+import heapq
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "http://127.0.0.1:11434"
+
+# request priority classes, lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_backends = {}
+_backends_lock = threading.Lock()
+_http_session = None
+
+# the Stream being read on this thread, if any
+_reading = threading.local()
+
+
+def is_retryable(error):
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, ConnectionError)):
+        return True
+    # ollama.ResponseError carries the HTTP status
+    return getattr(error, "status_code", None) in BACKEND_RETRY_STATUS
+
+
+class Scheduler:
+    """Hands out a backend's in-flight slots, interactive requests first."""
+    def __init__(self, max_in_flight=BACKEND_MAX_CONCURRENCY, background_max_in_flight=BACKEND_BACKGROUND_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.limits = {INTERACTIVE: max_in_flight, BACKGROUND: min(background_max_in_flight, max_in_flight)}
+        self.condition = threading.Condition()
+        self.waiting = []  # heap of (priority, sequence)
+        self.sequence = itertools.count()
+        self.in_flight = {INTERACTIVE: 0, BACKGROUND: 0}
+
+    def can_start(self, priority, sequence):
+        # callers hold self.condition
+        if not self.waiting or self.waiting[0] != (priority, sequence):
+            return False
+        return (sum(self.in_flight.values()) < self.max_in_flight
+                and self.in_flight[priority] < self.limits[priority])
+
+    def acquire(self, priority=INTERACTIVE):
+        start_time = time.perf_counter()
+        name = PRIORITY_NAMES[priority]
+        with self.condition:
+            entry = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, entry)
+            self.record_depths()
+            while not self.can_start(*entry):
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.in_flight[priority] += 1
+            self.record_depths()
+            # the next in line may be able to start too
+            self.condition.notify_all()
+        metrics.record(f"llm.queue_wait.{name}", time.perf_counter() - start_time)
+        return Slot(self, priority)
+
+    def release(self, priority):
+        with self.condition:
+            self.in_flight[priority] -= 1
+            self.condition.notify_all()
+
+    def record_depths(self):
+        # callers hold self.condition
+        for priority, name in PRIORITY_NAMES.items():
+            metrics.gauge(f"llm.queue_depth.{name}", sum(1 for entry in self.waiting if entry[0] == priority))
+
+
+class WatchedStream(httpcore.NetworkStream):
+    # a socket that tells the Stream reading it which connection it is on, so
+    # the Stream can shut it down from another thread
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, max_bytes, timeout=None):
+        with Watch(self):
+            return self.stream.read(max_bytes, timeout)
+
+    def write(self, buffer, timeout=None):
+        with Watch(self):
+            self.stream.write(buffer, timeout)
+
+    def close(self):
+        self.stream.close()
+
+    def start_tls(self, *args, **kwargs):
+        return WatchedStream(self.stream.start_tls(*args, **kwargs))
+
+    def get_extra_info(self, info):
+        return self.stream.get_extra_info(info)
+
+    def shutdown(self):
+        sock = self.stream.get_extra_info("socket")
+        try:
+            # unlike close(), this wakes up a recv() blocked on another thread
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, AttributeError):
+            pass
+
+
+class Watch:
+    # attaches a socket to the Stream read on this thread for one read or write
+    def __init__(self, network_stream):
+        self.network_stream = network_stream
+        self.owner = getattr(_reading, "stream", None)
+
+    def __enter__(self):
+        if self.owner is not None:
+            self.owner.attach(self.network_stream)
+
+    def __exit__(self, *exc):
+        if self.owner is not None:
+            self.owner.detach()
+        return False
+
+
+class WatchedBackend(httpcore.SyncBackend):
+    def connect_tcp(self, *args, **kwargs):
+        return WatchedStream(super().connect_tcp(*args, **kwargs))
+
+    def connect_unix_socket(self, *args, **kwargs):
+        return WatchedStream(super().connect_unix_socket(*args, **kwargs))
+
+
+class Stream:
+    """The parts of a streamed call. close() may be called from any thread."""
+    def __init__(self, parts):
+        self.lock = threading.Lock()
+        self.closed = False
+        self.network_stream = None  # only set while a read or write is in progress
+        self.parts = parts(self)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        _reading.stream = self
+        try:
+            return next(self.parts)
+        finally:
+            _reading.stream = None
+
+    def attach(self, network_stream):
+        with self.lock:
+            self.network_stream = network_stream
+            closed = self.closed
+        if closed:
+            network_stream.shutdown()
+
+    def detach(self):
+        with self.lock:
+            self.network_stream = None
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            network_stream = self.network_stream
+        if network_stream is not None:
+            network_stream.shutdown()
+        try:
+            self.parts.close()
+        except ValueError:
+            # being read on another thread, which now fails and cleans up
+            pass
+
+
+class BackendClient:
+    def __init__(self, host=None, max_connections=BACKEND_MAX_CONNECTIONS, max_concurrency=BACKEND_MAX_CONCURRENCY,
+                 retries=BACKEND_RETRIES, backoff=BACKEND_RETRY_BACKOFF):
+        self.host = host or os.environ.get("OLLAMA_HOST") or DEFAULT_HOST
+        self.retries = retries
+        self.backoff = backoff
+        self.scheduler = Scheduler(max_concurrency)
+
+        transport = httpx.HTTPTransport(limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=BACKEND_KEEPALIVE_SECONDS
+        ))
+        # httpx has no option for the network backend, so streams can be shut down
+        transport._pool._network_backend = WatchedBackend()
+        self.client = Client(
+            host=self.host,
+            timeout=httpx.Timeout(BACKEND_READ_TIMEOUT, connect=BACKEND_CONNECT_TIMEOUT),
+            transport=transport
+        )
+
+    def chat(self, *args, **kwargs):
+        return self.call("chat", *args, **kwargs)
+
+    def generate(self, *args, **kwargs):
+        return self.call("generate", *args, **kwargs)
+
+    def ps(self, priority=INTERACTIVE):
+        return self.call("ps", priority=priority)
+
+    def list(self, priority=INTERACTIVE):
+        return self.call("list", priority=priority)
+
+    def call(self, method, *args, priority=INTERACTIVE, **kwargs):
+        if kwargs.get("stream"):
+            return self.stream(method, *args, priority=priority, **kwargs)
+        with self.scheduler.acquire(priority):
+            return self.with_retries(method, lambda: getattr(self.client, method)(*args, **kwargs))
+
+    def stream(self, method, *args, priority=INTERACTIVE, **kwargs):
+        return Stream(lambda owner: self.stream_parts(owner, method, *args, priority=priority, **kwargs))
+
+    def stream_parts(self, owner, method, *args, priority=INTERACTIVE, **kwargs):
+        # the request is only sent when the first part is read, so retrying
+        # the first read retries the whole request
+        with self.scheduler.acquire(priority):
+            if owner.closed:
+                return
+
+            def start():
+                parts = getattr(self.client, method)(*args, **kwargs)
+                return parts, next(parts, None)
+
+            parts, first = self.with_retries(method, start, owner)
+            if first is None:
+                return
+            try:
+                yield first
+                yield from parts
+            finally:
+                parts.close()
+
+    def with_retries(self, method, request, owner=None):
+        for attempt in range(self.retries + 1):
+            try:
+                return request()
+            except Exception as e:
+                if attempt == self.retries or not is_retryable(e) or (owner is not None and owner.closed):
+                    raise
+                delay = self.backoff * 2 ** attempt
+                metrics.increment("llm.backend.retries")
+                logger.warning(f"{method} on {self.host} failed ({str(e) or type(e).__name__}), "
+                               f"retrying in {delay:.1f} s")
+                time.sleep(delay)
+
+    def close(self):
+        self.client._client.close()
+
+
+class Slot:
+    # releases a backend slot when the block (or a closed stream) exits
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.scheduler.release(self.priority)
+        return False
+
+
+def get_backend(host=None):
+    """The shared client for host (OLLAMA_HOST or the local Ollama by default)."""
+    host = host or os.environ.get("OLLAMA_HOST") or DEFAULT_HOST
+    with _backends_lock:
+        if host not in _backends:
+            _backends[host] = BackendClient(host)
+        return _backends[host]
+
+
+def http_session():
+    """A shared requests session with pooled connections and retries, for plain HTTP calls."""
+    global _http_session
+    with _backends_lock:
+        if _http_session is None:
+            retry = Retry(total=BACKEND_RETRIES, backoff_factor=BACKEND_RETRY_BACKOFF,
+                          status_forcelist=BACKEND_RETRY_STATUS, allowed_methods=["GET", "HEAD"])
+            adapter = HTTPAdapter(pool_connections=BACKEND_MAX_CONNECTIONS, pool_maxsize=BACKEND_MAX_CONNECTIONS,
+                                  max_retries=retry)
+            _http_session = requests.Session()
+            _http_session.mount("http://", adapter)
+            _http_session.mount("https://", adapter)
+        return _http_session
@@ -0,0 +1,134 @@
+"""
+Batch rendering of speech across a pool of worker processes.
+
+Every worker loads its own copy of the TTS engine once and then renders jobs
+from the shared queue, so rendering samples for 100+ speakers (or a phrase
+bank for every voice) uses all cores. The number of workers is capped by the
+memory each engine copy needs, outputs that already exist are skipped so an
+interrupted batch can be resumed, and throughput is printed as it goes.
+"""
+from distr.core.tts_engines import ENGINES, select_engine, available_memory_mb
+from distr.core.constants import BATCH_RENDER_MEMORY_FRACTION
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import tempfile
+import shutil
+import time
+import os
+
+# the engine loaded in this worker process
+_engine = None
+
+
+def _init_worker(engine_name):
+    global _engine
+    _engine = {engine.name: engine for engine in ENGINES}[engine_name]()
+    _engine.load()
+
+
+def _render(job):
+    key, text, speaker, output_path = job
+    start_time = time.perf_counter()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        _engine.synthesize_to_file(text, tmp_path, speaker)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return key, time.perf_counter() - start_time
+
+
+class BatchRenderer:
+    def __init__(self, engine_name=None, workers=None, memory_cap_mb=None):
+        self.engine_name = engine_name or select_engine().name
+        engine = {engine.name: engine for engine in ENGINES}[self.engine_name]
+
+        if memory_cap_mb is None:
+            memory_cap_mb = available_memory_mb() * BATCH_RENDER_MEMORY_FRACTION
+        max_workers = max(1, int(memory_cap_mb // engine.min_ram_mb))
+        self.workers = min(workers or os.cpu_count() or 1, max_workers)
+        self.memory_cap_mb = memory_cap_mb
+
+    def render(self, jobs, unit="items", on_result=None):
+        """
+        jobs is a list of (key, text, speaker, output_path). Jobs whose output
+        already exists are skipped. on_result(key, output_path) is called in
+        this process as each job finishes.
+        """
+        todo = [job for job in jobs if not os.path.exists(job[3])]
+        skipped = len(jobs) - len(todo)
+        if skipped:
+            print(f"Skipping {skipped} {unit} that are already rendered")
+        if not todo:
+            return {"rendered": 0, "skipped": skipped, "failed": 0, "per_minute": 0.0}
+
+        for job in todo:
+            os.makedirs(os.path.dirname(job[3]) or ".", exist_ok=True)
+
+        print(f"Rendering {len(todo)} {unit} with {self.workers} {self.engine_name} workers "
+              f"(memory cap {self.memory_cap_mb:.0f} MB)")
+        start_time = time.perf_counter()
+        rendered = 0
+        failed = 0
+
+        # spawn, so the workers don't inherit a forked torch/ONNX runtime
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.engine_name,)) as pool:
+            futures = {pool.submit(_render, job): job for job in todo}
+            for future in as_completed(futures):
+                key, _, _, output_path = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed to render {key}: {str(e)}")
+                    continue
+
+                rendered += 1
+                per_minute = rendered / (time.perf_counter() - start_time) * 60
+                print(f"[{rendered}/{len(todo)}] {key} ({per_minute:.1f} {unit}/min)")
+                if on_result:
+                    on_result(key, output_path)
+
+        elapsed = time.perf_counter() - start_time
+        per_minute = rendered / elapsed * 60 if elapsed else 0.0
+        print(f"Rendered {rendered} {unit} in {elapsed:.1f} s ({per_minute:.1f} {unit}/min), {failed} failed")
+        return {"rendered": rendered, "skipped": skipped, "failed": failed, "per_minute": per_minute}
+
+
+def prerender_phrase_banks(speakers=None, renderer=None, phrases=None):
+    """
+    Renders the system phrases for every voice straight into the TTS cache,
+    so switching voices in the settings never waits for the phrase bank.
+    """
+    from distr.core.phrases import SYSTEM_PHRASES
+    from distr.core.tts_cache import TTSCache
+
+    renderer = renderer or BatchRenderer()
+    engine = {engine.name: engine for engine in ENGINES}[renderer.engine_name]
+    phrases = phrases or SYSTEM_PHRASES
+    if speakers is None:
+        speakers = [engine.default_speaker]
+
+    cache = TTSCache()
+    staging_dir = tempfile.mkdtemp(prefix="phrase_banks_")
+    jobs = []
+    texts = {}
+    for speaker in speakers:
+        for text in phrases.values():
+            key = cache.make_key(text, speaker, engine.model_name, 1.0)
+            if key in cache.entries:
+                continue  # already in the cache
+            texts[key] = text
+            jobs.append((key, text, speaker, os.path.join(staging_dir, f"{key}.wav")))
+
+    def store(key, output_path):
+        cache.store(key, lambda path: shutil.move(output_path, path), texts[key])
+
+    try:
+        return renderer.render(jobs, unit="phrases", on_result=store)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
@@ -8,16 +8,90 @@ import os
 from datetime import datetime
 from sqlalchemy.orm.exc import NoResultFound
 from distr.core.db import get_session, Chat
-from distr.core.constants import CORRECTIONS
+from distr.core.constants import CORRECTIONS, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, LLM_HISTORY_TOKEN_BUDGET, LLM_SUMMARY_MAX_TOKENS
+from distr.core.constants import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_HOURS
+from distr.core.constants import LLM_SPECULATIVE_PREFILL, LLM_PREFILL_MIN_CHARS, LLM_PREFILL_SKIP_METHODS
+from distr.core.signals import signal_manager
+from distr.core.history import ConversationHistory, estimate_tokens
+from distr.core.response_cache import ResponseCache
+from distr.core.intents import FastPathRouter
+from distr.core.utils import load_preferences_config
+from distr.core.metrics import metrics
+from distr.core.phrases import phrase
 from difflib import SequenceMatcher
+from distr.core.backend import get_backend, BACKGROUND
 from langchain_community.llms import Ollama
-from ollama import Client
+import threading
+import logging
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Generation:
+    """
+    One in-flight LLM generation that can be abandoned from any thread.
+
+    Ollama's response is read on a background thread and handed over through a
+    queue, so cancel() releases the consumer straight away. cancel() also
+    closes the stream, which shuts down the connection under the reader even
+    while Ollama is still evaluating the prompt, so Ollama stops and frees the
+    model for the next request.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = queue.Queue()
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.error = None
+        self.stats = None  # the final part, with Ollama's timings
+        threading.Thread(target=self.read, daemon=True).start()
+
+    def read(self):
+        try:
+            for part in self.stream:
+                if self.cancelled.is_set():
+                    break
+                if part.get('done'):
+                    self.stats = part
+                self.parts.put(part)
+        except Exception as e:
+            self.error = e
+        finally:
+            close = getattr(self.stream, "close", None)
+            if close:
+                close()
+            self.parts.put(None)
+            self.finished.set()
+
+    def cancel(self):
+        if self.finished.is_set() or self.cancelled.is_set():
+            return False
+        self.cancelled.set()
+        self.parts.put(None)
+        close = getattr(self.stream, "close", None)
+        if close:
+            close()
+        return True
+
+    def __iter__(self):
+        while True:
+            part = self.parts.get()
+            if part is None or self.cancelled.is_set():
+                break
+            yield part
+        if self.error and not self.cancelled.is_set():
+            raise self.error
 
 
 class ChatManager(QObject):
     chat_updated = pyqtSignal(int)  # Signal to emit when a chat is updated
     chat_created = pyqtSignal(int)  # New signal
     chat_deleted = pyqtSignal(int)  # New signal
+    response_started = pyqtSignal(str)  # the prompt, a streamed response follows
+    response_token = pyqtSignal(str)
+    response_finished = pyqtSignal(str)  # the full response
     
     def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
         super().__init__()
@@ -30,8 +104,39 @@ class ChatManager(QObject):
             print("Falling back to default model: 'sentence-transformers/all-MiniLM-L6-v2'")
             self.sbert_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
 
-        # Initialize Ollama
-        self.client = Client()
+        # Initialize Ollama (the shared, pooled client)
+        self.client = get_backend()
+        preferences = load_preferences_config()
+        self.keep_alive = preferences.get("ollama_keep_alive", OLLAMA_KEEP_ALIVE)
+
+        # the model is kept loaded while listening is on, and released when it stops
+        self.model_resident = False
+        self.model_wanted = False
+        self.residency_lock = threading.Lock()
+        signal_manager.voice_set_is_listening.connect(self.set_model_resident)
+
+        # the generation in flight; "stop" or a new command abandons it
+        self.generation = None
+        self.generation_lock = threading.Lock()
+        self.abandoned_generations = 0
+        signal_manager.voice_stop_speaking.connect(self.cancel_generation)
+
+        # speculative prefill of the prompt that is still being dictated
+        self.speculative_prefill = preferences.get("speculative_prefill", LLM_SPECULATIVE_PREFILL)
+        self.prefill_lock = threading.Lock()
+        self.speculation = None
+
+        # trivial intents are answered without the model
+        self.router = FastPathRouter() if preferences.get("fast_path", True) else None
+
+        self.response_cache = None
+        if preferences.get("semantic_cache", False):
+            self.response_cache = ResponseCache(
+                lambda text: self.sbert_model.encode(text, normalize_embeddings=True),
+                OLLAMA_MODEL,
+                threshold=preferences.get("semantic_cache_threshold", SEMANTIC_CACHE_THRESHOLD),
+                ttl_hours=preferences.get("semantic_cache_ttl_hours", SEMANTIC_CACHE_TTL_HOURS)
+            )
         
         # Set up the agent's profile prompt
         self.agent_prompt = """
@@ -52,10 +157,12 @@ class ChatManager(QObject):
         to the best of your abilities.
         """    
         
-        # Initialize conversation history with the agent prompt
-        self.conversation_history = [
-            {"role": "system", "content": self.agent_prompt}
-        ]
+        # Initialize conversation history with the agent prompt pinned at the start
+        self.history = ConversationHistory(
+            self.agent_prompt,
+            summarize=self.summarize_history,
+            token_budget=preferences.get("history_token_budget", LLM_HISTORY_TOKEN_BUDGET)
+        )
 
         # Load trigger words
         with open(os.path.join(os.path.dirname(__file__), 'actions.config.json'), 'r') as f:
@@ -75,6 +182,38 @@ class ChatManager(QObject):
         else:
             return None, 0.0
 
+    def resolve_intent(self, utterance: str, actions: List[dict]) -> tuple:
+        """
+        Asks the LLM which of the configured actions the utterance meant.
+        Returns (action, confidence), or (None, 0.0) if none fits.
+        """
+        commands = "\n".join(
+            f"- {action['trigger']}" + (f" (also: {', '.join(action['trigger_variants'][:4])})"
+                                        if action.get('trigger_variants') else "")
+            for action in actions
+        )
+        # the command list comes first and stays the same, so Ollama can keep it cached
+        prompt = (
+            "You map what a user said to a voice assistant onto one of its commands.\n"
+            f"Commands:\n{commands}\n\n"
+            'Reply with JSON only: {"command": "<command exactly as listed, or none>", "confidence": <0 to 1>}\n\n'
+            f"The user said: \"{utterance}\""
+        )
+        response = self.client.generate(model=OLLAMA_MODEL, prompt=prompt, format="json",
+                                        options={"temperature": 0, "num_predict": 48}, keep_alive=self.keep_alive)
+        try:
+            answer = json.loads(response['response'])
+            command = str(answer.get("command", "")).strip().lower()
+            confidence = float(answer.get("confidence", 0.0))
+        except (ValueError, TypeError, AttributeError):
+            logger.warning(f"Could not parse the intent answer: {response['response']!r}")
+            return None, 0.0
+
+        for action in actions:
+            if command == action['trigger'].lower():
+                return action, confidence
+        return None, 0.0
+
     def refine_prompt(self, action: dict, trigger_sentences: List[str], transcription: str, end_words: List[str]) -> str:
         print("PROMPT TEMPLATE...")
         print(f"Trigger sentences: {trigger_sentences}")
@@ -108,16 +247,19 @@ class ChatManager(QObject):
         refined_content = " ".join(refined_content)
 
         # Remove the end phrase if present
-        for end_word in end_words:
-            end_index = refined_content.lower().rfind(end_word.lower())
-            if end_index != -1:
-                refined_content = refined_content[:end_index].strip()
-                break
+        refined_content = self.strip_end_words(refined_content, end_words)
 
         print(f"Refined content: {refined_content}")
         
         return refined_content if refined_content else "<unrecognised>"
 
+    def strip_end_words(self, content: str, end_words: List[str]) -> str:
+        for end_word in end_words:
+            end_index = content.lower().rfind(end_word.lower())
+            if end_index != -1:
+                return content[:end_index].strip()
+        return content
+
     def apply_corrections(self, phrase):
         words = phrase.split()
         corrected_words = [CORRECTIONS.get(word.lower(), word) for word in words]
@@ -147,7 +289,7 @@ class ChatManager(QObject):
             self.chat_updated.emit(0)  # Emit signal with a dummy chat ID
             return f"Processed: {refined_content}"
         else:
-            return "I'm sorry, I couldn't understand that. Could you please rephrase?"
+            return phrase("unrecognised")
 
     def is_recognised(self, action:dict, input_text: str) -> bool:
         return self.refine_prompt(action, [input_text], input_text, []) != "<unrecognised>"
@@ -181,33 +323,267 @@ class ChatManager(QObject):
         finally:
             session.close()
 
+    def local_response(self, prompt):
+        # answers a prompt with a fast-path intent or from the semantic cache,
+        # as if the model had said it
+        ai_response = self.router.route(prompt) if self.router else None
+        if ai_response is None and self.response_cache:
+            ai_response = self.response_cache.lookup(prompt)
+        if ai_response is not None:
+            self.speculation = None
+            self.history.add("user", prompt)
+            self.remember_response(ai_response)
+        return ai_response
+
+    def speculate(self, action, transcription_buffer):
+        """
+        Called as the dictated prompt of an LLM action grows; prefills Ollama's
+        KV cache with the conversation and the partial prompt.
+        """
+        if not self.speculative_prefill or not action.get("method", "").startswith("transcribe."):
+            return
+        if action.get("params", {}).get("method") in LLM_PREFILL_SKIP_METHODS:
+            return
+
+        text = " ".join(transcription_buffer).strip()
+        if not action.get("keep_trigger", False):
+            triggers = sorted([action["trigger"]] + action.get("trigger_variants", []), key=len, reverse=True)
+            trigger = next((trigger for trigger in triggers if text.lower().startswith(trigger.lower())), None)
+            if trigger:
+                text = text[len(trigger):].strip()
+        text = self.strip_end_words(text, action.get("end", {}).get("words", []))
+        # Whisper capitalises the start of the prompt, keep the prefix the same
+        self.prefill(text[:1].upper() + text[1:])
+
+    def prefill(self, text):
+        if len(text) < LLM_PREFILL_MIN_CHARS or (self.speculation and self.speculation["text"] == text):
+            return
+        # one at a time; a newer partial prompt simply waits for the next one
+        if not self.prefill_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self.run_prefill, args=(text,), daemon=True).start()
+
+    def run_prefill(self, text):
+        try:
+            messages = self.history.messages() + [{"role": "user", "content": text}]
+            start_time = time.perf_counter()
+            response = self.client.chat(model=OLLAMA_MODEL, messages=messages, options={"num_predict": 1},
+                                        keep_alive=self.keep_alive, priority=BACKGROUND)
+            metrics.record("llm.prefill.speculative", time.perf_counter() - start_time)
+
+            speculation = self.speculation or {"calls": 0, "eval_count": 0, "eval_seconds": 0.0}
+            self.speculation = {
+                "text": text,
+                "calls": speculation["calls"] + 1,
+                "eval_count": speculation["eval_count"] + (response.get('prompt_eval_count') or 0),
+                "eval_seconds": speculation["eval_seconds"] + (response.get('prompt_eval_duration') or 0) / 1e9,
+            }
+        except Exception as e:
+            logger.warning(f"Speculative prefill failed: {str(e)}")
+        finally:
+            self.prefill_lock.release()
+
+    def record_prefill_savings(self, prompt, stats):
+        # the part of the final prompt that speculation had already processed
+        speculation, self.speculation = self.speculation, None
+        if not speculation or not stats:
+            return
+        eval_count = stats.get('prompt_eval_count') or 0
+        eval_seconds = (stats.get('prompt_eval_duration') or 0) / 1e9
+        metrics.record("llm.prompt_eval", eval_seconds)
+
+        if eval_count:
+            seconds_per_token = eval_seconds / eval_count
+        elif speculation["eval_count"]:
+            seconds_per_token = speculation["eval_seconds"] / speculation["eval_count"]
+        else:
+            return
+        # Ollama only counts the tokens it had to process, so what speculation
+        # processed is saved, except for the tail where the partial prompt and
+        # the final one differ
+        common = os.path.commonprefix([speculation["text"], prompt])
+        wasted_tokens = estimate_tokens(speculation["text"][len(common):]) if len(common) < len(speculation["text"]) else 0
+        reused_tokens = max(0, speculation["eval_count"] - wasted_tokens)
+        saved = reused_tokens * seconds_per_token
+        metrics.record("llm.prefill.saved", saved)
+        logger.info(f"Speculative prefill ({speculation['calls']} calls) covered ~{reused_tokens} prompt tokens, "
+                    f"saved ~{saved * 1000:.0f} ms; the final prompt eval took {eval_seconds * 1000:.0f} ms")
+
+    def start_generation(self, messages):
+        generation = Generation(self.client.chat(model=OLLAMA_MODEL, messages=messages, stream=True,
+                                                 keep_alive=self.keep_alive))
+        with self.generation_lock:
+            previous, self.generation = self.generation, generation
+        if previous:
+            self.abandon(previous)
+        return generation
+
+    def cancel_generation(self):
+        with self.generation_lock:
+            generation, self.generation = self.generation, None
+        if generation:
+            self.abandon(generation)
+
+    def abandon(self, generation):
+        if generation.cancel():
+            self.abandoned_generations += 1
+            metrics.increment("llm.generations.abandoned")
+            logger.info(f"LLM generation abandoned ({self.abandoned_generations} so far)")
+
+    def finish_generation(self, generation):
+        with self.generation_lock:
+            if self.generation is generation:
+                self.generation = None
+
     # Add this new method
     def process_prompt(self, prompt):
+        ai_response = self.local_response(prompt)
+        if ai_response is not None:
+            return {"message": {"role": "assistant", "content": ai_response}, "local": True}
+
         # Add user input to conversation history
-        self.conversation_history.append({"role": "user", "content": prompt})
+        self.history.add("user", prompt)
 
         # Create the messages list with conversation history
-        messages = self.conversation_history.copy()
+        messages = self.history.messages()
+
+        # Generate response using the Ollama model; streamed, so it can be abandoned
+        generation = self.start_generation(messages)
+        try:
+            ai_response = "".join(part['message']['content'] for part in generation)
+        finally:
+            self.finish_generation(generation)
+
+        self.remember_response(ai_response)
+        self.record_prefill_savings(prompt, generation.stats)
+        cancelled = generation.cancelled.is_set()
+        if self.response_cache and not cancelled:
+            self.response_cache.store(prompt, ai_response)
+
+        return {"message": {"role": "assistant", "content": ai_response}, "cancelled": cancelled}
+
+    def stream_prompt(self, prompt):
+        """
+        Like process_prompt, but yields the response token by token as Ollama
+        generates it. The chat window follows along through response_token.
+        """
+        ai_response = self.local_response(prompt)
+        if ai_response is not None:
+            self.response_started.emit(prompt)
+            self.response_token.emit(ai_response)
+            self.response_finished.emit(ai_response)
+            yield ai_response
+            return
 
-        # Generate response using the Ollama model
-        response = self.client.chat(model="gemma2:latest",messages=messages)
+        self.history.add("user", prompt)
+        messages = self.history.messages()
 
-        ai_response = response['message']['content']
+        start_time = time.perf_counter()
+        tokens = []
+        completed = False
+        self.response_started.emit(prompt)
+        generation = self.start_generation(messages)
+        try:
+            for part in generation:
+                token = part['message']['content']
+                if not token:
+                    continue
+                if not tokens:
+                    metrics.record("llm.time_to_first_token", time.perf_counter() - start_time)
+                tokens.append(token)
+                self.response_token.emit(token)
+                yield token
+            completed = not generation.cancelled.is_set()
+        finally:
+            # also runs when the consumer stops early, keeping what was said
+            if not completed:
+                self.abandon(generation)
+            self.finish_generation(generation)
+            ai_response = "".join(tokens)
+            metrics.record("llm.response_time", time.perf_counter() - start_time)
+            self.remember_response(ai_response)
+            self.response_finished.emit(ai_response)
+            self.record_prefill_savings(prompt, generation.stats)
+            if completed and self.response_cache:
+                # only whole answers are worth repeating
+                self.response_cache.store(prompt, ai_response)
 
+    def remember_response(self, ai_response):
         # Add AI response to conversation history
-        self.conversation_history.append({"role": "assistant", "content": ai_response})
+        self.history.add("assistant", ai_response)
+
+    def summarize_history(self, previous_summary, turns):
+        # runs on the history's background thread, off the response path
+        conversation = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        prompt = (
+            "Summarise this conversation between a user and an assistant in a few sentences. "
+            "Keep names, facts, decisions and open questions, leave out pleasantries.\n\n"
+        )
+        if previous_summary:
+            prompt += f"Summary so far: {previous_summary}\n\n"
+        prompt += f"Conversation:\n{conversation}\n\nSummary:"
 
-        # Limit conversation history to last 10 exchanges (20 messages)
-        if len(self.conversation_history) > 20:
-            self.conversation_history = self.conversation_history[-20:]
+        response = self.client.generate(
+            model=OLLAMA_MODEL,
+            prompt=prompt,
+            options={"num_predict": LLM_SUMMARY_MAX_TOKENS},
+            keep_alive=self.keep_alive,
+            priority=BACKGROUND
+        )
+        return response['response']
+
+    def set_model_resident(self, resident):
+        # called from the GUI thread; loading and releasing happen in the background
+        if resident == self.model_wanted:
+            return
+        self.model_wanted = resident
+        threading.Thread(target=self.sync_model_residency, daemon=True).start()
+
+    def sync_model_residency(self):
+        with self.residency_lock:
+            wanted = self.model_wanted
+            if wanted == self.model_resident:
+                return
+            try:
+                if wanted:
+                    self.warm_up()
+                else:
+                    self.release_model()
+                self.model_resident = wanted
+            except Exception as e:
+                logger.error(f"Could not {'load' if wanted else 'release'} {OLLAMA_MODEL}: {str(e)}")
+
+    def warm_up(self):
+        try:
+            loaded = [model.get('name') or model.get('model')
+                      for model in self.client.ps(priority=BACKGROUND).get('models', [])]
+        except Exception:
+            loaded = []
+        if OLLAMA_MODEL in loaded:
+            logger.info(f"{OLLAMA_MODEL} is already loaded, keep_alive set to {self.keep_alive}")
+        else:
+            logger.info(f"Loading {OLLAMA_MODEL} in the background (keep_alive {self.keep_alive})")
 
-        return response
+        # an empty prompt only loads the model
+        start_time = time.perf_counter()
+        self.client.generate(model=OLLAMA_MODEL, prompt="", keep_alive=self.keep_alive, priority=BACKGROUND)
+        seconds = time.perf_counter() - start_time
+        metrics.record("llm.warm_up", seconds)
+        logger.info(f"{OLLAMA_MODEL} is loaded ({seconds:.1f} s)")
+
+    def release_model(self):
+        self.client.generate(model=OLLAMA_MODEL, prompt="", keep_alive=0, priority=BACKGROUND)
+        logger.info(f"Released {OLLAMA_MODEL}, listening is off")
 
     def set_tts_manager(self, tts_manager):
         self.tts_manager = tts_manager
 
-    def start_tts(self, text):
-        self.tts_manager.start_tts(text)
+    def start_tts(self, text, channel="response"):
+        # returns a TTSRequest straight away, synthesis runs on the TTS worker
+        return self.tts_manager.start_tts(text, channel)
+
+    def start_tts_stream(self, channel="response"):
+        return self.tts_manager.start_tts_stream(channel)
 
 def initialize_chat_manager():
     chat_manager = ChatManager()
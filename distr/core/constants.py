@@ -14,6 +14,131 @@ TMP_DIR = os.path.join(ASSETS_DIR, "tmp")
 
 DEFAULT_SILENCE_TIMER = 2
 
+# Number of n-best hypotheses requested from Vosk for every final result
+VOSK_MAX_ALTERNATIVES = 5
+# How much the ASR confidence of a hypothesis counts towards its joint score
+# when matching the n-best list against the action triggers (0 = ignore ASR)
+NBEST_CONFIDENCE_WEIGHT = 0.2
+
+# Seconds of recent microphone audio the listener keeps in memory
+AUDIO_BUFFER_SECONDS = 10
+
+# Commands whose best hypothesis is less confident than this get a second
+# pass through a small Whisper model (overridable in preferences.json).
+# A command is held back for it at most RESCORE_TIMEOUT_SECONDS.
+RESCORE_CONFIDENCE_THRESHOLD = 0.6
+RESCORE_AUDIO_SECONDS = 3
+RESCORE_WHISPER_MODEL = "tiny.en"
+RESCORE_TIMEOUT_SECONDS = 0.8
+
+# Speak responses sentence by sentence, starting playback of the first
+# sentence while the rest are still being synthesized
+TTS_PIPELINED = True
+TTS_FIRST_CHUNK_CHARS = 80
+TTS_MAX_CHUNK_CHARS = 250
+
+TTS_MODEL_NAME = "tts_models/en/vctk/vits"
+TTS_DEFAULT_SPEAKER = "p225"
+
+# The engine is picked by available RAM and its measured real-time factor
+# (synthesis time / audio duration, written by scripts/benchmark_tts.py)
+TTS_RTF_BUDGET = 0.5
+TTS_BENCHMARK_FILE = os.path.join(ASSETS_DIR, "cache", "tts_benchmark.json")
+PIPER_MODEL_PATH = os.path.join(MODELS_DIR, "piper", "en_US-lessac-medium.onnx")
+# the voice in PIPER_MODEL_PATH, which has a single speaker
+PIPER_DEFAULT_SPEAKER = "lessac"
+
+# Batch rendering runs one engine per worker process, using at most this
+# share of the available memory
+BATCH_RENDER_MEMORY_FRACTION = 0.75
+
+# Synthesized speech is cached on disk, least recently used entries are
+# evicted past the quota (overridable as tts_cache_quota_mb in preferences.json)
+TTS_CACHE_DIR = os.path.join(ASSETS_DIR, "cache", "tts")
+TTS_CACHE_QUOTA_MB = 200
+# cache hits only update the index in memory, it is written at most this often
+# (and on every store and at shutdown)
+TTS_CACHE_FLUSH_SECONDS = 30
+# temporary files younger than this may belong to another process still writing
+TTS_CACHE_TMP_GRACE_SECONDS = 600
+
+# Sounds play through one in-process output stream; a buffer of 256 frames
+# is ~6 ms, which bounds how long starting or stopping a sound takes
+OUTPUT_SAMPLE_RATE = 44100
+OUTPUT_BUFFER_FRAMES = 256
+DECODED_SOUNDS_CACHE_SIZE = 16
+# Volume of a sound while a higher priority one plays over it (speech under
+# an alert, a UI sound under speech)
+SPEECH_DUCK_GAIN = 0.3
+
+# The settings window keys that are saved to preferences.json; the rest of the
+# window (API keys included) is not persisted
+PERSISTED_SETTINGS = ["tts_voice_id", "playback_speed"]
+
+OLLAMA_MODEL = "gemma2:latest"
+# How long Ollama keeps the model loaded after a request while listening is
+# on (overridable as ollama_keep_alive in preferences.json); it is released
+# as soon as listening is stopped
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Model backends are reached through one pooled client per host: connections
+# are kept alive between calls, failed connects and overloaded responses are
+# retried with exponential backoff, and at most BACKEND_MAX_CONCURRENCY
+# requests run against a backend at once (Ollama queues the rest anyway)
+BACKEND_MAX_CONNECTIONS = 4
+BACKEND_KEEPALIVE_SECONDS = 120
+BACKEND_CONNECT_TIMEOUT = 5.0
+BACKEND_READ_TIMEOUT = 300.0  # loading a model can take minutes
+BACKEND_RETRIES = 3
+BACKEND_RETRY_BACKOFF = 0.5
+BACKEND_RETRY_STATUS = (429, 502, 503, 504)
+BACKEND_MAX_CONCURRENCY = 2
+# Background requests (summaries, speculative prefill, model loading) never
+# take more than this many of the slots, so an interactive request only ever
+# waits for other interactive ones, and always goes ahead of queued background work
+BACKEND_BACKGROUND_MAX_IN_FLIGHT = 1
+
+# The conversation sent to the LLM is kept under this many (estimated) tokens;
+# past it, the oldest turns are summarised until it is back under the watermark
+LLM_HISTORY_TOKEN_BUDGET = 3000
+LLM_HISTORY_COMPACT_TO = 0.6
+LLM_SUMMARY_MAX_TOKENS = 200
+LLM_CHARS_PER_TOKEN = 4
+
+# While a prompt is still being dictated, the partial transcript is sent to the
+# model for prompt processing only (one token is generated), so most of the
+# final prompt is already in Ollama's KV cache when Whisper is done
+LLM_SPECULATIVE_PREFILL = True
+LLM_PREFILL_MIN_CHARS = 12
+# actions whose transcription is answered by the LLM
+LLM_PREFILL_SKIP_METHODS = ["dictate", "speak"]
+
+# When no action matches a short utterance, the LLM is asked which configured
+# action was meant; confident answers are executed, and a phrasing resolved to
+# the same action LLM_INTENT_LEARN_AFTER times is remembered as a trigger
+# variant (models/settings/learned_triggers.json), so it matches directly next
+# time. Shorter phrasings than LLM_INTENT_LEARN_MIN_WORDS are never learned.
+LLM_INTENT_FALLBACK = True
+LLM_INTENT_MIN_CONFIDENCE = 0.75
+LLM_INTENT_MAX_WORDS = 8
+LLM_INTENT_LEARN_AFTER = 2
+LLM_INTENT_LEARN_MIN_WORDS = 2
+
+# Trivial intents (time, date, arithmetic, units, battery) are answered locally;
+# until the LLM has been timed this session, a hit counts as saving this long
+FAST_PATH_LLM_ESTIMATE_SECONDS = 2.0
+
+# Opt-in ("semantic_cache": true in preferences.json) cache of LLM answers to
+# prompts that mean the same thing; time-sensitive and contextual prompts are
+# never cached
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_TTL_HOURS = 24 * 7
+SEMANTIC_CACHE_EXCLUDE_PATTERNS = [
+    r"\b(today|tonight|tomorrow|yesterday|now|currently|current|latest|recent|news)\b",
+    r"\b(time|date|day|week|month|year|weather|forecast|temperature)\b",
+    r"\b(it|that|this|those|these|them|they|he|she|him|her|again|more|else|previous|above|last)\b",
+]
+
 WHISPER_MODEL_SIZE = "base.en"
 WHISPER_MODEL_PATH = os.path.join(MODELS_DIR, WHISPER_MODEL_SIZE)
 
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, Boolean, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, Text, Boolean, DateTime, ForeignKey, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, backref
 import os
@@ -39,6 +39,18 @@ class Chat(Base):
                             backref=backref("parent", remote_side=[id]),
                             cascade="all, delete-orphan")
 
+class CachedResponse(Base):
+    __tablename__ = 'response_cache'
+
+    id = Column(Integer, primary_key=True)
+    prompt = Column(Text)
+    embedding = Column(LargeBinary)  # normalized float32 sentence embedding
+    response = Column(Text)
+    model = Column(String)
+    hits = Column(Integer, default=0)
+    created_date = Column(DateTime, default=datetime.utcnow)
+    last_hit_date = Column(DateTime, nullable=True)
+
 # Create the database file if it doesn't exist
 if not os.path.exists(DB_DIR):
     os.makedirs(DB_DIR)
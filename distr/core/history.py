@@ -0,0 +1,118 @@
+"""
+Conversation history for the agent, bounded by a token budget.
+
+The system prompt is always sent first and never dropped. When the turns grow
+past the budget, the oldest exchanges (a user turn and the replies to it) are
+folded into a rolling summary by a background call, and the history is cut
+down to a low watermark in one go. The summary is appended to the system
+prompt, so the kept turns always follow it starting with a user turn.
+Between compactions the messages only ever grow at the end, so the prompt
+prefix stays the same from one request to the next and Ollama can reuse its
+prompt cache instead of processing the whole conversation again.
+"""
+from distr.core.constants import LLM_HISTORY_TOKEN_BUDGET, LLM_HISTORY_COMPACT_TO, LLM_CHARS_PER_TOKEN
+from distr.core.metrics import metrics
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // LLM_CHARS_PER_TOKEN)
+
+
+class ConversationHistory:
+    def __init__(self, system_prompt, summarize=None, token_budget=LLM_HISTORY_TOKEN_BUDGET,
+                 compact_to=LLM_HISTORY_COMPACT_TO):
+        """
+        summarize(previous_summary, turns) returns the new summary text; it
+        runs on a background thread. Without it, old turns are just dropped.
+        """
+        self.system_prompt = system_prompt
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.compact_to = compact_to
+
+        self.summary = ""
+        self.turns = []
+        self.lock = threading.Lock()
+        self.compacting = False
+
+    def messages(self):
+        with self.lock:
+            system_prompt = self.system_prompt
+            if self.summary:
+                system_prompt = f"{system_prompt}\n\n{SUMMARY_PREFIX}{self.summary}"
+            return [{"role": "system", "content": system_prompt}] + list(self.turns)
+
+    def token_count(self):
+        with self.lock:
+            return self._token_count()
+
+    def _token_count(self):
+        # callers hold self.lock
+        total = estimate_tokens(self.system_prompt) + (estimate_tokens(self.summary) if self.summary else 0)
+        return total + sum(estimate_tokens(turn["content"]) for turn in self.turns)
+
+    def add(self, role, content):
+        with self.lock:
+            self.turns.append({"role": role, "content": content})
+            tokens = self._token_count()
+            over_budget = tokens > self.token_budget and not self.compacting
+            if over_budget:
+                self.compacting = True
+                turns = self._turns_to_compact()
+                previous_summary = self.summary
+        metrics.gauge("llm.history_tokens", tokens)
+
+        if over_budget:
+            threading.Thread(target=self.compact, args=(previous_summary, turns), daemon=True).start()
+
+    def _turns_to_compact(self):
+        # callers hold self.lock; the oldest whole exchanges that take the history
+        # down to the low watermark, always keeping the latest exchange
+        target = self.token_budget * self.compact_to
+        excess = self._token_count() - target
+        latest = max((i for i, turn in enumerate(self.turns) if turn["role"] == "user"), default=0)
+        count = 0
+        while count < latest and excess > 0:
+            # the user turn and everything up to the next user turn
+            end = count + 1
+            while end < latest and self.turns[end]["role"] != "user":
+                end += 1
+            excess -= sum(estimate_tokens(turn["content"]) for turn in self.turns[count:end])
+            count = end
+        return self.turns[:count]
+
+    def compact(self, previous_summary, turns):
+        if not turns:
+            with self.lock:
+                self.compacting = False
+            return
+
+        summary = previous_summary
+        if self.summarize:
+            start_time = time.perf_counter()
+            try:
+                summary = self.summarize(previous_summary, turns).strip() or previous_summary
+                metrics.record("llm.summary", time.perf_counter() - start_time)
+            except Exception as e:
+                logger.error(f"Could not summarise the conversation, dropping {len(turns)} old turns: {str(e)}")
+
+        with self.lock:
+            # turns are only ever appended, so the compacted ones are still at the front
+            del self.turns[:len(turns)]
+            self.summary = summary
+            self.compacting = False
+            tokens = self._token_count()
+        metrics.increment("llm.history.compactions")
+        logger.info(f"Compacted {len(turns)} turns into the summary, history is now ~{tokens} tokens")
+
+    def clear(self):
+        with self.lock:
+            self.summary = ""
+            self.turns = []
@@ -0,0 +1,276 @@
+"""
+Fast-path answers for trivial intents.
+
+The time, the date, simple arithmetic, unit conversions and the battery level
+are answered by deterministic handlers in well under 10 ms instead of a round
+trip through the LLM. The router sits in front of the model: a prompt that no
+handler recognises falls through to it unchanged.
+
+Each hit is counted per intent (`intent.<name>.hits`), with the handler's
+latency and the LLM time it saved, estimated from the mean LLM response time
+measured so far in this session.
+"""
+from distr.core.constants import FAST_PATH_LLM_ESTIMATE_SECONDS
+from distr.core.metrics import metrics
+from datetime import datetime
+import operator
+import logging
+import time
+import ast
+import re
+
+logger = logging.getLogger(__name__)
+
+NUMBER = r"-?\d+(?:[.,]\d+)*"
+
+# spoken operators, longest first so "divided by" wins over "by"
+OPERATOR_WORDS = [
+    (r"to the power of", "**"),
+    (r"multiplied by", "*"),
+    (r"divided by", "/"),
+    (r"squared", "**2"),
+    (r"cubed", "**3"),
+    (r"times", "*"),
+    (r"plus", "+"),
+    (r"minus", "-"),
+    (r"over", "/"),
+    (r"x", "*"),
+]
+
+OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+# unit -> (dimension, factor to the base unit of the dimension)
+UNITS = {
+    "millimeter": ("length", 0.001), "centimeter": ("length", 0.01), "meter": ("length", 1.0),
+    "kilometer": ("length", 1000.0), "inch": ("length", 0.0254), "foot": ("length", 0.3048),
+    "yard": ("length", 0.9144), "mile": ("length", 1609.344),
+    "milligram": ("mass", 0.001), "gram": ("mass", 1.0), "kilogram": ("mass", 1000.0),
+    "ounce": ("mass", 28.349523125), "pound": ("mass", 453.59237), "stone": ("mass", 6350.29318),
+    "milliliter": ("volume", 0.001), "liter": ("volume", 1.0), "teaspoon": ("volume", 0.00492892),
+    "tablespoon": ("volume", 0.0147868), "cup": ("volume", 0.236588), "pint": ("volume", 0.473176),
+    "quart": ("volume", 0.946353), "gallon": ("volume", 3.78541),
+    "second": ("time", 1.0), "minute": ("time", 60.0), "hour": ("time", 3600.0), "day": ("time", 86400.0),
+    "week": ("time", 604800.0),
+    "kilobyte": ("data", 1e3), "megabyte": ("data", 1e6), "gigabyte": ("data", 1e9), "terabyte": ("data", 1e12),
+    "celsius": ("temperature", None), "fahrenheit": ("temperature", None), "kelvin": ("temperature", None),
+}
+
+UNIT_ALIASES = {
+    "mm": "millimeter", "cm": "centimeter", "m": "meter", "km": "kilometer", "kms": "kilometer",
+    "in": "inch", "inches": "inch", "ft": "foot", "feet": "foot", "yd": "yard", "mi": "mile",
+    "mg": "milligram", "g": "gram", "kg": "kilogram", "kilo": "kilogram", "kilos": "kilogram",
+    "oz": "ounce", "lb": "pound", "lbs": "pound",
+    "ml": "milliliter", "l": "liter", "litre": "liter", "millilitre": "milliliter",
+    "metre": "meter", "centimetre": "centimeter", "millimetre": "millimeter", "kilometre": "kilometer",
+    "tsp": "teaspoon", "tbsp": "tablespoon",
+    "sec": "second", "secs": "second", "min": "minute", "mins": "minute", "hr": "hour", "hrs": "hour",
+    "kb": "kilobyte", "mb": "megabyte", "gb": "gigabyte", "tb": "terabyte",
+    "c": "celsius", "centigrade": "celsius", "f": "fahrenheit", "k": "kelvin",
+    "degrees celsius": "celsius", "degrees fahrenheit": "fahrenheit", "degrees c": "celsius", "degrees f": "fahrenheit",
+}
+
+
+def unit_name(text):
+    text = text.strip().lower().rstrip(".?!")
+    text = re.sub(r"^(a|an|one)\s+", "", text)
+    if text in UNIT_ALIASES:
+        return UNIT_ALIASES[text]
+    if text in UNITS:
+        return text
+    # plurals: "miles", "inches"
+    for suffix in ("es", "s"):
+        if text.endswith(suffix) and text[:-len(suffix)] in UNITS:
+            return text[:-len(suffix)]
+    return None
+
+
+def parse_number(text):
+    return float(text.replace(",", ""))
+
+
+def format_number(value):
+    if abs(value - round(value)) < 1e-9 and abs(value) < 1e15:
+        return f"{int(round(value)):,}"
+    return f"{value:,.4g}" if abs(value) < 1e-3 or abs(value) >= 1e6 else f"{value:,.4f}".rstrip("0").rstrip(".")
+
+
+def evaluate(node):
+    # only numbers and arithmetic, nothing else is ever evaluated
+    if isinstance(node, ast.Expression):
+        return evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+        left, right = evaluate(node.left), evaluate(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > 100:
+            raise ValueError("exponent too large")
+        return OPERATORS[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in OPERATORS:
+        return OPERATORS[type(node.op)](evaluate(node.operand))
+    raise ValueError(f"unsupported expression: {ast.dump(node)}")
+
+
+def answer_time(prompt):
+    if not re.fullmatch(r"(?:what(?:'s| is) the (?:current )?time|what time is it|(?:the )?(?:current |local )?time)"
+                        r"(?: now| right now| please)?[?.!]*", prompt):
+        return None
+    return f"It's {datetime.now().strftime('%-I:%M %p')}."
+
+
+def answer_date(prompt):
+    if not re.fullmatch(r"(?:what(?:'s| is) (?:the date|the date today|today's date|today)|what day is (?:it|today)"
+                        r"|(?:today's )?date)(?: today| please)?[?.!]*", prompt):
+        return None
+    return f"Today is {datetime.now().strftime('%A, %-d %B %Y')}."
+
+
+def answer_arithmetic(prompt):
+    match = re.fullmatch(r"(?:what(?:'s| is)|calculate|compute|how much is|solve)\s+(.+?)[?.!]*", prompt)
+    if not match:
+        return None
+    expression = match.group(1)
+
+    # "15 percent of 80"
+    percent = re.fullmatch(rf"({NUMBER})\s*(?:%|percent)\s+of\s+({NUMBER})", expression)
+    if percent:
+        value = parse_number(percent.group(1)) / 100 * parse_number(percent.group(2))
+        return f"{percent.group(1)} percent of {percent.group(2)} is {format_number(value)}."
+
+    spoken = expression
+    for words, symbol in OPERATOR_WORDS:
+        spoken = re.sub(rf"\b{words}\b", f" {symbol} ", spoken)
+    spoken = spoken.replace("^", "**").replace("×", "*").replace("÷", "/")
+    spoken = re.sub(r"(?<=\d),(?=\d{3}\b)", "", spoken)
+    if not re.fullmatch(r"[\d\s.+\-*/%()]+", spoken) or not re.search(r"\d\s*(?:\*\*|[+\-*/%])\s*[\d(]", spoken):
+        return None
+    try:
+        value = evaluate(ast.parse(spoken, mode="eval"))
+    except ZeroDivisionError:
+        return "You can't divide by zero."
+    except (SyntaxError, ValueError, OverflowError):
+        return None
+    return f"{expression.strip()} is {format_number(value)}."
+
+
+def convert_temperature(value, source, target):
+    celsius = {"celsius": value, "fahrenheit": (value - 32) * 5 / 9, "kelvin": value - 273.15}[source]
+    return {"celsius": celsius, "fahrenheit": celsius * 9 / 5 + 32, "kelvin": celsius + 273.15}[target]
+
+
+def answer_units(prompt):
+    match = re.fullmatch(rf"(?:convert|what(?:'s| is)|how (?:much|many) is)?\s*({NUMBER})\s*(?:degrees? )?(.+?)"
+                         rf"\s+(?:to|in|into|in to)\s+(?:degrees? )?(.+?)[?.!]*", prompt)
+    if match:
+        value_text, source, target = match.groups()
+        value = parse_number(value_text)
+    else:
+        # "how many ounces in a pound"
+        match = re.fullmatch(r"how many (.+?) (?:are )?(?:in|are in|make) (?:a |an |one )?(.+?)[?.!]*", prompt)
+        if not match:
+            return None
+        target, source = match.groups()
+        value_text, value = "1", 1.0
+
+    source, target = unit_name(source), unit_name(target)
+    if not source or not target or source == target or UNITS[source][0] != UNITS[target][0]:
+        return None
+
+    if UNITS[source][0] == "temperature":
+        result = convert_temperature(value, source, target)
+        return f"{value_text} degrees {source} is {format_number(result)} degrees {target}."
+    result = value * UNITS[source][1] / UNITS[target][1]
+    source_label = source if value == 1 else f"{source}s" if not source.endswith("ch") else f"{source}es"
+    target_label = target if result == 1 else f"{target}s" if not target.endswith("ch") else f"{target}es"
+    if source == "foot":
+        source_label = "foot" if value == 1 else "feet"
+    if target == "foot":
+        target_label = "foot" if result == 1 else "feet"
+    return f"{value_text} {source_label} is {format_number(result)} {target_label}."
+
+
+def answer_battery(prompt):
+    if not re.fullmatch(r"(?:what(?:'s| is) )?(?:my |the )?battery(?: level| status| charge| percentage)?(?: at| left)?"
+                        r"|how much (?:battery|charge) (?:do i have|is left|have i got)(?: left)?"
+                        r"|how(?:'s| is) (?:my |the )?battery(?: doing)?", prompt.rstrip("?.!")):
+        return None
+    try:
+        import psutil
+        battery = psutil.sensors_battery()
+    except Exception:
+        battery = None
+    if battery is None:
+        return "I can't read a battery on this computer."
+
+    answer = f"The battery is at {battery.percent:.0f} percent"
+    if battery.power_plugged:
+        return answer + " and charging." if battery.percent < 100 else answer + " and plugged in."
+    if battery.secsleft and battery.secsleft > 0:
+        hours, minutes = divmod(battery.secsleft // 60, 60)
+        return answer + f", about {hours} hours and {minutes} minutes left."
+    return answer + "."
+
+
+INTENTS = [
+    ("time", answer_time),
+    ("date", answer_date),
+    ("battery", answer_battery),
+    ("units", answer_units),
+    ("arithmetic", answer_arithmetic),
+]
+
+
+class FastPathRouter:
+    def __init__(self, intents=None):
+        self.intents = intents or INTENTS
+        self.stats = {name: {"hits": 0, "seconds": 0.0, "saved": 0.0} for name, _ in self.intents}
+
+    def route(self, prompt):
+        """The answer to prompt if a handler recognises it, otherwise None."""
+        start_time = time.perf_counter()
+        text = re.sub(r"\s+", " ", prompt.strip().lower())
+        text = re.sub(r"^(?:hey |ok |okay |so |please |jax,? |can you tell me |tell me )+", "", text)
+        for name, handler in self.intents:
+            try:
+                answer = handler(text)
+            except Exception as e:
+                logger.error(f"Fast-path handler {name} failed: {str(e)}")
+                continue
+            if answer is None:
+                continue
+
+            seconds = time.perf_counter() - start_time
+            saved = max(0.0, self.llm_estimate() - seconds)
+            stats = self.stats[name]
+            stats["hits"] += 1
+            stats["seconds"] += seconds
+            stats["saved"] += saved
+            metrics.increment(f"intent.{name}.hits")
+            metrics.record(f"intent.{name}", seconds)
+            metrics.record("intent.saved", saved)
+            logger.info(f"Fast path '{name}' answered in {seconds * 1000:.1f} ms (~{saved:.1f} s saved)")
+            return answer
+
+        metrics.record("intent.miss", time.perf_counter() - start_time)
+        return None
+
+    def llm_estimate(self):
+        # what the LLM has taken on average so far
+        llm = metrics.summary()["timings"].get("llm.response_time")
+        return llm["mean"] if llm else FAST_PATH_LLM_ESTIMATE_SECONDS
+
+    def report(self):
+        lines = []
+        for name, stats in self.stats.items():
+            if stats["hits"]:
+                lines.append(f"{name:<12} hits={stats['hits']:<5} mean={stats['seconds'] / stats['hits'] * 1000:6.2f} ms  "
+                             f"saved={stats['saved']:7.1f} s")
+        return "\n".join(lines)
@@ -0,0 +1,84 @@
+"""
+Lightweight in-process latency and counter metrics.
+
+Any part of the pipeline can record a timing (in seconds), bump a counter or
+set a gauge (a level such as a queue depth, reported as last and peak value);
+the replay script and the logs use `metrics.report()` to summarise them.
+"""
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import threading
+import time
+
+MAX_SAMPLES = 1000
+
+
+class Metrics:
+    def __init__(self):
+        self.samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, value):
+        with self.lock:
+            self.samples[name].append(value)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def gauge(self, name, value):
+        with self.lock:
+            peak = self.gauges.get(name, {}).get("max", value)
+            self.gauges[name] = {"value": value, "max": max(peak, value)}
+
+    @contextmanager
+    def timer(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def summary(self):
+        with self.lock:
+            samples = {name: sorted(values) for name, values in self.samples.items()}
+            counters = dict(self.counters)
+            gauges = {name: dict(gauge) for name, gauge in self.gauges.items()}
+
+        stats = {}
+        for name, values in samples.items():
+            if not values:
+                continue
+            stats[name] = {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max": values[-1],
+            }
+        return {"timings": stats, "counters": counters, "gauges": gauges}
+
+    def report(self):
+        summary = self.summary()
+        lines = []
+        for name, s in sorted(summary["timings"].items()):
+            lines.append(
+                f"{name:<32} n={s['count']:<5} mean={s['mean'] * 1000:8.1f} ms  "
+                f"p50={s['p50'] * 1000:8.1f} ms  p95={s['p95'] * 1000:8.1f} ms  max={s['max'] * 1000:8.1f} ms"
+            )
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name:<32} {value}")
+        for name, gauge in sorted(summary["gauges"].items()):
+            lines.append(f"{name:<32} last={gauge['value']}  max={gauge['max']}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,88 @@
+"""
+Bank of the fixed phrases the assistant speaks.
+
+These are rendered once in the background as soon as the TTS model is ready
+(from the TTS disk cache when possible) and kept decoded in memory, so they
+play without any synthesis latency. The bank re-renders itself whenever the
+voice or the speed changes.
+"""
+from distr.core.sound import SPEECH, load_wav
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PHRASES = {
+    "unrecognised": "I'm sorry, I couldn't understand that. Could you please rephrase?",
+    "stopped_listening": "Okay, I've stopped listening.",
+    "speech_model_failed": "Sorry, I can't transcribe right now. The speech model didn't load.",
+    "transcription_failed": "Sorry, I couldn't transcribe that.",
+    "action_failed": "Sorry, something went wrong while doing that.",
+}
+
+
+def phrase(key):
+    return SYSTEM_PHRASES[key]
+
+
+class PhraseBank:
+    def __init__(self, tts_manager, phrases=None):
+        self.tts_manager = tts_manager
+        self.phrases = dict(phrases or SYSTEM_PHRASES)
+        self.texts = {text: key for key, text in self.phrases.items()}
+
+        self.files = {}   # key -> rendered wav file
+        self.audio = {}   # key -> (samples, sample_rate), decoded in memory
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def warm(self):
+        # render every phrase in the background once the TTS model is ready
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.files = {}
+            self.audio = {}
+        threading.Thread(target=self.render_all, args=(generation,), daemon=True).start()
+
+    def rerender(self):
+        print("Voice settings changed, re-rendering phrase bank")
+        self.warm()
+
+    def render_all(self, generation):
+        self.tts_manager.wait_until_ready()
+        if not self.tts_manager.is_ready:
+            return
+        for key, text in self.phrases.items():
+            if generation != self.generation:
+                return  # settings changed again, a newer render is running
+            try:
+                path = self.tts_manager.synthesize_to_file(text)
+                samples = load_wav(path)
+            except Exception as e:
+                logger.error(f"Error rendering phrase '{key}': {str(e)}")
+                continue
+            with self.lock:
+                if generation != self.generation:
+                    return
+                self.files[key] = path
+                self.audio[key] = samples
+        logger.info(f"Phrase bank ready: {len(self.audio)}/{len(self.phrases)} phrases rendered")
+
+    def lookup(self, text):
+        # returns the phrase key if this exact text has been rendered
+        key = self.texts.get(text.strip())
+        with self.lock:
+            return key if key in self.files else None
+
+    def play(self, key, priority=SPEECH, on_finished=None):
+        with self.lock:
+            audio = self.audio.get(key)
+        if audio is None:
+            # not rendered yet, fall back to normal synthesis
+            self.tts_manager.start_tts(self.phrases[key])
+            return False
+
+        samples, sample_rate = audio
+        return self.tts_manager.sound_player.play_pcm(samples, sample_rate, on_finished=on_finished,
+                                                      priority=priority, name=f"phrase '{key}'")
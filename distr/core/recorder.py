@@ -0,0 +1,79 @@
+"""
+Rolling buffer of the raw microphone audio that is fed to the recognizer.
+
+The listener appends every chunk it reads, so the most recent few seconds of
+16 kHz / 16-bit mono audio are always available without opening another
+input stream.
+
+Every chunk is also fed to Vosk, so the buffer's running sample count is on the
+same clock as the recognizer's word timings. A capture can therefore start
+and stop exactly on word boundaries, e.g. just after a trigger phrase.
+"""
+from collections import deque
+import threading
+
+
+class AudioRingBuffer:
+    def __init__(self, max_seconds, sample_rate=16000, sample_width=2):
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.max_bytes = int(max_seconds * sample_rate) * sample_width
+
+        self.chunks = deque()
+        self.size = 0
+        self.total_bytes = 0  # bytes appended since the recognizer started
+        self.lock = threading.Lock()
+
+        self.capture = None  # chunks recorded since start_capture()
+        self.capture_start = 0
+
+    def append(self, data):
+        with self.lock:
+            self.chunks.append(data)
+            self.size += len(data)
+            self.total_bytes += len(data)
+            while self.size - len(self.chunks[0]) >= self.max_bytes:
+                self.size -= len(self.chunks.popleft())
+            if self.capture is not None:
+                self.capture.append(data)
+
+    def to_offset(self, seconds):
+        return int(seconds * self.sample_rate) * self.sample_width
+
+    def current_time(self):
+        return self.total_bytes / (self.sample_rate * self.sample_width)
+
+    def start_capture(self, from_seconds=None):
+        # record everything from `from_seconds` (recognizer time) onwards,
+        # including audio that is already in the buffer
+        with self.lock:
+            buffered_start = self.total_bytes - self.size
+            start = self.total_bytes if from_seconds is None else self.to_offset(from_seconds)
+            start = min(max(start, buffered_start), self.total_bytes)
+            self.capture = [b''.join(self.chunks)[start - buffered_start:]]
+            self.capture_start = start
+
+    def stop_capture(self, until_seconds=None):
+        # returns the captured audio, cut at `until_seconds` (recognizer time)
+        with self.lock:
+            if self.capture is None:
+                return b''
+            data = b''.join(self.capture)
+            self.capture = None
+        if until_seconds is not None:
+            end = self.to_offset(until_seconds) - self.capture_start
+            if 0 <= end < len(data):
+                data = data[:end]
+        return data
+
+    def latest(self, seconds):
+        # returns the last `seconds` of audio as raw bytes
+        wanted = int(seconds * self.sample_rate) * self.sample_width
+        with self.lock:
+            data = b''.join(self.chunks)
+        return data[-wanted:]
+
+    def clear(self):
+        with self.lock:
+            self.chunks.clear()
+            self.size = 0
@@ -0,0 +1,152 @@
+"""
+Second-pass rescoring of short, low-confidence voice commands.
+
+Vosk is fast but regularly unsure about one or two word commands. When the
+confidence of the best hypothesis falls below a threshold, the last few
+seconds of audio are run through a small Whisper model whose initial prompt
+lists the trigger vocabulary, and the result is offered to the action handler
+as an extra hypothesis. Confident utterances never touch Whisper.
+
+Vosk only reports word-level confidences when n-best results are off, so with
+n-best on the confidence is the best hypothesis' posterior among the
+alternatives. When Vosk returns a single alternative that posterior is always
+1.0 and says nothing; such an utterance is rescored only when it doesn't start
+with a known trigger. With n-best off, the mean word confidence is used.
+
+Whisper runs on its own thread, so the listener keeps reading audio while it
+works. The result comes back through a callback; the listener holds the
+command back until then, for at most RESCORE_TIMEOUT_SECONDS, after which it
+goes ahead with the first pass and a late result is dropped.
+"""
+from distr.core.constants import RESCORE_CONFIDENCE_THRESHOLD, RESCORE_WHISPER_MODEL, RESCORE_TIMEOUT_SECONDS
+from distr.core.utils import load_preferences_config
+from distr.core.metrics import metrics
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import threading
+import logging
+import whisper
+import time
+
+logger = logging.getLogger(__name__)
+
+# whisper only looks at the last 224 prompt tokens, keep the vocabulary short
+MAX_PROMPT_WORDS = 150
+
+
+class SecondPassRescorer:
+    def __init__(self, trigger_words):
+        preferences = load_preferences_config()
+        self.threshold = preferences.get("rescore_confidence_threshold", RESCORE_CONFIDENCE_THRESHOLD)
+        self.model_size = preferences.get("rescore_whisper_model", RESCORE_WHISPER_MODEL)
+        self.timeout = preferences.get("rescore_timeout_seconds", RESCORE_TIMEOUT_SECONDS)
+        self.triggers = tuple(dict.fromkeys(trigger.lower() for trigger in trigger_words))
+        self.initial_prompt = self.build_initial_prompt(trigger_words)
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rescore")
+        self.pending = None  # the second pass Whisper is working on
+
+        self.model = None
+        self.load_error = None
+        self.model_ready = threading.Event()
+        threading.Thread(target=self.load_model, daemon=True).start()
+
+        self.utterances = 0  # command utterances seen
+        self.runs = 0        # second passes executed
+        self.changed = 0     # second pass produced a different text
+        self.helped = 0      # the action was matched from the second pass text
+        self.timeouts = 0    # second passes that took longer than the timeout
+        self.total_time = 0.0
+
+    def build_initial_prompt(self, trigger_words):
+        vocabulary = []
+        word_count = 0
+        for trigger in dict.fromkeys(trigger_words):
+            word_count += len(trigger.split())
+            if word_count > MAX_PROMPT_WORDS:
+                break
+            vocabulary.append(trigger)
+        return "Voice commands: " + ", ".join(vocabulary) + "."
+
+    def load_model(self):
+        try:
+            self.model = whisper.load_model(self.model_size)
+            logger.info(f"Second pass Whisper model ({self.model_size}) loaded")
+        except Exception as e:
+            self.load_error = e
+            logger.error(f"Error loading second pass Whisper model: {str(e)}")
+        finally:
+            # set even on failure; without a model the second pass is skipped
+            self.model_ready.set()
+
+    def needs_rescore(self, hypotheses):
+        self.utterances += 1
+        if not hypotheses or not self.model_ready.is_set() or self.model is None:
+            return False
+        best = hypotheses[0]
+        word_confidences = [w["conf"] for w in best.get("words", []) if "conf" in w]
+        if word_confidences:
+            return float(np.mean(word_confidences)) < self.threshold
+        if len(hypotheses) == 1:
+            # a lone alternative's posterior is always 1.0
+            return not best["text"].lower().startswith(self.triggers)
+        return best.get("confidence", 1.0) < self.threshold
+
+    def submit(self, audio_data, on_done):
+        """
+        Starts the second pass on the worker thread and returns straight away.
+        on_done(text) is called there with the text, or None if Whisper failed.
+        Returns False if Whisper is still busy with the previous second pass.
+        """
+        if self.pending is not None and not self.pending.done():
+            print("Second pass skipped, Whisper is still busy with the previous one")
+            return False
+
+        def done(future):
+            if future.exception():
+                logger.error(f"Error in second pass rescoring: {str(future.exception())}")
+            on_done(None if future.exception() else future.result())
+
+        self.pending = self.worker.submit(self.transcribe, audio_data)
+        self.pending.add_done_callback(done)
+        return True
+
+    def record_timeout(self):
+        self.timeouts += 1
+        print(f"Second pass took longer than {self.timeout:.1f} s, using the first pass")
+
+    def transcribe(self, audio_data):
+        # audio_data is raw 16 kHz int16 mono audio
+        start_time = time.time()
+        audio = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+        result = self.model.transcribe(
+            audio,
+            language="en",
+            initial_prompt=self.initial_prompt,
+            temperature=0.0,
+            condition_on_previous_text=False,
+            fp16=False,
+        )
+        elapsed = time.time() - start_time
+
+        self.runs += 1
+        self.total_time += elapsed
+        metrics.record("asr.second_pass", elapsed)
+        text = result["text"].strip().lower().strip(".,!?")
+        print(f"Second pass ({elapsed * 1000:.0f} ms): {text}")
+        return text
+
+    def record_outcome(self, first_text, second_text, matched_text):
+        if second_text and second_text != first_text:
+            self.changed += 1
+            if matched_text == second_text:
+                self.helped += 1
+        logger.info(self.report())
+
+    def report(self):
+        run_rate = self.runs / self.utterances if self.utterances else 0.0
+        average_time = self.total_time / self.runs if self.runs else 0.0
+        return (
+            f"Second pass: ran on {self.runs}/{self.utterances} commands ({run_rate:.1%}), "
+            f"changed {self.changed}, helped {self.helped}, timed out {self.timeouts}, "
+            f"avg {average_time * 1000:.0f} ms"
+        )
@@ -0,0 +1,149 @@
+"""
+Opt-in semantic cache of LLM responses.
+
+Prompts are embedded with the SBERT model the chat manager already has, and a
+new prompt that is close enough to a cached one (cosine similarity above the
+threshold) gets the cached answer back in milliseconds instead of a full
+generation. Entries expire after a TTL and are kept in the local SQLite DB.
+Prompts that depend on the time or on the earlier conversation ("what's the
+weather today", "tell me more about it") are never cached.
+
+Enable it with "semantic_cache": true in preferences.json.
+"""
+from distr.core.constants import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_HOURS, SEMANTIC_CACHE_EXCLUDE_PATTERNS
+from distr.core.db import get_session, CachedResponse
+from distr.core.metrics import metrics
+from datetime import datetime, timedelta
+import numpy as np
+import threading
+import logging
+import time
+import re
+
+logger = logging.getLogger(__name__)
+
+EXCLUDE = re.compile("|".join(SEMANTIC_CACHE_EXCLUDE_PATTERNS), re.IGNORECASE)
+
+
+class ResponseCache:
+    def __init__(self, encode, model, threshold=SEMANTIC_CACHE_THRESHOLD, ttl_hours=SEMANTIC_CACHE_TTL_HOURS):
+        """encode(text) returns a normalized embedding."""
+        self.encode = encode
+        self.model = model
+        self.threshold = threshold
+        self.ttl = timedelta(hours=ttl_hours)
+
+        self.lock = threading.Lock()
+        self.ids = []
+        self.responses = []
+        self.created = []
+        self.embeddings = None
+        self.hits = 0
+        self.misses = 0
+        self.excluded = 0
+        self.load()
+
+    def load(self):
+        # drops expired entries and loads the rest into memory
+        session = get_session()
+        try:
+            session.query(CachedResponse).filter(CachedResponse.created_date < datetime.utcnow() - self.ttl).delete()
+            session.commit()
+            entries = session.query(CachedResponse).filter(CachedResponse.model == self.model).all()
+            with self.lock:
+                self.ids = [entry.id for entry in entries]
+                self.responses = [entry.response for entry in entries]
+                self.created = [entry.created_date for entry in entries]
+                self.embeddings = (np.stack([np.frombuffer(entry.embedding, dtype=np.float32) for entry in entries])
+                                   if entries else None)
+        finally:
+            session.close()
+        logger.info(f"Semantic cache: {len(self.ids)} cached responses for {self.model}")
+
+    def is_cacheable(self, prompt):
+        return not EXCLUDE.search(prompt)
+
+    def lookup(self, prompt):
+        if not self.is_cacheable(prompt):
+            self.excluded += 1
+            metrics.increment("llm.cache.excluded")
+            return None
+
+        start_time = time.perf_counter()
+        embedding = self.encode(prompt)
+        with self.lock:
+            if self.embeddings is None:
+                best = None
+            else:
+                similarities = self.embeddings @ embedding
+                best = int(np.argmax(similarities))
+                similarity = float(similarities[best])
+                expired = self.created[best] < datetime.utcnow() - self.ttl
+                if similarity < self.threshold or expired:
+                    best = None
+            entry_id = self.ids[best] if best is not None else None
+            response = self.responses[best] if best is not None else None
+        metrics.record("llm.cache.lookup", time.perf_counter() - start_time)
+
+        if response is None:
+            self.misses += 1
+            metrics.increment("llm.cache.miss")
+            return None
+
+        self.hits += 1
+        metrics.increment("llm.cache.hit")
+        logger.info(f"Semantic cache hit (similarity {similarity:.3f}), hit rate {self.hit_rate():.0%}")
+        threading.Thread(target=self.record_hit, args=(entry_id,), daemon=True).start()
+        return response
+
+    def record_hit(self, entry_id):
+        session = get_session()
+        try:
+            entry = session.query(CachedResponse).get(entry_id)
+            if entry:
+                entry.hits = (entry.hits or 0) + 1
+                entry.last_hit_date = datetime.utcnow()
+                session.commit()
+        finally:
+            session.close()
+
+    def store(self, prompt, response):
+        if not response.strip() or not self.is_cacheable(prompt):
+            return
+        embedding = np.asarray(self.encode(prompt), dtype=np.float32)
+
+        session = get_session()
+        try:
+            entry = CachedResponse(
+                prompt=prompt,
+                embedding=embedding.tobytes(),
+                response=response,
+                model=self.model,
+                hits=0,
+                created_date=datetime.utcnow()
+            )
+            session.add(entry)
+            session.commit()
+            entry_id, created = entry.id, entry.created_date
+        finally:
+            session.close()
+
+        with self.lock:
+            self.ids.append(entry_id)
+            self.responses.append(response)
+            self.created.append(created)
+            row = embedding[np.newaxis, :]
+            self.embeddings = row if self.embeddings is None else np.vstack([self.embeddings, row])
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self.ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "excluded": self.excluded,
+            "hit_rate": self.hit_rate(),
+        }
@@ -16,6 +16,7 @@ class SignalManager(QObject):
     sound_finished = pyqtSignal()
 
     stop_sound_player = pyqtSignal()
+    play_cue = pyqtSignal(str)  # the name of a sound cue, see distr/core/sound.py
 
     hide_oracle = pyqtSignal() 
     show_oracle = pyqtSignal()  
@@ -34,8 +35,9 @@ class SignalManager(QObject):
 
     #signals for transcription control
     voice_set_action = pyqtSignal(dict)
-    voice_start_transcribing = pyqtSignal()
-    voice_stop_transcribing = pyqtSignal()
+    voice_start_transcribing = pyqtSignal(list)  # word timings of the utterance that started it
+    voice_stop_transcribing = pyqtSignal(list)  # n-best hypotheses of the utterance that ended it
+    voice_cut_transcribing = pyqtSignal()
 
     voice_set_is_transcribing = pyqtSignal(bool)
     voice_set_is_listening = pyqtSignal(bool)
@@ -1,71 +1,385 @@
-from distr.core.constants import ASSETS_DIR
+"""
+In-process audio output.
+
+A single callback output stream stays open for the lifetime of the app and
+plays decoded PCM from memory, so starting a sound only means handing the
+samples to the next audio buffer, and stopping takes effect within one buffer
+(with a short fade so it doesn't click). Sounds are decoded once and kept in
+memory; fixed assets like decisions.mp3 are preloaded at startup. Completion
+is reported through callbacks instead of polling a player process.
+
+Sounds are scheduled in three priority classes, each with its own queue:
+alerts, speech and UI sounds. Speech plays on its own lane and queued speech
+chunks follow each other without a gap. Alerts and UI sounds share a cue lane
+where an alert preempts a playing UI sound. A sound is ducked while one of a
+higher class plays over it: speech under an alert, a UI sound under speech.
+An alert doesn't preempt speech: alerts are short spoken status messages
+("I've stopped listening") and cutting the response would lose what the user
+asked for, so the response carries on, ducked, underneath. UI sounds are the
+cues in CUES, requested with the play_cue signal; alerts are the pre-rendered
+system phrases (see TTSManager.start_tts).
+
+is_speaking is shared by everything that speaks (TTS utterances and spoken
+alerts), so it is only signalled when the first of them starts and when the
+last one ends.
+"""
+from distr.core.constants import ASSETS_DIR, OUTPUT_SAMPLE_RATE, OUTPUT_BUFFER_FRAMES, DECODED_SOUNDS_CACHE_SIZE
+from distr.core.constants import SPEECH_DUCK_GAIN
+from distr.core.audio_source import resample
 from distr.core.signals import signal_manager
-import subprocess
+from distr.core.metrics import metrics
+from collections import OrderedDict, deque
+import numpy as np
 import threading
-import os
+import logging
+import pyaudio
+import queue
+import wave
 import time
+import os
+
+logger = logging.getLogger(__name__)
+
+DECISIONS_SOUND = os.path.join(ASSETS_DIR, "sounds", "decisions.mp3")
+
+# priority classes, highest first
+ALERT = 0
+SPEECH = 1
+UI = 2
+PRIORITY_NAMES = {ALERT: "alert", SPEECH: "speech", UI: "ui"}
+
+# cue name -> sound file, played in the UI class
+CUES = {
+    "listening_started": DECISIONS_SOUND,
+}
+
+
+def load_wav(path):
+    # decodes a 16-bit wav file into float32 mono samples
+    with wave.open(path, "rb") as wf:
+        sample_rate = wf.getframerate()
+        channels = wf.getnchannels()
+        raw = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    samples = raw.reshape(-1, channels).mean(axis=1).astype(np.float32) / 32768.0
+    return samples, sample_rate
+
+
+def decode_audio(path):
+    if path.lower().endswith(".wav"):
+        try:
+            return load_wav(path)
+        except wave.Error:
+            pass  # not 16-bit PCM, let torchaudio handle it
+
+    import torchaudio
+    waveform, sample_rate = torchaudio.load(path)
+    return waveform.mean(dim=0).numpy().astype(np.float32), sample_rate
+
+
+class Playback:
+    def __init__(self, samples, name, priority, show_voice_box, is_speaking, on_finished):
+        self.samples = samples
+        self.name = name
+        self.priority = priority
+        self.show_voice_box = show_voice_box
+        self.is_speaking = is_speaking
+        self.on_finished = on_finished
+
+        self.position = 0
+        self.stopping = False
+        self.speaking = False  # holds is_speaking while it plays
+        self.queued_time = time.perf_counter()
+        self.started_time = None
 
 
 class SoundPlayer:
-    def __init__(self):
+    def __init__(self, sample_rate=OUTPUT_SAMPLE_RATE, buffer_frames=OUTPUT_BUFFER_FRAMES):
         signal_manager.stop_sound_player.connect(self.stop_sound)
-        self.sound_process = None
-        self.sound_playing = False
-        self.stop_event = threading.Event()
+        signal_manager.play_cue.connect(self.play_cue)
+        self.sample_rate = sample_rate
+        self.buffer_frames = buffer_frames
         self.show_voice_box = True
 
-    def play_sound(self, sound_file, show_voice_box=True, is_speaking=True):
-        if os.path.exists(sound_file):
-            if not self.sound_playing:
-                print(f"Playing sound: {sound_file}")
-                self.sound_playing = True
-                self.stop_event.clear()
-                self.sound_process = subprocess.Popen(["afplay", sound_file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                threading.Thread(target=self._monitor_sound_playback, args=(is_speaking,), daemon=True).start()
-                if show_voice_box:
+        # scheduler state, shared with the audio callback
+        self.lock = threading.Lock()
+        self.queues = {priority: deque() for priority in PRIORITY_NAMES}
+        self.active = {"speech": None, "cue": None}  # alerts and UI sounds share the cue lane
+        self.gains = {"speech": 1.0, "cue": 1.0}  # per lane, for ducking
+        self.idle_events = {priority: threading.Event() for priority in PRIORITY_NAMES}
+        for event in self.idle_events.values():
+            event.set()
+        self.finished_event = threading.Event()
+        self.finished_event.set()
+        self.speaking_count = 0
+        self.speaking_lock = threading.Lock()
+
+        self.decoded = OrderedDict()  # path -> (mtime, samples), least recently used first
+        self.preloaded = {}
+
+        # start/finish notifications are handled off the audio thread
+        self.events = queue.Queue()
+        threading.Thread(target=self._dispatch_events, daemon=True).start()
+
+        self.audio = pyaudio.PyAudio()
+        self.stream = None
+        self.open_stream()
+        for sound_file in set(CUES.values()):
+            self.preload(sound_file)
+
+    @property
+    def sound_playing(self):
+        return not self.finished_event.is_set()
+
+    def open_stream(self):
+        if self.stream is not None:
+            return True
+        try:
+            self.stream = self.audio.open(
+                format=pyaudio.paFloat32,
+                channels=1,
+                rate=self.sample_rate,
+                output=True,
+                frames_per_buffer=self.buffer_frames,
+                stream_callback=self._callback
+            )
+            self.stream.start_stream()
+            return True
+        except Exception as e:
+            logger.error(f"Could not open audio output stream: {str(e)}")
+            self.stream = None
+            return False
+
+    def close(self):
+        self.stop_sound()
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        self.audio.terminate()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        events = []
+        with self.lock:
+            # an alert preempts a UI sound, which fades out on this buffer
+            cue = self.active["cue"]
+            if cue is not None and cue.priority == UI and self.queues[ALERT]:
+                cue.stopping = True
+
+            played = set()
+            cue_out = self._fill_lane("cue", frame_count, events, played)
+            speech_out = self._fill_lane("speech", frame_count, events, played)
+
+            # only a higher class ducks: speech under an alert, a UI sound under speech
+            self._duck("speech", speech_out, ALERT in played)
+            self._duck("cue", cue_out, UI in played and SPEECH in played)
+
+            if events:
+                self._update_idle()
+
+        for event in events:
+            self.events.put(event)
+        return np.clip(cue_out + speech_out, -1.0, 1.0).tobytes(), pyaudio.paContinue
+
+    def _duck(self, lane, out, ducked):
+        # callers hold self.lock; gain changes are ramped over one buffer
+        target_gain = SPEECH_DUCK_GAIN if ducked else 1.0
+        if self.gains[lane] != target_gain:
+            out *= np.linspace(self.gains[lane], target_gain, len(out), dtype=np.float32)
+        elif target_gain != 1.0:
+            out *= target_gain
+        self.gains[lane] = target_gain
+
+    def _fill_lane(self, lane, frame_count, events, played):
+        # callers hold self.lock; queued sounds start on the exact sample the previous one ended
+        out = np.zeros(frame_count, dtype=np.float32)
+        offset = 0
+        while offset < frame_count:
+            playback = self.active[lane]
+            if playback is None:
+                playback = self._next_queued(lane)
+                if playback is None:
+                    break
+                playback.started_time = time.perf_counter()
+                self.active[lane] = playback
+                events.append(("started", playback, False))
+
+            chunk = playback.samples[playback.position:playback.position + frame_count - offset]
+            if playback.stopping:
+                # fade out so stopping doesn't click
+                chunk = chunk * np.linspace(1.0, 0.0, len(chunk), dtype=np.float32)
+            out[offset:offset + len(chunk)] = chunk
+            played.add(playback.priority)
+            playback.position += len(chunk)
+            offset += len(chunk)
+
+            if playback.stopping or playback.position >= len(playback.samples):
+                self.active[lane] = None
+                events.append(("finished", playback, playback.stopping))
+        return out
+
+    def _next_queued(self, lane):
+        # callers hold self.lock
+        priorities = [SPEECH] if lane == "speech" else [ALERT, UI]
+        for priority in priorities:
+            if self.queues[priority]:
+                return self.queues[priority].popleft()
+        return None
+
+    def _update_idle(self):
+        # callers hold self.lock
+        active_priorities = {playback.priority for playback in self.active.values() if playback is not None}
+        for priority, event in self.idle_events.items():
+            if self.queues[priority] or priority in active_priorities:
+                event.clear()
+            else:
+                event.set()
+        if all(event.is_set() for event in self.idle_events.values()):
+            self.finished_event.set()
+        else:
+            self.finished_event.clear()
+
+    def _dispatch_events(self):
+        while True:
+            kind, playback, stopped = self.events.get()
+            if kind == "started":
+                name = PRIORITY_NAMES[playback.priority]
+                delay = playback.started_time - playback.queued_time
+                metrics.record("sound.schedule_delay", delay)
+                metrics.record(f"sound.schedule_delay.{name}", delay)
+                metrics.gauge(f"sound.queue_depth.{name}", len(self.queues[playback.priority]))
+                print(f"Playing sound: {playback.name}")
+                if playback.show_voice_box:
                     signal_manager.show_voice_box.emit()
                     signal_manager.sound_started.emit()
-                if is_speaking:
-                    signal_manager.voice_set_is_speaking.emit(True)
-                    signal_manager.action_set_is_speaking.emit(True)
-        else:
+                if playback.is_speaking:
+                    playback.speaking = True
+                    self.set_speaking(True)
+                continue
+
+            if playback.speaking:
+                # sounds dropped before they started never held is_speaking
+                playback.speaking = False
+                self.set_speaking(False)
+            if playback.on_finished:
+                try:
+                    playback.on_finished(stopped)
+                except Exception as e:
+                    logger.error(f"Error in completion callback for {playback.name}: {str(e)}")
+            if self.finished_event.is_set():
+                signal_manager.sound_finished.emit()
+
+    def set_speaking(self, speaking):
+        # counts the sounds and utterances that are speaking, only the first start and last end are signalled
+        with self.speaking_lock:
+            was_speaking = self.speaking_count > 0
+            self.speaking_count = max(self.speaking_count + (1 if speaking else -1), 0)
+            changed = (self.speaking_count > 0) != was_speaking
+        if changed:
+            signal_manager.voice_set_is_speaking.emit(speaking)
+            signal_manager.action_set_is_speaking.emit(speaking)
+
+    def preload(self, sound_file):
+        # keeps the decoded sound in memory for the lifetime of the player
+        try:
+            self.preloaded[sound_file] = self.load(sound_file)
+        except Exception as e:
+            logger.error(f"Could not preload {sound_file}: {str(e)}")
+
+    def load(self, sound_file):
+        if sound_file in self.preloaded:
+            return self.preloaded[sound_file]
+
+        mtime = os.path.getmtime(sound_file)
+        cached = self.decoded.get(sound_file)
+        if cached and cached[0] == mtime:
+            self.decoded.move_to_end(sound_file)
+            return cached[1]
+
+        samples, sample_rate = decode_audio(sound_file)
+        samples = resample(samples, sample_rate, self.sample_rate).astype(np.float32)
+        self.decoded[sound_file] = (mtime, samples)
+        while len(self.decoded) > DECODED_SOUNDS_CACHE_SIZE:
+            self.decoded.popitem(last=False)
+        return samples
+
+    def play_sound(self, sound_file, show_voice_box=True, is_speaking=True, on_finished=None, priority=SPEECH):
+        if not os.path.exists(sound_file):
             print(f"Sound file not found: {sound_file}")
+            return False
+        try:
+            samples = self.load(sound_file)
+        except Exception as e:
+            print(f"Could not decode {sound_file}: {str(e)}")
+            return False
+        return self.play_pcm(samples, self.sample_rate, show_voice_box, is_speaking, on_finished, priority, name=sound_file)
 
-    def _monitor_sound_playback(self, is_speaking=True):
-        while self.sound_process.poll() is None:
-            if self.stop_event.is_set():
-                if is_speaking:
-                    signal_manager.voice_set_is_speaking.emit(False)
-                    signal_manager.action_set_is_speaking.emit(False)
-                self.sound_process.terminate()
-                break
-            time.sleep(0.1)
-        self._reset_sound_state(False)
-        signal_manager.sound_finished.emit()
-
-        if is_speaking: 
-            signal_manager.voice_set_is_speaking.emit(False)
-            signal_manager.action_set_is_speaking.emit(False)
+    def play_pcm(self, samples, sample_rate, show_voice_box=True, is_speaking=True, on_finished=None,
+                 priority=SPEECH, name="pcm"):
+        """
+        Queues float32 mono samples for playback in the given priority class.
+        on_finished(stopped) is called once the last sample was played, or the
+        sound was stopped before that.
+        """
+        if not self.open_stream():
+            return False
 
-    def _reset_sound_state(self, is_speaking=False):
-        self.sound_process = None
-        self.sound_playing = False
+        samples = np.asarray(samples, dtype=np.float32)
+        if sample_rate != self.sample_rate:
+            samples = resample(samples, sample_rate, self.sample_rate).astype(np.float32)
+
+        playback = Playback(samples, name, priority, show_voice_box, is_speaking, on_finished)
+        with self.lock:
+            self.queues[priority].append(playback)
+            depth = len(self.queues[priority])
+            self._update_idle()
+        metrics.gauge(f"sound.queue_depth.{PRIORITY_NAMES[priority]}", depth)
+        return True
+
+    def stop_sound(self, is_speaking=False, priority=None):
+        # drops queued sounds; playing ones fade out and finish on the next buffer
+        priorities = list(PRIORITY_NAMES) if priority is None else [priority]
+        dropped = []
+        with self.lock:
+            for queued_priority in priorities:
+                dropped.extend(self.queues[queued_priority])
+                self.queues[queued_priority].clear()
+            for playback in self.active.values():
+                if playback is not None and playback.priority in priorities:
+                    playback.stopping = True
+            self._update_idle()
+
+        for playback in dropped:
+            self.events.put(("finished", playback, True))
         if is_speaking:
             signal_manager.voice_set_is_speaking.emit(False)
             signal_manager.action_set_is_speaking.emit(False)
-        self.stop_event.clear()
 
-    def stop_sound(self, is_speaking=False):
-        if self.sound_process:
-            self.stop_event.set()
-            if is_speaking:
-                signal_manager.voice_set_is_speaking.emit(False)
-                signal_manager.action_set_is_speaking.emit(False)
-            signal_manager.sound_finished.emit()
+    def clear_queue(self, priority):
+        # drops sounds that haven't started yet, the playing one carries on
+        with self.lock:
+            dropped = list(self.queues[priority])
+            self.queues[priority].clear()
+            self._update_idle()
+        for playback in dropped:
+            self.events.put(("finished", playback, True))
+
+    def queue_depths(self):
+        with self.lock:
+            return {PRIORITY_NAMES[priority]: len(queued) for priority, queued in self.queues.items()}
+
+    def wait_until_finished(self, timeout=None, priority=None):
+        # blocks until everything (or everything of one priority class) has played or was stopped
+        event = self.finished_event if priority is None else self.idle_events[priority]
+        return event.wait(timeout)
 
     def play_decisions_sound(self):
-        sound_file = os.path.join(ASSETS_DIR, "sounds", "decisions.mp3")
-        self.play_sound(sound_file, False, False)
+        self.play_sound(DECISIONS_SOUND, False, False, priority=UI)
+
+    def play_cue(self, name):
+        if name not in CUES:
+            logger.warning(f"Unknown sound cue: {name}")
+            return False
+        return self.play_sound(CUES[name], show_voice_box=False, is_speaking=False, priority=UI)
 
     def is_sound_playing(self, is_speaking=True):
         if is_speaking:
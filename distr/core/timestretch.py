@@ -0,0 +1,54 @@
+"""
+Time-stretching of synthesized speech for the playback_speed setting.
+
+Uses WSOLA (waveform similarity overlap-add): windowed frames are taken from
+the input at `speed` times the output hop, and each frame's position is
+nudged within a small tolerance to the offset that best continues the
+previous frame, so pitch is kept and there is no phasiness. The search for
+the best offset is a single matrix product per frame.
+"""
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
+
+FRAME_MS = 30
+TOLERANCE_MS = 10
+
+
+def time_stretch(samples, speed, sample_rate, frame_ms=FRAME_MS, tolerance_ms=TOLERANCE_MS):
+    """
+    Returns the samples played `speed` times faster (speed > 1) or slower
+    (speed < 1) at the same pitch.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if abs(speed - 1.0) < 1e-3 or len(samples) == 0:
+        return samples
+
+    frame = int(sample_rate * frame_ms / 1000) // 2 * 2
+    hop = frame // 2
+    tolerance = int(sample_rate * tolerance_ms / 1000)
+    window = np.hanning(frame).astype(np.float32)
+
+    padded = np.pad(samples, (tolerance, frame + hop + tolerance))
+    output_length = int(len(samples) / speed)
+    frame_count = output_length // hop + 1
+
+    output = np.zeros(frame_count * hop + frame, dtype=np.float32)
+    norm = np.zeros_like(output)
+    previous = None
+    for index in range(frame_count):
+        position = tolerance + int(round(index * hop * speed))
+        if position + frame + tolerance > len(padded):
+            break
+
+        if previous is not None:
+            # the samples that would naturally follow the previous frame
+            target = padded[previous + hop:previous + hop + frame]
+            candidates = sliding_window_view(padded[position - tolerance:position + tolerance + frame], frame)
+            position += int(np.argmax(candidates @ target)) - tolerance
+
+        output[index * hop:index * hop + frame] += padded[position:position + frame] * window
+        norm[index * hop:index * hop + frame] += window
+        previous = position
+
+    output /= np.maximum(norm, 1e-3)
+    return output[:output_length]
@@ -0,0 +1,168 @@
+"""
+Whisper transcription jobs, run on a worker thread instead of in the Qt slot
+that stopped the recording.
+
+Jobs are taken from a priority queue. A job can be cancelled while it is
+waiting. A job that is already running is finished, but its result is thrown
+away. A job whose transcription fails (for example because the Whisper model
+could not be loaded) is reported through job_failed; an error in the callback
+that acts on the text is reported through action_failed instead. Every job
+records how long it waited in the queue and how long Whisper took.
+"""
+from distr.core.metrics import metrics
+from PyQt6.QtCore import QObject, pyqtSignal
+import itertools
+import threading
+import logging
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class TranscriptionJob:
+    def __init__(self, job_id, audio, callback=None, priority=PRIORITY_NORMAL, task="transcribe"):
+        self.id = job_id
+        self.audio = audio  # float32 mono 16 kHz samples
+        self.callback = callback
+        self.priority = priority
+        self.task = task
+
+        self.cancelled = False
+        self.submitted_time = time.time()
+        self.started_time = None
+        self.finished_time = None
+        self.result = None
+        self.error = None
+
+    @property
+    def queue_wait(self):
+        return (self.started_time or time.time()) - self.submitted_time
+
+    @property
+    def transcription_time(self):
+        if self.started_time is None or self.finished_time is None:
+            return None
+        return self.finished_time - self.started_time
+
+
+class TranscriptionService(QObject):
+    job_completed = pyqtSignal(dict)
+    job_cancelled = pyqtSignal(int)
+    job_failed = pyqtSignal(int, str)     # Whisper couldn't transcribe the audio
+    action_failed = pyqtSignal(int, str)  # the callback failed on the transcribed text
+
+    def __init__(self, get_model):
+        super().__init__()
+        self.get_model = get_model  # blocks until the Whisper model is loaded, raises if it failed
+
+        self.jobs = queue.PriorityQueue()
+        self.pending = {}
+        self.current_job = None
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+        self.running = True
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, audio, callback=None, priority=PRIORITY_NORMAL, task="transcribe"):
+        job = TranscriptionJob(next(self.ids), audio, callback, priority, task)
+        with self.lock:
+            self.pending[job.id] = job
+        self.jobs.put((priority, job.id, job))
+        print(f"Queued transcription job {job.id} (priority {priority}, {len(audio) / 16000:.1f} s of audio)")
+        return job
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.pending.get(job_id)
+            if self.current_job and self.current_job.id == job_id:
+                job = self.current_job
+            if job is None:
+                return False
+            job.cancelled = True
+        print(f"Cancelled transcription job {job_id}")
+        self.job_cancelled.emit(job_id)
+        return True
+
+    def cancel_all(self):
+        with self.lock:
+            job_ids = list(self.pending.keys())
+            if self.current_job:
+                job_ids.append(self.current_job.id)
+        for job_id in job_ids:
+            self.cancel(job_id)
+
+    def has_pending(self):
+        with self.lock:
+            return bool(self.pending) or self.current_job is not None
+
+    def run(self):
+        while self.running:
+            try:
+                _, _, job = self.jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                self.pending.pop(job.id, None)
+                if job.cancelled:
+                    continue
+                self.current_job = job
+
+            try:
+                self.process_job(job)
+            finally:
+                with self.lock:
+                    self.current_job = None
+
+    def process_job(self, job):
+        try:
+            model = self.get_model()
+            job.started_time = time.time()
+            result = model.transcribe(job.audio, task=job.task, fp16=False)
+            job.finished_time = time.time()
+        except Exception as e:
+            job.error = str(e)
+            logger.error(f"Error in transcription job {job.id}: {str(e)}", exc_info=True)
+            if not job.cancelled:
+                self.job_failed.emit(job.id, job.error)
+            return
+
+        if job.cancelled:
+            print(f"Dropped result of cancelled transcription job {job.id}")
+            return
+
+        job.result = result
+        metrics.record("transcription.queue_wait", job.queue_wait)
+        metrics.record("transcription.whisper", job.transcription_time)
+        logger.info(
+            f"Transcription job {job.id}: waited {job.queue_wait:.2f} s, "
+            f"transcribed in {job.transcription_time:.2f} s"
+        )
+
+        if job.callback:
+            try:
+                with metrics.timer("transcription.action"):
+                    job.callback(result)
+            except Exception as e:
+                job.error = str(e)
+                logger.error(f"Error acting on transcription job {job.id}: {str(e)}", exc_info=True)
+                self.action_failed.emit(job.id, job.error)
+
+        self.job_completed.emit({
+            "job_id": job.id,
+            "text": result["text"],
+            "language": result.get("language"),
+            "queue_wait": job.queue_wait,
+            "transcription_time": job.transcription_time,
+        })
+
+    def stop(self):
+        self.running = False
+        self.cancel_all()
@@ -0,0 +1,402 @@
+"""
+Text-to-speech for the assistant's spoken responses.
+
+Speech requests go onto a queue served by one worker thread, so callers (the
+listener included) never block on synthesis. Each request gets a TTSRequest
+handle that can be waited on or cancelled, and new speech on a channel
+supersedes whatever is still pending or speaking on that channel.
+
+Long responses are split into sentences (or clauses). Playback of the first
+chunk starts while the later chunks are still being generated, so the time to
+first audio depends on the length of the first sentence rather than the
+whole response. Stopping cancels whatever synthesis is still pending.
+"""
+from PyQt6.QtCore import QObject, pyqtSignal
+from distr.core.constants import TMP_DIR, TTS_PIPELINED, TTS_FIRST_CHUNK_CHARS, TTS_MAX_CHUNK_CHARS
+from distr.core.tts_engines import select_engine, write_wav
+from distr.core.timestretch import time_stretch
+from distr.core.tts_cache import TTSCache
+from distr.core.phrases import PhraseBank
+from distr.core.utils import load_preferences_config
+from distr.core.signals import signal_manager
+from distr.core.sound import ALERT, SPEECH, load_wav
+from distr.core.metrics import metrics
+import itertools
+import threading
+import logging
+import glob
+import queue
+import time
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+tts_model_ready = threading.Event()
+
+SENTENCE_END = re.compile(r'(?<=[.!?;])\s+')
+CLAUSE_END = re.compile(r'(?<=[,])\s+')
+
+
+def split_sentences(text, first_chunk_chars=TTS_FIRST_CHUNK_CHARS, max_chunk_chars=TTS_MAX_CHUNK_CHARS):
+    """
+    Split text into chunks that can be synthesized independently. The first
+    chunk is kept short (split at a clause if needed) to get audio out fast.
+    """
+    chunks = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        current = ""
+        for clause in CLAUSE_END.split(sentence.strip()):
+            for word in clause.split():
+                limit = first_chunk_chars if not chunks else max_chunk_chars
+                if current and len(current) + 1 + len(word) > limit:
+                    chunks.append(current)
+                    current = word
+                else:
+                    current = f"{current} {word}" if current else word
+
+            # the first chunk may end at a clause once it is long enough
+            if not chunks and len(current) >= first_chunk_chars // 2:
+                chunks.append(current)
+                current = ""
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def stream_sentences(tokens, first_chunk_chars=TTS_FIRST_CHUNK_CHARS):
+    """
+    Groups streamed tokens into sentences, yielding each one as soon as it is
+    complete. A long first sentence is cut at a clause so speech starts early.
+    """
+    buffer = ""
+    first = True
+    for token in tokens:
+        buffer += token
+        sentences = SENTENCE_END.split(buffer)
+        buffer = sentences.pop()
+        if first and not sentences and len(buffer) >= first_chunk_chars:
+            clauses = CLAUSE_END.split(buffer)
+            if len(clauses) > 1:
+                sentences = [" ".join(clauses[:-1])]
+                buffer = clauses[-1]
+
+        for sentence in sentences:
+            if sentence.strip():
+                first = False
+                yield sentence.strip()
+    if buffer.strip():
+        yield buffer.strip()
+
+
+class TTSRequest:
+    """
+    Handle for a queued utterance. wait() blocks until it has been spoken,
+    cancelled or failed; cancel() drops it, or stops it if it is speaking.
+    A streamed request is fed text while it is already speaking, and ends
+    when it is closed.
+    """
+    def __init__(self, manager, request_id, channel, streaming=False):
+        self.manager = manager
+        self.id = request_id
+        self.text = ""
+        self.channel = channel
+        self.streaming = streaming
+
+        self.chunks = queue.Queue()
+        self.chunk_count = 0
+        self.cancelled = False
+        self.error = None
+        self.finished = threading.Event()
+        self.submitted_time = time.perf_counter()
+
+    def feed(self, text):
+        first = self.chunk_count == 0
+        self.text = f"{self.text} {text}".strip()
+        if self.manager.pipelined:
+            first_chunk_chars = TTS_FIRST_CHUNK_CHARS if first else TTS_MAX_CHUNK_CHARS
+            chunks = split_sentences(text, first_chunk_chars, TTS_MAX_CHUNK_CHARS)
+        else:
+            chunks = [text.strip()]
+        for chunk in chunks:
+            if chunk:
+                self.chunk_count += 1
+                self.chunks.put(chunk)
+
+    def close(self):
+        self.chunks.put(None)
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def cancel(self):
+        self.manager.cancel(self)
+
+    @property
+    def done(self):
+        return self.finished.is_set()
+
+
+class TTSManager(QObject):
+    tts_started = pyqtSignal(int)
+    tts_progress = pyqtSignal(int, int, int)  # request id, chunks queued for playback, total chunks
+    tts_cancelled = pyqtSignal(int)
+    tts_completed = pyqtSignal(str)
+    tts_error = pyqtSignal(str)
+
+    def __init__(self, sound_player):
+        super().__init__()
+        self.engine = select_engine()
+        self.sound_player = sound_player  # Use the provided SoundPlayer instance
+        self.speaker = self.engine.default_speaker
+        self.speed = 1.0
+        self.pipelined = TTS_PIPELINED
+        self.cache = TTSCache()
+        self.remove_legacy_outputs()
+        self.phrase_bank = PhraseBank(self)
+
+        # utterances are synthesized and spoken one at a time on a worker thread
+        self.requests = queue.Queue()
+        self.pending = []
+        self.current_request = None
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+        signal_manager.stop_sound_player.connect(self.stop)
+        signal_manager.sound_stopped.connect(self.stop)
+
+        # the model loads in the background; speech requested before it is
+        # ready waits in the queue
+        self.load_error = None
+        threading.Thread(target=self.initialize_tts_model, daemon=True).start()
+        self.phrase_bank.warm()
+
+        self.running = True
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def initialize_tts_model(self):
+        print(f"Initializing TTS model ({self.engine.name})...")
+        start_time = time.perf_counter()
+        try:
+            self.engine.load()
+            self.apply_settings(load_preferences_config(), rerender=False)
+            metrics.record("tts.model_load", time.perf_counter() - start_time)
+            print(f"TTS model initialized in {time.perf_counter() - start_time:.1f} s.")
+        except Exception as e:
+            # queued requests fail with this error instead of waiting forever
+            self.load_error = e
+            logger.error(f"Error loading TTS model: {str(e)}", exc_info=True)
+        tts_model_ready.set()  # Signal that the TTS model is ready
+
+    @property
+    def is_ready(self):
+        return tts_model_ready.is_set() and self.load_error is None
+
+    def synthesize_to_file(self, text):
+        # repeated phrases are played from the cache without any synthesis
+        speaker, speed = self.speaker, self.speed
+        key = self.cache.make_key(text, speaker, self.engine.model_name, speed)
+        cached_file = self.cache.get(key)
+        if cached_file:
+            return cached_file
+
+        # other speeds are derived from the speed 1.0 rendering, never resynthesized
+        base_key = self.cache.make_key(text, speaker, self.engine.model_name, 1.0)
+        base_file = self.cache.get(base_key) if base_key != key else None
+        if base_file is None:
+            with metrics.timer("tts.synthesis"):
+                base_file = self.cache.store(
+                    base_key,
+                    lambda path: self.engine.synthesize_to_file(text, path, speaker),
+                    text
+                )
+        if base_key == key:
+            return base_file
+
+        with metrics.timer("tts.time_stretch"):
+            return self.cache.store(key, lambda path: self.stretch_file(base_file, path, speed), text)
+
+    def stretch_file(self, source_path, path, speed):
+        samples, sample_rate = load_wav(source_path)
+        write_wav(path, time_stretch(samples, speed, sample_rate), sample_rate)
+
+    def remove_legacy_outputs(self):
+        # responses used to be written to assets/tmp/output_<md5>.wav and never removed
+        for path in glob.glob(os.path.join(TMP_DIR, "output_*.wav")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def wait_until_ready(self, timeout=None):
+        return tts_model_ready.wait(timeout)
+
+    def apply_settings(self, settings, rerender=True):
+        speaker = settings.get("tts_voice_id") or settings.get("tts_voice") or self.speaker
+        if speaker not in self.engine.speakers:
+            speaker = self.speaker
+        speed = float(settings.get("playback_speed", self.speed))
+
+        if (speaker, speed) != (self.speaker, self.speed):
+            print(f"TTS voice: {speaker}, speed: {speed:.2f}x")
+            self.speaker = speaker
+            self.speed = speed
+            if rerender:
+                self.phrase_bank.rerender()
+
+    def start_tts(self, text, channel="response"):
+        """
+        Queues text to be spoken and returns straight away with a TTSRequest.
+        New speech supersedes whatever is pending or speaking on the same channel.
+        """
+        request = TTSRequest(self, next(self.ids), channel)
+        if channel == "system":
+            # a rendered system phrase plays at once as an alert, over a response
+            # that is still speaking (which is ducked) instead of queueing behind it
+            key = self.phrase_bank.lookup(text)
+            if key and self.phrase_bank.play(key, priority=ALERT, on_finished=lambda stopped: request.finished.set()):
+                request.text = text
+                return request
+        request.feed(text)
+        request.close()
+        return self.submit(request)
+
+    def start_tts_stream(self, channel="response"):
+        # returns a TTSRequest to feed() sentences into as they arrive, and close()
+        return self.submit(TTSRequest(self, next(self.ids), channel, streaming=True))
+
+    def submit(self, request):
+        channel = request.channel
+        with self.lock:
+            stale = [pending for pending in self.pending if pending.channel == channel]
+            if self.current_request and self.current_request.channel == channel:
+                stale.append(self.current_request)
+            self.pending.append(request)
+        for stale_request in stale:
+            self.cancel(stale_request)
+
+        if not tts_model_ready.is_set():
+            print(f"TTS model still loading, request {request.id} queued")
+        self.requests.put(request)
+        return request
+
+    def cancel(self, request):
+        with self.lock:
+            if request.done or request.cancelled:
+                return False
+            request.cancelled = True
+            if request in self.pending:
+                self.pending.remove(request)
+                request.finished.set()
+            is_speaking = request is self.current_request
+        request.chunks.put(None)  # unblocks the worker if it waits for streamed text
+
+        if is_speaking:
+            # its queued chunks are dropped, the playing one fades out
+            self.sound_player.stop_sound(priority=SPEECH)
+        print(f"TTS request {request.id} cancelled")
+        self.tts_cancelled.emit(request.id)
+        return True
+
+    def stop(self):
+        # cancels everything that is pending or speaking
+        with self.lock:
+            requests = list(self.pending)
+            if self.current_request:
+                requests.append(self.current_request)
+        for request in requests:
+            self.cancel(request)
+
+    def run(self):
+        self.wait_until_ready()
+        while self.running:
+            try:
+                request = self.requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                if request.cancelled:
+                    continue
+                self.pending.remove(request)
+                self.current_request = request
+
+            try:
+                self.speak(request)
+            except Exception as e:
+                request.error = e
+                print(f"TTS Error: {str(e)}")
+                self.tts_error.emit(str(e))
+            finally:
+                with self.lock:
+                    self.current_request = None
+                request.finished.set()
+
+    def speak(self, request):
+        if self.load_error:
+            raise RuntimeError(f"TTS model failed to load: {self.load_error}")
+        metrics.record("tts.queue_wait", time.perf_counter() - request.submitted_time)
+        self.tts_started.emit(request.id)
+
+        # fixed phrases are pre-rendered and play without synthesis
+        phrase_key = None if request.streaming else self.phrase_bank.lookup(request.text)
+        if phrase_key:
+            self.phrase_bank.play(phrase_key)
+            self.sound_player.wait_until_finished(priority=SPEECH)
+            return
+
+        # chunks are queued as soon as they are synthesized and play back to back;
+        # a streamed request waits here for the next sentence
+        start_time = time.perf_counter()
+        last_file = None
+        index = 0
+        try:
+            while True:
+                chunk = request.chunks.get()
+                if chunk is None or request.cancelled:
+                    if request.cancelled:
+                        print(f"TTS cancelled, skipped {request.chunk_count - index} pending chunks")
+                    break
+                last_file = self.synthesize_to_file(chunk)
+                if request.cancelled:
+                    break
+
+                if index == 0:
+                    # one is_speaking for the whole utterance, however many chunks it has
+                    self.sound_player.set_speaking(True)
+                self.sound_player.play_sound(last_file, is_speaking=False, priority=SPEECH)
+                index += 1
+                self.tts_progress.emit(request.id, index, request.chunk_count)
+                if index == 1:
+                    self.record_time_to_first_audio(time.perf_counter() - start_time, len(request.text))
+
+            self.sound_player.wait_until_finished(priority=SPEECH)
+        finally:
+            if index:
+                self.sound_player.set_speaking(False)
+
+        if last_file and not request.cancelled:
+            metrics.record("tts.total_time", time.perf_counter() - start_time)
+            self.tts_completed.emit(last_file)
+
+    def shutdown(self):
+        self.running = False
+        self.stop()
+        self.cache.flush()
+
+    def record_time_to_first_audio(self, seconds, text_length):
+        # bucketed by text length, so long answers can be compared with short ones
+        if text_length < 100:
+            bucket = "short"
+        elif text_length < 500:
+            bucket = "medium"
+        else:
+            bucket = "long"
+        metrics.record("tts.time_to_first_audio", seconds)
+        metrics.record(f"tts.time_to_first_audio.{bucket}", seconds)
+        logger.info(f"TTS time to first audio: {seconds:.2f} s for {text_length} characters")
+
+
+def initialize_tts_manager(sound_player):
+    return TTSManager(sound_player)
@@ -0,0 +1,173 @@
+"""
+Persistent, content-addressed cache of synthesized speech.
+
+Entries are keyed by a hash of (text, speaker, model, speed), so a phrase
+that was spoken before is played straight from disk without any synthesis.
+Renderings at other playback speeds are stored as entries of their own,
+time-stretched from the speed 1.0 entry.
+The cache keeps an on-disk JSON index with sizes and last-access times and
+evicts the least recently used entries once it grows past its byte quota.
+Cache hits only touch the index in memory; it is written on every store, at
+most every TTS_CACHE_FLUSH_SECONDS otherwise, and on flush().
+Audio files and the index are written to a temporary file first and then
+renamed into place, so a crash never leaves a half-written entry behind.
+
+Several processes can share the cache (the app and the batch renderer). Audio
+files the index doesn't know are adopted into it rather than deleted, the
+on-disk index is merged in before it is rewritten, and only temporary files
+older than TTS_CACHE_TMP_GRACE_SECONDS are treated as crash leftovers.
+"""
+from distr.core.constants import TTS_CACHE_DIR, TTS_CACHE_QUOTA_MB, TTS_CACHE_FLUSH_SECONDS, TTS_CACHE_TMP_GRACE_SECONDS
+from distr.core.utils import load_preferences_config
+from distr.core.metrics import metrics
+import threading
+import tempfile
+import hashlib
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+
+
+class TTSCache:
+    def __init__(self, cache_dir=TTS_CACHE_DIR, quota_bytes=None):
+        if quota_bytes is None:
+            quota_mb = load_preferences_config().get("tts_cache_quota_mb", TTS_CACHE_QUOTA_MB)
+            quota_bytes = int(quota_mb * 1024 * 1024)
+
+        self.cache_dir = cache_dir
+        self.quota_bytes = quota_bytes
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.lock = threading.Lock()
+        self.dirty = False  # last-access times not written to the index yet
+        self.last_flush = time.time()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entries = self.load_index()
+
+    @staticmethod
+    def make_key(text, speaker, model, speed=1.0):
+        payload = json.dumps([text, speaker, model, round(float(speed), 3)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def read_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logger.error(f"Invalid TTS cache index at {self.index_path}, ignoring it")
+        return {}
+
+    def adopt(self, key):
+        # an entry for an audio file another process stored, or None
+        try:
+            stat = os.stat(self.path_for(key))
+        except OSError:
+            return None
+        return {"size": stat.st_size, "last_access": stat.st_mtime, "text": ""}
+
+    def load_index(self):
+        # drops entries whose audio is gone and adopts audio the index doesn't know
+        entries = {key: entry for key, entry in self.read_index().items() if os.path.exists(self.path_for(key))}
+        now = time.time()
+        for filename in os.listdir(self.cache_dir):
+            key, extension = os.path.splitext(filename)
+            path = os.path.join(self.cache_dir, filename)
+            if extension == ".wav" and key not in entries:
+                entry = self.adopt(key)
+                if entry:
+                    entries[key] = entry
+            elif extension == ".tmp":
+                try:
+                    if now - os.path.getmtime(path) > TTS_CACHE_TMP_GRACE_SECONDS:
+                        os.remove(path)  # left behind by a crash
+                except OSError:
+                    pass
+        return entries
+
+    def save_index(self):
+        # callers hold self.lock; entries other processes added since are kept
+        for key, entry in self.read_index().items():
+            if key not in self.entries and os.path.exists(self.path_for(key)):
+                self.entries[key] = entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+        self.dirty = False
+        self.last_flush = time.time()
+
+    def flush(self):
+        # writes last-access times that only changed in memory
+        with self.lock:
+            if self.dirty:
+                self.save_index()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key) or self.adopt(key)
+            if entry is None or not os.path.exists(self.path_for(key)):
+                self.entries.pop(key, None)
+                metrics.increment("tts.cache.miss")
+                return None
+            entry["last_access"] = time.time()
+            self.entries[key] = entry
+            self.dirty = True
+            if time.time() - self.last_flush > TTS_CACHE_FLUSH_SECONDS:
+                self.save_index()
+        metrics.increment("tts.cache.hit")
+        return self.path_for(key)
+
+    def store(self, key, write_audio, text=""):
+        """
+        write_audio(path) renders the audio into the given path; the result
+        only becomes visible under the key once it has been fully written.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            write_audio(tmp_path)
+            os.replace(tmp_path, self.path_for(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self.lock:
+            self.entries[key] = {
+                "size": os.path.getsize(self.path_for(key)),
+                "last_access": time.time(),
+                "text": text[:80],
+            }
+            self.evict(keep=key)
+            self.save_index()
+        return self.path_for(key)
+
+    def evict(self, keep=None):
+        # callers hold self.lock; removes least recently used entries
+        total = sum(entry["size"] for entry in self.entries.values())
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.quota_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+            total -= entry["size"]
+            del self.entries[key]
+            metrics.increment("tts.cache.evicted")
+
+    def size(self):
+        with self.lock:
+            return sum(entry["size"] for entry in self.entries.values())
@@ -0,0 +1,201 @@
+"""
+Text-to-speech engines behind TTSManager.
+
+- CoquiVitsEngine: Coqui's multi-speaker VCTK VITS model, the best sounding
+  voice but heavy to load and slow on CPU-only machines
+- PiperEngine: a Piper ONNX voice, small and fast enough for Raspberry
+  Pi-class hosts (needs `pip install piper-tts` and a voice in models/piper)
+
+select_engine() picks the best sounding engine that fits into the available
+RAM and whose measured real-time factor (synthesis time / audio duration, see
+scripts/benchmark_tts.py) is within the latency budget. Engines that haven't
+been measured are only used when no measured engine is within budget, fastest
+first (Piper before Coqui). `tts_engine` in preferences.json forces an engine.
+"""
+from distr.core.constants import TTS_MODEL_NAME, TTS_DEFAULT_SPEAKER, TTS_BENCHMARK_FILE, TTS_RTF_BUDGET
+from distr.core.constants import PIPER_MODEL_PATH, PIPER_DEFAULT_SPEAKER
+from distr.core.utils import load_preferences_config
+from abc import ABC, abstractmethod
+import importlib.util
+import numpy as np
+import logging
+import json
+import wave
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def write_wav(path, samples, sample_rate):
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm.tobytes())
+
+
+def available_memory_mb():
+    try:
+        import psutil
+        return psutil.virtual_memory().available / (1024 * 1024)
+    except ImportError:
+        # without psutil, fall back to the total physical memory
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024)
+
+
+class TTSEngine(ABC):
+    name = None
+    model_name = None
+    default_speaker = None
+    min_ram_mb = 0
+
+    def __init__(self):
+        self.sample_rate = None
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    @property
+    def speakers(self):
+        return []
+
+    @abstractmethod
+    def load(self):
+        """Loads the model; called once, on a background thread."""
+
+    @abstractmethod
+    def synthesize(self, text, speaker=None):
+        """Returns (float32 mono samples, sample_rate)."""
+
+    def synthesize_to_file(self, text, path, speaker=None):
+        samples, sample_rate = self.synthesize(text, speaker)
+        write_wav(path, samples, sample_rate)
+
+
+class CoquiVitsEngine(TTSEngine):
+    name = "coqui-vits"
+    model_name = TTS_MODEL_NAME
+    default_speaker = TTS_DEFAULT_SPEAKER
+    min_ram_mb = 2000
+
+    def __init__(self):
+        super().__init__()
+        self.model = None
+
+    @classmethod
+    def is_available(cls):
+        return importlib.util.find_spec("TTS") is not None
+
+    @property
+    def speakers(self):
+        return (self.model.speakers or []) if self.model else []
+
+    def load(self):
+        from TTS.api import TTS
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = TTS(self.model_name).to(device)
+        self.sample_rate = self.model.synthesizer.output_sample_rate
+
+    def synthesize(self, text, speaker=None):
+        samples = self.model.tts(text=text, speaker=speaker or self.default_speaker)
+        return np.asarray(samples, dtype=np.float32), self.sample_rate
+
+    def synthesize_to_file(self, text, path, speaker=None):
+        self.model.tts_to_file(text=text, file_path=path, speaker=speaker or self.default_speaker)
+
+
+class PiperEngine(TTSEngine):
+    name = "piper"
+    model_name = os.path.basename(PIPER_MODEL_PATH)
+    default_speaker = PIPER_DEFAULT_SPEAKER
+    min_ram_mb = 300
+
+    def __init__(self, model_path=PIPER_MODEL_PATH):
+        super().__init__()
+        self.model_path = model_path
+        self.voice = None
+
+    @classmethod
+    def is_available(cls):
+        return importlib.util.find_spec("piper") is not None and os.path.exists(PIPER_MODEL_PATH)
+
+    @property
+    def speakers(self):
+        if self.voice is None:
+            return []
+        # a single speaker voice has no speaker map, its speaker is the voice itself
+        return list(getattr(self.voice.config, "speaker_id_map", None) or {}) or [self.default_speaker]
+
+    def load(self):
+        from piper.voice import PiperVoice
+        self.voice = PiperVoice.load(self.model_path)
+        self.sample_rate = self.voice.config.sample_rate
+
+    def synthesize(self, text, speaker=None):
+        speaker_id = None
+        if speaker is not None:
+            speaker_id = (getattr(self.voice.config, "speaker_id_map", None) or {}).get(speaker)
+
+        if hasattr(self.voice, "synthesize_stream_raw"):
+            audio = b"".join(self.voice.synthesize_stream_raw(text, speaker_id=speaker_id))
+        else:
+            # piper-tts >= 1.3 yields audio chunks instead of raw bytes
+            audio = b"".join(chunk.audio_int16_bytes for chunk in self.voice.synthesize(text))
+        samples = np.frombuffer(audio, dtype=np.int16).astype(np.float32) / 32768.0
+        return samples, self.sample_rate
+
+
+# best sounding first
+ENGINES = [CoquiVitsEngine, PiperEngine]
+# the order for engines without a benchmark
+FASTEST_FIRST = [PiperEngine, CoquiVitsEngine]
+
+
+def load_benchmarks():
+    try:
+        with open(TTS_BENCHMARK_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def select_engine():
+    preferences = load_preferences_config()
+    engines = {engine.name: engine for engine in ENGINES}
+
+    forced = preferences.get("tts_engine", "auto")
+    if forced in engines:
+        print(f"TTS engine: {forced} (from preferences)")
+        return engines[forced]()
+
+    budget = float(preferences.get("tts_rtf_budget", TTS_RTF_BUDGET))
+    memory_mb = available_memory_mb()
+    benchmarks = load_benchmarks()
+
+    candidates = [engine for engine in ENGINES if engine.is_available() and memory_mb >= engine.min_ram_mb]
+    rtfs = {engine.name: benchmarks.get(engine.name, {}).get("rtf") for engine in candidates}
+    for engine in candidates:
+        rtf = rtfs[engine.name]
+        if rtf is not None and rtf <= budget:
+            print(f"TTS engine: {engine.name} (RTF {rtf}, {memory_mb:.0f} MB available)")
+            return engine()
+
+    unmeasured = [engine for engine in FASTEST_FIRST if engine in candidates and rtfs[engine.name] is None]
+    if unmeasured:
+        # run scripts/benchmark_tts.py to choose by measurement
+        engine = next(engine for engine in FASTEST_FIRST if engine in candidates)
+        logger.warning(f"No measured TTS engine within the RTF budget of {budget}, "
+                       f"using {engine.name} ({', '.join(e.name for e in unmeasured)} not measured)")
+        return engine()
+
+    if candidates:
+        # nothing is fast enough, take the fastest one
+        engine = min(candidates, key=lambda e: rtfs[e.name])
+        logger.warning(f"No TTS engine within the RTF budget of {budget}, using the fastest: {engine.name}")
+        return engine()
+
+    logger.warning(f"No TTS engine fits into {memory_mb:.0f} MB, falling back to {CoquiVitsEngine.name}")
+    return CoquiVitsEngine()
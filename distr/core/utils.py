@@ -3,6 +3,8 @@ import os
 from distr.core.constants import CORE_DIR, MODELS_DIR
 
 SETTINGS_DIR = os.path.join(MODELS_DIR, "settings")
+# trigger variants learned from the LLM fallback, merged over actions.config.json
+LEARNED_TRIGGERS_PATH = os.path.join(SETTINGS_DIR, "learned_triggers.json")
 
 import logging
 
@@ -19,9 +21,45 @@ def load_actions_config():
     except json.JSONDecodeError:
         logger.error(f"Error: Invalid JSON in config file at {path}")
         config = {"actions": []}
+
+    learned = load_learned_triggers()
+    for action in config["actions"]:
+        variants = learned.get(action.get("trigger"), [])
+        if variants:
+            known = action.setdefault("trigger_variants", [])
+            known.extend(variant for variant in variants if variant not in known and variant != action["trigger"])
     return config
 
 
+def load_learned_triggers():
+    # {"<action trigger>": ["learned variant", ...]}
+    try:
+        with open(LEARNED_TRIGGERS_PATH, "r") as f:
+            return json.load(f).get("learned", {})
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        logger.error(f"Error: Invalid JSON in learned triggers file at {LEARNED_TRIGGERS_PATH}")
+        return {}
+
+
+def save_learned_trigger(trigger, variant):
+    learned = load_learned_triggers()
+    variants = learned.setdefault(trigger, [])
+    if variant in variants:
+        return
+    variants.append(variant)
+
+    os.makedirs(SETTINGS_DIR, exist_ok=True)
+    tmp_path = f"{LEARNED_TRIGGERS_PATH}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"learned": learned}, f, indent=2)
+        os.replace(tmp_path, LEARNED_TRIGGERS_PATH)
+    except OSError as e:
+        logger.error(f"Error: Could not save learned triggers to {LEARNED_TRIGGERS_PATH}: {e}")
+
+
 def load_preferences_config():    
     path = os.path.join(SETTINGS_DIR, "preferences.json")
     try:
@@ -35,3 +73,14 @@ def load_preferences_config():
         config = {}
     return config
 
+
+def save_preferences_config(config):
+    os.makedirs(SETTINGS_DIR, exist_ok=True)
+    path = os.path.join(SETTINGS_DIR, "preferences.json")
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(config, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Error: Could not save preferences to {path}: {e}")
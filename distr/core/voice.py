@@ -9,8 +9,15 @@ Key components:
 3. Speech recognition
 5. Action handling for recognized speech
 """
-from distr.core.constants import MODELS_DIR, DEFAULT_SILENCE_TIMER, TMP_DIR, WHISPER_MODEL_PATH
+from distr.core.constants import MODELS_DIR, DEFAULT_SILENCE_TIMER, TMP_DIR, WHISPER_MODEL_PATH, VOSK_MAX_ALTERNATIVES
+from distr.core.constants import AUDIO_BUFFER_SECONDS, RESCORE_AUDIO_SECONDS
 from distr.core.utils import load_actions_config
+from distr.core.recorder import AudioRingBuffer
+from distr.core.rescore import SecondPassRescorer
+from distr.core.transcription import TranscriptionService, PRIORITY_NORMAL
+from distr.core.audio_source import PyAudioSource
+from distr.core.metrics import metrics
+from distr.core.phrases import phrase
 from distr.core.signals import signal_manager 
 from distr.core.constants import TMP_DIR
 from PyQt6 import QtCore
@@ -21,10 +28,10 @@ import queue
 import json
 import vosk
 import time
-import hashlib
 import wave
 import os
 import importlib
+import itertools
 import whisper
 import threading
 from typing import Set
@@ -89,9 +96,61 @@ def initialize_model():
         # immediate feedback to the user, enabling features like live
         # transcription display or early trigger word detection. However,
         # these partial results may be less accurate than the final result.
+
+        recognizer.SetMaxAlternatives(VOSK_MAX_ALTERNATIVES)  # Enable n-best results
+        # Instead of a single "text", the final result becomes a list of
+        # "alternatives", each with its own text, confidence and word timings.
+        # The action handler scores all of them against the triggers, so a
+        # mishearing like "moss up" can still resolve to "mouse up".
+
         print("ASR Model loaded successfully.")
 
-        recognizer.SetPartialWords(True)  # Enable partial results
+
+def parse_hypotheses(result):
+    """
+    Turn a Vosk final result into an n-best list, best first:
+    [{"text": str, "confidence": float (0..1), "words": [...]}, ...]
+    """
+    if "alternatives" in result:
+        alternatives = [alt for alt in result["alternatives"] if alt.get("text")]
+        if not alternatives:
+            return []
+
+        # Vosk reports lattice scores, normalise them into posteriors
+        scores = np.array([alt.get("confidence", 0.0) for alt in alternatives], dtype=np.float64)
+        posteriors = np.exp(scores - scores.max())
+        posteriors /= posteriors.sum()
+
+        return [
+            {"text": alt["text"], "confidence": float(posterior), "words": alt.get("result", [])}
+            for alt, posterior in zip(alternatives, posteriors)
+        ]
+
+    if result.get("text"):
+        words = result.get("result", [])
+        confidence = float(np.mean([w.get("conf", 1.0) for w in words])) if words else 1.0
+        return [{"text": result["text"], "confidence": confidence, "words": words}]
+
+    return []
+
+
+def find_phrase_span(words, phrases, first=True):
+    """
+    Find a phrase in a list of Vosk word timings and return its
+    (start, end) time, or None. Picks the first or the last occurrence.
+    """
+    tokens = [w["word"].lower() for w in words]
+    best_span = None
+    for phrase in phrases:
+        phrase_tokens = phrase.lower().split()
+        if not phrase_tokens:
+            continue
+        for i in range(len(tokens) - len(phrase_tokens) + 1):
+            if tokens[i:i + len(phrase_tokens)] == phrase_tokens:
+                span = (words[i]["start"], words[i + len(phrase_tokens) - 1]["end"])
+                if best_span is None or (span[0] < best_span[0] if first else span[0] > best_span[0]):
+                    best_span = span
+    return best_span
 
 
 class ContinuousListener(QtCore.QThread):
@@ -99,7 +158,7 @@ class ContinuousListener(QtCore.QThread):
         energy = np.abs(np.frombuffer(audio_data, dtype=np.int16)).mean()
         return energy > threshold
 
-    def __init__(self, action_handler, chat_manager):
+    def __init__(self, action_handler, chat_manager, audio_source=None):
         print("ContinuousListener initialized")
         print("Action handler:", action_handler)
 
@@ -109,27 +168,37 @@ class ContinuousListener(QtCore.QThread):
 
         self.chat_manager = chat_manager
         self.action_handler = action_handler
-        self.audio = pyaudio.PyAudio()
+        # where the audio comes from: the microphone unless a file or
+        # synthetic source is given (see distr/core/audio_source.py)
+        self.audio_source = audio_source or PyAudioSource()
 
         # Start loading Whisper model in the background
         self.whisper_model = None
+        self.whisper_load_error = None
         self.whisper_buffer = []
-        self.whisper_model_ready = threading.Event()    
-        self.load_whisper_model()
+        self.whisper_model_ready = threading.Event()
+        threading.Thread(target=self.load_whisper_model, daemon=True).start()
+        self.transcription_service = TranscriptionService(self.get_whisper_model)
+        self.transcription_service.job_failed.connect(self.on_transcription_failed)
+        self.transcription_service.action_failed.connect(self.on_action_failed)
 
-        self.stream = None
         self.frames = []
         self.running = True
 
+        # recent microphone audio, used to re-run unsure commands through Whisper
+        self.audio_buffer = AudioRingBuffer(AUDIO_BUFFER_SECONDS)
+        self.rescorer = SecondPassRescorer(self.action_handler.all_triggers) if self.action_handler else None
+        self.rescored = queue.Queue()  # (command id, second pass text) from the rescorer's thread
+        self.pending_rescore = None    # the command waiting for its second pass
+        self.command_ids = itertools.count(1)
+
         self.is_listening = True
         self.is_transcribing = False
         self.is_speaking = False
 
 
-        self.transcription_stream = None
-        self.transcription_frames = []
-
         self.transcription_buffer = []
+        self.transcription_trimmed = False
 
         self.audio_queue = queue.Queue()
 
@@ -157,6 +226,7 @@ class ContinuousListener(QtCore.QThread):
 
         signal_manager.voice_start_transcribing.connect(self.start_transcribing)
         signal_manager.voice_stop_transcribing.connect(self.stop_transcribing)
+        signal_manager.voice_cut_transcribing.connect(self.cut_transcribing)
 
         signal_manager.voice_update_last_speech_time.connect(self.update_last_speech_time)
 
@@ -193,16 +263,25 @@ class ContinuousListener(QtCore.QThread):
                 
         while self.running:
             try:
-                if self.stream and self.stream.is_active():
-                    audio_data = self.stream.read(512, exception_on_overflow=False)
+                if self.audio_source.is_active():
+                    audio_data = self.audio_source.read(512)
+                    if not audio_data and not self.audio_source.is_live:
+                        print("Audio source exhausted")
+                        self.running = False
+                        break
+                    self.audio_buffer.append(audio_data)
                     self.get_time_since_last_speech(audio_data)
                     if len(audio_data) > 0:
                         try:
-                            if recognizer.AcceptWaveform(audio_data):
+                            decode_start = time.perf_counter()
+                            is_final = recognizer.AcceptWaveform(audio_data)
+                            metrics.record("asr.chunk", time.perf_counter() - decode_start)
+                            if is_final:
                                 result = json.loads(recognizer.Result())
-                                if result.get("text"):
-                                    print("result:", result)
-                                    self.process_speech(result["text"])
+                                hypotheses = parse_hypotheses(result)
+                                if hypotheses:
+                                    print("result:", [(h["text"], round(h["confidence"], 3)) for h in hypotheses])
+                                    self.process_speech(hypotheses[0]["text"], hypotheses)
                                 else:
                                     # print("Empty audio data received")
                                     pass
@@ -216,11 +295,20 @@ class ContinuousListener(QtCore.QThread):
                 else:
                     print("Stream is not active or not initialized")
                     time.sleep(0.1)
+                if self.action_handler:
+                    # commands the LLM fallback resolved start here, like matched ones
+                    self.action_handler.run_resolved_intents(self.chat_manager)
+                    self.finish_rescoring()
             except Exception as e:
                 print(f"Error in run method: {str(e)}")
                 logger.error(f"Error in run method: {str(e)}", exc_info=True)
                 time.sleep(0.1)
 
+        # a replayed recording can end while a command waits for its second pass
+        while self.pending_rescore is not None and not self.audio_source.is_live:
+            self.finish_rescoring()
+            time.sleep(0.01)
+
 
     def stop_speaking(self):
         self.is_speaking = False
@@ -230,25 +318,16 @@ class ContinuousListener(QtCore.QThread):
 
 
     def start_continuous_stream(self):
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-        
-        self.stream = self.audio.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=16000,
-            input=True,
-            frames_per_buffer=1024
-        )
-        print("Continuous listening stream started")
+        self.audio_source.open()
+        print(f"Continuous listening stream started ({type(self.audio_source).__name__})")
 
 
     def process_continuous_audio(self, audio_data):
         if recognizer.AcceptWaveform(audio_data):
             result = json.loads(recognizer.Result())
-            if result["text"]:
-                self.action_handler.process_speech(result["text"])
+            hypotheses = parse_hypotheses(result)
+            if hypotheses:
+                self.action_handler.process_speech(self.chat_manager, hypotheses[0]["text"], hypotheses)
 
 
     def audio_callback(self, in_data, frame_count, time_info, status):
@@ -289,15 +368,30 @@ class ContinuousListener(QtCore.QThread):
             return None  # Return None if the speech was only filler words
         
 
-    def process_speech(self, speech: str) -> None:
+    def clean_hypotheses(self, hypotheses):
+        cleaned = []
+        for hypothesis in hypotheses or []:
+            text = self.clean_speech(hypothesis["text"])
+            if text:
+                cleaned.append(dict(hypothesis, text=text))
+        return cleaned
+
+    def process_speech(self, speech: str, hypotheses=None) -> None:
         self.get_config()
         cleaned_speech = self.clean_speech(speech)
+        cleaned_hypotheses = self.clean_hypotheses(hypotheses)
         if cleaned_speech:
             self.update_last_speech_time()
 
         if self.is_listening:
             print("is_listening:", self.is_listening)
 
+            # "cut" drops the current recording or any transcription still queued
+            if cleaned_speech in self.config.get("cut_words", []) and (self.is_transcribing or self.transcription_service.has_pending()):
+                if self.action_handler:
+                    self.action_handler.cut_transcribing()
+                return
+
             if not self.is_transcribing and not self.is_speaking:
                 #waiting for an action
                 print("waiting for an action")
@@ -313,16 +407,22 @@ class ContinuousListener(QtCore.QThread):
                     signal_manager.disable_tray.emit()
                     signal_manager.voice_set_is_listening.emit(False)
                     signal_manager.action_set_is_listening.emit(False)
+                    if self.chat_manager:
+                        self.chat_manager.start_tts(phrase("stopped_listening"), channel="system")
                     return
 
                 # Check if the cleaned speech is not just a filler word
-                if cleaned_speech not in self.filler_words and len(cleaned_speech) > 1:
-                    if isinstance(speech, str):
-                        cleaned_speech = speech.encode('utf-8')
+                if cleaned_speech and cleaned_speech not in self.filler_words and len(cleaned_speech) > 1:
+                    # the cleaned best hypothesis, so it compares equal to cleaned_hypotheses[0]
+                    if isinstance(cleaned_speech, str):
+                        cleaned_speech = cleaned_speech.encode('utf-8')
                     
                     # Process the speech
                     if self.action_handler:    
-                        self.action_handler.process_speech(self.chat_manager, cleaned_speech)
+                        # a command still waiting for its second pass goes first
+                        self.finish_rescoring(force=True)
+                        if not self.start_rescoring(cleaned_speech, cleaned_hypotheses):
+                            self.run_command(cleaned_speech, cleaned_hypotheses)
             else:
                 print("SPEAKING:", self.is_speaking)
                 print("TRANSCRIBING:", self.is_transcribing)
@@ -335,7 +435,7 @@ class ContinuousListener(QtCore.QThread):
                         if isinstance(cleaned_speech, str):
                             cleaned_speech = cleaned_speech.encode('utf-8')
                     if self.action_handler:    
-                        self.action_handler.process_speech(self.chat_manager, cleaned_speech)
+                        self.action_handler.process_speech(self.chat_manager, cleaned_speech, cleaned_hypotheses)
 
 
 
@@ -348,9 +448,63 @@ class ContinuousListener(QtCore.QThread):
                 signal_manager.action_set_is_listening.emit(True)
                 signal_manager.voice_set_is_listening.emit(True)
                 signal_manager.enable_tray.emit()
+                signal_manager.play_cue.emit("listening_started")
                 return
 
 
+    def run_command(self, speech, hypotheses, second_pass_text=None):
+        first_text = hypotheses[0]["text"] if hypotheses else None
+        if second_pass_text:
+            hypotheses.insert(0, {"text": second_pass_text, "confidence": 1.0, "words": []})
+        self.action_handler.process_speech(self.chat_manager, speech, hypotheses)
+        if second_pass_text is not None:
+            matched_text = (self.action_handler.last_match or {}).get("text")
+            self.rescorer.record_outcome(first_text, second_pass_text, matched_text)
+
+    def start_rescoring(self, speech, hypotheses):
+        # unsure commands are held back for a second pass that runs off this
+        # thread, run() picks up the result without pausing the audio reads
+        if not self.rescorer or not self.rescorer.needs_rescore(hypotheses):
+            return False
+        command_id = next(self.command_ids)
+        audio_data = self.audio_buffer.latest(RESCORE_AUDIO_SECONDS)
+        if not self.rescorer.submit(audio_data, lambda text: self.rescored.put((command_id, text))):
+            return False
+        self.pending_rescore = {
+            "id": command_id,
+            "speech": speech,
+            "hypotheses": hypotheses,
+            "deadline": time.time() + self.rescorer.timeout,
+        }
+        return True
+
+    def finish_rescoring(self, force=False):
+        # runs the held back command once its second pass is in, or past the deadline
+        pending = self.pending_rescore
+        if pending is None:
+            return
+        text = None
+        finished = False
+        while True:
+            try:
+                command_id, result = self.rescored.get_nowait()
+            except queue.Empty:
+                break
+            if command_id == pending["id"]:
+                text, finished = result, True  # older, late results are dropped
+
+        if not finished:
+            if time.time() >= pending["deadline"]:
+                self.rescorer.record_timeout()
+            elif not force:
+                return
+            else:
+                print("Second pass superseded by the next command, using the first pass")
+
+        self.pending_rescore = None
+        second_pass_text = None if text is None else (self.clean_speech(text) or "")
+        self.run_command(pending["speech"], pending["hypotheses"], second_pass_text)
+
     def get_time_since_last_speech(self, audio_data):
         if self.last_speech_time is not None:
             current_time = time.time()
@@ -399,118 +553,117 @@ class ContinuousListener(QtCore.QThread):
         return (in_data, pyaudio.paContinue)  # Changed from (None, pyaudio.paContinue)
 
 
-    def start_transcribing(self):
+    def start_transcribing(self, words=None):
         signal_manager.set_oracle_green.emit()
         if self.is_transcribing:
             print("Transcription already in progress")
             return
-        
-        self.transcription_frames = []
-        self.transcription_stream = self.audio.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=44100,
-            input=True,
-            frames_per_buffer=1024,
-            stream_callback=self.transcription_callback
-        )
-        self.transcription_stream.start_stream()
+
+        # The trigger utterance has already been heard, so the capture starts
+        # in the past: right after the trigger phrase, using the Vosk word
+        # timings of the hypothesis that matched the action (sent with the signal).
+        words = words or []
+        trigger_span = None
+        if not self.action.get("keep_trigger", False):
+            triggers = [self.action.get("trigger", "")] + self.action.get("trigger_variants", [])
+            trigger_span = find_phrase_span(words, triggers)
+
+        if trigger_span:
+            capture_start = trigger_span[1]
+        elif words:
+            capture_start = words[0]["start"]
+        else:
+            capture_start = None
+        # only when the trigger was actually cut off the audio
+        self.transcription_trimmed = trigger_span is not None
+        self.audio_buffer.start_capture(capture_start)
 
         self.is_transcribing = True
         signal_manager.action_set_is_transcribing.emit(True)
         
-        print("Transcription stream started")
+        print(f"Transcription capture started at {capture_start}")
 
-
-    def transcription_callback(self, in_data, frame_count, time_info, status):
-        self.transcription_frames.append(in_data)
-        return (in_data, pyaudio.paContinue)
-    
-
-    def stop_transcribing(self, cut=False):
+    def stop_transcribing(self, hypotheses=None, cut=False):
         if not self.is_transcribing:
             return
-        
-        if self.transcription_stream:
-            self.transcription_stream.stop_stream()
-            self.transcription_stream.close()
-            self.transcription_stream = None
+
+        # cut the end phrase ("enter this", ...) off the end of the capture,
+        # using the hypotheses of the utterance that ended it
+        end_words = self.action.get("end", {}).get("words", [])
+        words = next((h["words"] for h in hypotheses or [] if h.get("words")), [])
+        end_span = find_phrase_span(words, end_words, first=False)
+        audio_data = self.audio_buffer.stop_capture(end_span[0] if end_span else None)
+
+        self.is_transcribing = False
+        signal_manager.action_set_is_transcribing.emit(False)
 
         if cut:
-            self.transcription_frames = []
+            print("Transcription cut")
             self.transcription_buffer = []
+            self.transcription_service.cancel_all()
             self.update_action_variables()
             return
 
-        # Generate MD5 hash for the filename
-        timestamp = int(time.time())
-        filename = f"audio_{timestamp}.wav"
-        md5_hash = hashlib.md5(filename.encode()).hexdigest()
-        self.audio_filename = os.path.join(TMP_DIR, f"{md5_hash}.wav")
-
-        # Save the recorded audio to a file
-        print("Saving audio file:", self.audio_filename)
-        wf = wave.open(self.audio_filename, 'wb')
-        wf.setnchannels(1)
-        wf.setsampwidth(self.audio.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(44100)
-        wf.writeframes(b''.join(self.transcription_frames))
-        wf.close()
-
-        # Reset transcription_frames after saving
-        self.transcription_frames = []
-
         print("action:", self.action)
         print("previous_action:", self.previous_action)
-        print("Transcription stopped and saved to file")
-
-        print(f"Transcribing audio file: {self.audio_filename}")
         print(f"Captured Speech Buffer: {self.transcription_buffer}")
 
-        self.is_transcribing = False
-        signal_manager.action_set_is_transcribing.emit(False)
+        # Whisper runs on the transcription service's worker thread; the
+        # action is executed there too once the text is available
+        action = self.action
+        data = {
+            "text": " ".join(self.transcription_buffer),
+            'trigger_sentence': list(self.transcription_buffer),
+            'trimmed': self.transcription_trimmed
+        }
+        audio = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+        self.transcription_service.submit(
+            audio,
+            callback=lambda result: self.on_transcription_complete(action, data, result),
+            priority=action.get("priority", PRIORITY_NORMAL),
+        )
+
+        self.update_action_variables()
 
-        translate = self.action.get('params', {}).get("method") == 'translate'
-        if translate:
-            # result = whisper_model.transcribe(audio_file, task="translate")
-            print("SOURCE LANGUAGE:", source_language)
-            print("TRANSCRIPTION:'n", transcription)
+    def cut_transcribing(self):
+        # the user said "cut": drop the recording and any queued transcription
+        if self.is_transcribing:
+            self.stop_transcribing(cut=True)
         else:
-            whisper_model = self.get_whisper_model()  # This will wait if the model is not yet loaded
-            result = whisper_model.transcribe(str(self.audio_filename), task="transcribe")
-            source_language = result["language"]
-            transcription = result["text"]
+            self.transcription_service.cancel_all()
 
-            print("TRANSCRIPTION:\n", transcription)
+    def on_transcription_complete(self, action, data, result):
+        transcription = result["text"]
+        print("TRANSCRIPTION:\n", transcription)
+        self.execute_action(dict(data, transcription=transcription), action)
 
-        self.execute_action({
-            "text": " ".join(self.transcription_buffer),
-            'transcription': transcription,
-            'trigger_sentence': self.transcription_buffer,
-            'audio_file': self.audio_filename
-        })
+    def on_transcription_failed(self, job_id, error):
+        print(f"Transcription job {job_id} failed: {error}")
+        key = "speech_model_failed" if self.whisper_load_error is not None else "transcription_failed"
+        self.chat_manager.start_tts(phrase(key), channel="system")
 
-        # print("deleting audio file:", self.audio_filename)
-        self.update_action_variables()
-        os.remove(str(self.audio_filename))
+    def on_action_failed(self, job_id, error):
+        print(f"Action on transcription job {job_id} failed: {error}")
+        self.chat_manager.start_tts(phrase("action_failed"), channel="system")
 
     def update_action_variables(self):
         self.previous_action = self.action
         self.action = {}
         signal_manager.action_set_action.emit(self.action)
 
-    def execute_action(self, data):       
-        print(f"Full Speech Sent to Transcription: {self.transcription_buffer}")
+    def execute_action(self, data, action=None):       
+        action = action if action is not None else self.action
+        print(f"Full Speech Sent to Transcription: {data.get('trigger_sentence')}")
         
-        print(f"Executing action: {self.action.get('trigger', 'Unknown action')}")
-        method = self.action.get('method')
+        print(f"Executing action: {action.get('trigger', 'Unknown action')}")
+        method = action.get('method')
         if method:
             module_name, function_name = method.rsplit('.', 1)
             module = importlib.import_module(f"distr.actions.{module_name}")
             function = getattr(module, function_name)
-            function(self.chat_manager, self.action, data)
+            function(self.chat_manager, action, data)
         else:
-            self.logger.warning(f"No method specified for action: {self.trigger_phrase}")
+            logger.warning(f"No method specified for action: {action.get('trigger')}")
             return False
 
 
@@ -519,27 +672,30 @@ class ContinuousListener(QtCore.QThread):
         try:
             self.whisper_model = whisper.load_model(WHISPER_MODEL_PATH)
             print("Whisper model (base.en) loaded successfully")
-            self.whisper_model_ready.set()
         except Exception as e:
+            self.whisper_load_error = e
             print(f"Error loading Whisper model: {str(e)}")
+        finally:
+            # set even on failure, so waiting transcriptions fail instead of hanging
+            self.whisper_model_ready.set()
         print("Whisper model initialization complete")
 
 
     def get_whisper_model(self):
-        self.whisper_model_ready.wait() 
+        self.whisper_model_ready.wait()
+        if self.whisper_load_error is not None:
+            raise RuntimeError(f"Whisper model failed to load: {self.whisper_load_error}")
         return self.whisper_model
 
     def stop(self):
         self.running = False
+        self.transcription_service.stop()
         self.wait()
 
     def __del__(self):
         try:
-            if hasattr(self, 'audio') and self.audio:
-                self.audio.terminate()
-            if hasattr(self, 'stream') and self.stream:
-                self.stream.stop_stream()
-                self.stream.close()
+            if hasattr(self, 'audio_source') and self.audio_source:
+                self.audio_source.close()
         except:
             pass  # Ignore any errors during cleanup
 
@@ -557,10 +713,11 @@ class ContinuousListener(QtCore.QThread):
         print(f"PyAudio version: {pyaudio.__version__}")
 
     def check_stream_status(self):
-        if self.stream:
-            print(f"Stream is {'active' if self.stream.is_active() else 'inactive'}")
-            print(f"Stream time: {self.stream.get_time()}")
-            print(f"Stream CPU load: {self.stream.get_cpu_load()}")
+        stream = getattr(self.audio_source, "stream", None)
+        if stream:
+            print(f"Stream is {'active' if stream.is_active() else 'inactive'}")
+            print(f"Stream time: {stream.get_time()}")
+            print(f"Stream CPU load: {stream.get_cpu_load()}")
         else:
             print("Stream is not initialized")
 
@@ -1,5 +1,5 @@
 from PyQt6.QtCore import Qt, pyqtSignal, QTimer, QSize
-from PyQt6.QtGui import QIcon, QAction, QMovie, QColor, QPainter, QFontMetrics, QBrush
+from PyQt6.QtGui import QIcon, QAction, QMovie, QColor, QPainter, QFontMetrics, QBrush, QTextCursor
 from PyQt6.QtWidgets import QPushButton, QListWidgetItem, QMenu, QMessageBox, QInputDialog, QLineEdit, QListWidget, QStyledItemDelegate
 from PyQt6 import QtWidgets
 from distr.core.db import get_session, Chat
@@ -541,6 +541,19 @@ class ChatWindow(QtWidgets.QMainWindow):
         print(f"Chat updated with ID: {chat_id}")
         self.load_chat_list(self.search_input.text())
 
+    def on_response_started(self, prompt):
+        self.chat_thread_view.append(f"Input: {prompt}")
+        self.chat_thread_view.append("Response: ")
+
+    def on_response_token(self, token):
+        # streamed tokens are appended to the current line as they arrive
+        self.chat_thread_view.moveCursor(QTextCursor.MoveOperation.End)
+        self.chat_thread_view.insertPlainText(token)
+        self.chat_thread_view.ensureCursorVisible()
+
+    def on_response_finished(self, response):
+        self.chat_thread_view.append("")
+
     def on_chat_deleted(self, chat_id):
         print(f"Chat deleted with ID: {chat_id}")
         self.load_chat_list(self.search_input.text())
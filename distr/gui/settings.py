@@ -7,6 +7,7 @@ import json
 import os
 import logging
 from distr.core.constants import MODELS_DIR
+from distr.core.utils import load_preferences_config
 
 SETTINGS_DIR = os.path.join(MODELS_DIR, "settings")
 INDEX_FOLDERS_FILE = os.path.join(SETTINGS_DIR, "index_folders.json")
@@ -684,11 +685,12 @@ class SettingsWindow(QMainWindow):
             'switch_oracle': self.switch_oracle.currentText(),
             'language': self.language_combo.currentText(),
             'vosk_sensitivity': self.vosk_sensitivity.value(),
-            'playback_speed': self.playback_speed.value(),
+            'playback_speed': round(0.5 + (self.speed_slider.value() - 10) * 0.05, 2),
             'input_device': self.input_device.currentText(),
             'output_device': self.output_device.currentText(),
             'diff_lock_audio': self.diff_lock_audio.isChecked(),
             'tts_voice': self.tts_voice.currentText(),
+            'tts_voice_id': self.tts_voice.currentData(),
             'openai_key': self.openai_key.text(),
             'anthropic_key': self.anthropic_key.text(),
             'agent_provider': self.agent_provider.currentText(),
@@ -730,8 +732,19 @@ class SettingsWindow(QMainWindow):
         x = (screen.width() - self.width()) // 2
         y = (screen.height() - self.height()) // 2
         self.move(x, y)
+        self.load_saved_settings()
         super().showEvent(event)
 
+    def load_saved_settings(self):
+        # the persisted TTS settings, so saving doesn't reset them to the widget defaults
+        preferences = load_preferences_config()
+        speed = preferences.get("playback_speed")
+        if speed is not None:
+            self.speed_slider.setValue(round((float(speed) - 0.5) / 0.05) + 10)
+        index = self.tts_voice.findData(preferences.get("tts_voice_id"))
+        if index >= 0:
+            self.tts_voice.setCurrentIndex(index)
+
     def apply_settings(self):
         # Gather the new settings
         new_settings = {}
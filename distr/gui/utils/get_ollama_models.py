@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
 from distr.core.constants import MODELS_DIR
+from distr.core.backend import http_session
 from bs4 import BeautifulSoup
-import requests
 import json
 import os
 import time
@@ -21,7 +21,7 @@ def scrape_ollama_library():
     else:
         print("Scraping website...")
         url = "https://ollama.com/library"
-        response = requests.get(url)
+        response = http_session().get(url, timeout=30)
         
         if response.status_code != 200:
             print(f"Failed to retrieve the page. Status code: {response.status_code}")
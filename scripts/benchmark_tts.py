@@ -0,0 +1,86 @@
+"""
+Benchmark the available TTS engines on this machine.
+
+Measures load time and the real-time factor (synthesis time / duration of the
+audio produced, lower is faster) of every engine that is installed, and
+writes the results to assets/cache/tts_benchmark.json, where TTSManager reads
+them to pick an engine that fits the latency budget.
+
+    python ./scripts/benchmark_tts.py
+    python ./scripts/benchmark_tts.py --engine piper --runs 5
+"""
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from distr.core.tts_engines import ENGINES, load_benchmarks, available_memory_mb
+from distr.core.constants import TTS_BENCHMARK_FILE
+
+SENTENCES = [
+    "Okay.",
+    "I'm sorry, I couldn't understand that. Could you please rephrase?",
+    "The capital of Australia is Canberra, which was chosen as a compromise between Sydney and Melbourne.",
+    "Here is a summary of the article: the team released a new version, fixed several bugs, "
+    "and improved the startup time by almost half on older machines.",
+]
+
+
+def benchmark(engine_class, runs):
+    engine = engine_class()
+    start_time = time.perf_counter()
+    engine.load()
+    load_seconds = time.perf_counter() - start_time
+
+    engine.synthesize("Warming up.")  # the first call pays for lazy initialisation
+
+    synthesis_seconds = 0.0
+    audio_seconds = 0.0
+    for _ in range(runs):
+        for sentence in SENTENCES:
+            start_time = time.perf_counter()
+            samples, sample_rate = engine.synthesize(sentence)
+            synthesis_seconds += time.perf_counter() - start_time
+            audio_seconds += len(samples) / sample_rate
+
+    return {
+        "rtf": round(synthesis_seconds / audio_seconds, 4),
+        "load_seconds": round(load_seconds, 2),
+        "audio_seconds": round(audio_seconds, 2),
+        "measured_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the real-time factor of the TTS engines")
+    parser.add_argument("--engine", help="only benchmark this engine")
+    parser.add_argument("--runs", type=int, default=3, help="passes over the test sentences")
+    args = parser.parse_args()
+
+    results = load_benchmarks()
+    print(f"Available memory: {available_memory_mb():.0f} MB")
+
+    for engine_class in ENGINES:
+        if args.engine and engine_class.name != args.engine:
+            continue
+        if not engine_class.is_available():
+            print(f"{engine_class.name:<12} not installed, skipped")
+            continue
+
+        print(f"Benchmarking {engine_class.name}...")
+        result = benchmark(engine_class, args.runs)
+        results[engine_class.name] = result
+        print(f"{engine_class.name:<12} RTF={result['rtf']:.3f}  load={result['load_seconds']:.1f} s  "
+              f"({result['audio_seconds']:.1f} s of audio)")
+
+    os.makedirs(os.path.dirname(TTS_BENCHMARK_FILE), exist_ok=True)
+    with open(TTS_BENCHMARK_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {TTS_BENCHMARK_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Pre-render the system phrase bank for every voice into the TTS cache, so
+switching voices in the settings never has to wait for the phrases.
+
+    python ./scripts/render_phrase_banks.py
+    python ./scripts/render_phrase_banks.py --speakers p225 p226 --workers 2
+"""
+import argparse
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from distr.core.batch_render import BatchRenderer, prerender_phrase_banks
+from distr.core.tts_engines import ENGINES
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render the phrase bank for every voice")
+    parser.add_argument("--engine", choices=[engine.name for engine in ENGINES], help="defaults to the engine the app would pick")
+    parser.add_argument("--speakers", nargs="*", help="defaults to every voice of the engine")
+    parser.add_argument("--workers", type=int, help="worker processes, capped by available memory")
+    args = parser.parse_args()
+
+    renderer = BatchRenderer(args.engine, workers=args.workers)
+    speakers = args.speakers
+    if not speakers:
+        engine = {engine.name: engine for engine in ENGINES}[renderer.engine_name]()
+        print(f"Loading {engine.name} to list its voices...")
+        engine.load()
+        speakers = engine.speakers or [engine.default_speaker]
+        del engine
+
+    prerender_phrase_banks(speakers, renderer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Replay recorded sessions through the voice pipeline without a microphone.
+
+Every WAV/FLAC file in a directory is fed through
+ContinuousListener -> ActionHandler -> actions, with the side effects stubbed
+out (keyboard/mouse, macOS APIs, the LLM and TTS), and the per-stage latency
+is printed at the end. Useful for catching regressions on CI machines without
+sound hardware.
+
+    python ./scripts/replay_sessions.py recordings/ --speed 4
+    python ./scripts/replay_sessions.py recordings/ --speed 0   # as fast as possible
+"""
+import argparse
+import types
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+MODEL_LOAD_TIMEOUT = 300  # seconds to wait for the second pass model (a first run downloads it)
+
+# everything the actions do to the machine is recorded here instead
+side_effects = []
+
+
+class SideEffectStub(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            side_effects.append((f"{self.__name__}.{name}", args, kwargs))
+            return (0, 0)
+        return record
+
+
+def install_stubs():
+    for module_name in ["pyautogui", "pyperclip", "AppKit", "Quartz"]:
+        sys.modules[module_name] = SideEffectStub(module_name)
+
+
+def find_sessions(directory):
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if f.lower().endswith((".wav", ".flac"))
+    )
+
+
+def wait_for_transcriptions(listener, timeout=120):
+    deadline = time.time() + timeout
+    while listener.transcription_service.has_pending() and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sessions through the voice pipeline")
+    parser.add_argument("directory", help="directory of .wav/.flac session recordings")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 = real time, 0 = as fast as possible")
+    parser.add_argument("--live", action="store_true", help="do not stub out the actions' side effects")
+    args = parser.parse_args()
+
+    sessions = find_sessions(args.directory)
+    if not sessions:
+        print(f"No recordings found in {args.directory}")
+        return 1
+
+    if not args.live:
+        install_stubs()
+
+    from PyQt6.QtCore import QCoreApplication, QObject
+    from distr.core.audio_source import FileAudioSource
+    from distr.core.actions import ActionHandler
+    from distr.core.chat import ChatManager
+    from distr.core.voice import ContinuousListener
+    from distr.core.metrics import metrics
+
+    class ReplayChatManager(ChatManager):
+        # keeps the prompt handling, but never calls the LLM or speaks
+        def __init__(self):
+            QObject.__init__(self)
+            self.prompts = []
+            self.spoken = []
+
+        def process_prompt(self, prompt):
+            self.prompts.append(prompt)
+            return {"message": {"content": "Stubbed response."}}
+
+        def stream_prompt(self, prompt):
+            self.prompts.append(prompt)
+            yield "Stubbed response."
+
+        def cancel_generation(self):
+            pass
+
+        def speculate(self, action, transcription_buffer):
+            pass
+
+        def start_tts(self, text, channel="response"):
+            self.spoken.append(text)
+
+        def start_tts_stream(self, channel="response"):
+            chat_manager = self
+
+            class StubSpeech:
+                def feed(self, text):
+                    chat_manager.spoken.append(text)
+
+                def close(self):
+                    pass
+            return StubSpeech()
+
+    app = QCoreApplication(sys.argv)
+    action_handler = ActionHandler()
+    action_handler.intent_fallback = False  # no LLM, and nothing learned from replays
+    chat_manager = ReplayChatManager()
+    listener = None
+
+    for path in sessions:
+        source = FileAudioSource(path, speed=args.speed)
+        if listener is None:
+            listener = ContinuousListener(action_handler, chat_manager, audio_source=source)
+            try:
+                listener.get_whisper_model()
+            except RuntimeError as e:
+                print(f"Cannot replay: {e}")
+                return 1
+            if not listener.rescorer.model_ready.wait(timeout=MODEL_LOAD_TIMEOUT):
+                print("Second pass Whisper model still loading, replaying without the second pass")
+            elif listener.rescorer.load_error is not None:
+                print(f"Second pass Whisper model failed to load ({listener.rescorer.load_error}), "
+                      f"replaying without the second pass")
+        else:
+            listener.audio_source = source
+
+        print(f"\n=== Replaying {os.path.basename(path)} ===")
+        effects_before = len(side_effects)
+        start_time = time.perf_counter()
+        listener.running = True
+        listener.run()  # returns when the file is exhausted
+        wait_for_transcriptions(listener)
+        elapsed = time.perf_counter() - start_time
+
+        print(f"Replayed {source.duration:.1f} s of audio in {elapsed:.1f} s")
+        for name, call_args, _ in side_effects[effects_before:]:
+            print(f"  side effect: {name}{call_args}")
+
+    listener.transcription_service.stop()
+
+    print("\n=== Per-stage latency ===")
+    print(metrics.report())
+    print(f"\nPrompts sent to the LLM: {len(chat_manager.prompts)}, spoken responses: {len(chat_manager.spoken)}")
+    app.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,429 @@
+"""
+A stand-in Ollama server for trying the chat pipeline without a real model.
+
+Serves /api/chat and /api/generate (streamed or not), /api/tags, /api/ps and
+/api/version, and answers with a canned response token by token. It imitates
+the timings that matter: a model load on the first request (and after
+keep_alive expires), prompt processing proportional to the part of the
+prompt that isn't a prefix of the previous one, and a fixed delay per token.
+It also counts connections and concurrent requests, and can turn the first
+requests away with a 503, to check the pooled backend client. The self-test
+also streams the chat manager's responses, and stops one halfway, against it.
+
+    python ./scripts/stub_ollama.py --port 11435
+    OLLAMA_HOST=http://127.0.0.1:11435 python -m distr.app
+
+    python ./scripts/stub_ollama.py --self-test
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import datetime, timezone, timedelta
+import argparse
+import threading
+import json
+import time
+import sys
+import os
+import re
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_RESPONSE = (
+    "Sure, here is a short answer. The stub server streams this text one word at a time, "
+    "so sentences reach the speech pipeline before the response is complete. "
+    "That is all for now!"
+)
+
+
+def parse_keep_alive(value, default=300):
+    # Ollama accepts seconds or durations like "5m", "1h"; negative means forever
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?", str(value).strip())
+    if not match:
+        return default
+    number, unit = float(match.group(1)), match.group(2) or "s"
+    return number * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.loaded = {}  # model -> expiry timestamp (None = forever)
+        self.last_prompt = ""
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_remaining = args.fail_first
+
+    def ensure_loaded(self, model, keep_alive):
+        # returns the time spent loading the model
+        with self.lock:
+            now = time.time()
+            expiry = self.loaded.get(model, 0)
+            needs_load = model not in self.loaded or (expiry is not None and expiry < now)
+        load_seconds = 0.0
+        if needs_load:
+            print(f"[stub] loading {model}")
+            time.sleep(self.args.load_time)
+            load_seconds = self.args.load_time
+        self.set_keep_alive(model, keep_alive)
+        return load_seconds
+
+    def set_keep_alive(self, model, keep_alive):
+        seconds = parse_keep_alive(keep_alive)
+        with self.lock:
+            if seconds == 0:
+                if model in self.loaded:
+                    print(f"[stub] unloading {model}")
+                self.loaded.pop(model, None)
+            else:
+                self.loaded[model] = None if seconds < 0 else time.time() + seconds
+
+    def prompt_eval(self, prompt):
+        # only the part after the common prefix with the previous prompt is processed again
+        with self.lock:
+            common = os.path.commonprefix([self.last_prompt, prompt])
+            self.last_prompt = prompt
+            self.requests += 1
+        uncached = len(prompt) - len(common)
+        return uncached, uncached * self.args.prompt_ms_per_char / 1000
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.state.lock:
+            self.server.state.connections += 1
+
+    def log_message(self, format, *args):
+        if self.server.state.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == "/api/version":
+            self.send_json({"version": "0.0.0-stub"})
+        elif self.path == "/api/tags":
+            self.send_json({"models": [{"name": state.args.model, "model": state.args.model, "size": 0}]})
+        elif self.path == "/api/ps":
+            with state.lock:
+                models = [
+                    {
+                        "name": model,
+                        "model": model,
+                        "expires_at": (datetime.fromtimestamp(expiry, timezone.utc) if expiry
+                                       else datetime.now(timezone.utc) + timedelta(days=365)).isoformat(),
+                    }
+                    for model, expiry in state.loaded.items()
+                    if expiry is None or expiry > time.time()
+                ]
+            self.send_json({"models": models})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with state.lock:
+            failing = state.fail_remaining > 0
+            if failing:
+                state.fail_remaining -= 1
+        if failing:
+            self.send_json({"error": "server busy, please try again"}, 503)
+            return
+
+        with state.lock:
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        try:
+            self.route(request)
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+    def route(self, request):
+        if self.path == "/api/chat":
+            prompt = "".join(f"{m.get('role')}:{m.get('content')}\n" for m in request.get("messages", []))
+            self.respond(request, prompt, chat=True)
+        elif self.path == "/api/generate":
+            self.respond(request, request.get("system", "") + request.get("prompt", ""), chat=False)
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def respond(self, request, prompt, chat):
+        state = self.server.state
+        args = state.args
+        model = request.get("model", args.model)
+        start_time = time.perf_counter()
+
+        if not prompt.strip() and parse_keep_alive(request.get("keep_alive")) == 0:
+            state.set_keep_alive(model, 0)
+            self.send_json({"model": model, "done": True, "done_reason": "unload", "response": ""})
+            return
+
+        load_seconds = state.ensure_loaded(model, request.get("keep_alive"))
+        if not prompt.strip():
+            # an empty request only loads the model
+            self.send_json({"model": model, "done": True, "done_reason": "load", "response": ""})
+            return
+
+        prompt_tokens, prompt_seconds = state.prompt_eval(prompt)
+        time.sleep(prompt_seconds)
+
+        num_predict = request.get("options", {}).get("num_predict", -1)
+        tokens = re.findall(r"\S+\s*", args.response)
+        if num_predict is not None and num_predict >= 0:
+            tokens = tokens[:num_predict]
+
+        def part(content, done=False):
+            payload = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": content}
+            else:
+                payload["response"] = content
+            if done:
+                payload.update({
+                    "done_reason": "stop",
+                    "total_duration": int((time.perf_counter() - start_time) * 1e9),
+                    "load_duration": int(load_seconds * 1e9),
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(prompt_seconds * 1e9),
+                    "eval_count": len(tokens),
+                    "eval_duration": int(len(tokens) * args.token_ms / 1000 * 1e9),
+                })
+            return payload
+
+        if not request.get("stream", True):
+            time.sleep(len(tokens) * args.token_ms / 1000)
+            self.send_json(part("".join(tokens), done=True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(args.token_ms / 1000)
+                self.write_chunk(part(token))
+            self.write_chunk(part("", done=True))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            print("[stub] client went away mid-response")
+
+    def write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_server(args):
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_chat_manager(client):
+    from PyQt6.QtCore import QObject
+    from distr.core.chat import ChatManager
+    from distr.core.history import ConversationHistory
+
+    class StubChatManager(ChatManager):
+        # the real prompt streaming against the stub, without SBERT or the user's preferences
+        def __init__(self):
+            QObject.__init__(self)
+            self.client = client
+            self.keep_alive = None
+            self.generation = None
+            self.generation_lock = threading.Lock()
+            self.abandoned_generations = 0
+            self.speculation = None
+            self.router = None
+            self.response_cache = None
+            self.history = ConversationHistory("You are a stub.")
+
+    return StubChatManager()
+
+
+def self_test(args):
+    from distr.core.backend import BackendClient, BACKGROUND
+    from distr.core.metrics import metrics
+    from distr.core.tts import stream_sentences
+
+    server = start_server(args)
+    state = server.state
+    host = f"http://127.0.0.1:{server.server_address[1]}"
+    client = BackendClient(host, max_concurrency=2, backoff=0.05)
+    messages = [{"role": "system", "content": "You are a stub."}, {"role": "user", "content": "Hello?"}]
+
+    start_time = time.perf_counter()
+    first_token = None
+    tokens = []
+    for part in client.chat(model=args.model, messages=messages, stream=True):
+        if part["message"]["content"]:
+            first_token = first_token or time.perf_counter() - start_time
+            tokens.append(part["message"]["content"])
+    total = time.perf_counter() - start_time
+
+    checks = {"streamed text matches the response": "".join(tokens) == args.response}
+    print(f"Streamed {len(tokens)} tokens, first after {first_token * 1000:.0f} ms, all after {total * 1000:.0f} ms")
+
+    # sequential calls reuse the pooled connection
+    connections = state.connections
+    timings = []
+    for _ in range(5):
+        start_time = time.perf_counter()
+        client.generate(model=args.model, prompt="Hi", options={"num_predict": 1})
+        timings.append((time.perf_counter() - start_time) * 1000)
+    print(f"5 sequential calls opened {state.connections - connections} new connections "
+          f"({', '.join(f'{ms:.0f}' for ms in timings)} ms)")
+    checks["sequential calls reuse one connection"] = state.connections - connections == 0
+
+    # a backend that turns the first requests away is retried
+    state.fail_remaining = 2
+    response = client.generate(model=args.model, prompt="Again", options={"num_predict": 2})
+    checks["503s are retried"] = state.fail_remaining == 0 and bool(response["response"])
+
+    # no more than max_concurrency requests reach the backend at once
+    state.max_in_flight = 0
+    threads = [threading.Thread(target=lambda: list(client.chat(model=args.model, messages=messages, stream=True)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"5 concurrent streams, at most {state.max_in_flight} in flight")
+    checks["concurrency is capped at 2"] = state.max_in_flight <= 2
+
+    # background work keeps to its slot, an interactive request goes straight in
+    metrics.reset()
+    background = [threading.Thread(target=lambda: client.generate(model=args.model, prompt="Summarise", priority=BACKGROUND))
+                  for _ in range(3)]
+    for thread in background:
+        thread.start()
+    time.sleep(0.05)
+    start_time = time.perf_counter()
+    client.generate(model=args.model, prompt="Quick", options={"num_predict": 1})
+    interactive_ms = (time.perf_counter() - start_time) * 1000
+    for thread in background:
+        thread.join()
+    waits = metrics.summary()["timings"]
+    print(f"Interactive call under background load took {interactive_ms:.0f} ms (queued "
+          f"{waits['llm.queue_wait.interactive']['max'] * 1000:.0f} ms, background queued up to "
+          f"{waits['llm.queue_wait.background']['max'] * 1000:.0f} ms)")
+    checks["interactive requests skip queued background work"] = (
+        waits["llm.queue_wait.interactive"]["max"] < waits["llm.queue_wait.background"]["max"])
+
+    # closing a stream while the prompt is still evaluated drops it at once
+    prompt_ms_per_char, args.prompt_ms_per_char = args.prompt_ms_per_char, 1000
+    stream = client.chat(model=args.model, messages=messages, stream=True)
+
+    def read_first():
+        try:
+            next(stream, None)
+        except Exception as e:
+            print(f"Reader stopped: {type(e).__name__}")
+    reader = threading.Thread(target=read_first, daemon=True)
+    reader.start()
+    time.sleep(0.2)
+    start_time = time.perf_counter()
+    stream.close()
+    reader.join(2)
+    args.prompt_ms_per_char = prompt_ms_per_char
+    print(f"Closed a stream during prompt eval, reader released after {(time.perf_counter() - start_time) * 1000:.0f} ms")
+    checks["closing a stream frees its slot during prompt eval"] = (
+        not reader.is_alive() and sum(client.scheduler.in_flight.values()) == 0)
+
+    # the chat manager's streamed response, split into sentences for speech
+    chat_manager = stub_chat_manager(client)
+    started, finished = [], []
+    chat_manager.response_started.connect(started.append)
+    chat_manager.response_finished.connect(finished.append)
+    metrics.reset()
+    sentences = list(stream_sentences(chat_manager.stream_prompt("Hello?")))
+    first_token = metrics.summary()["timings"].get("llm.time_to_first_token")
+    print(f"Chat manager streamed {len(sentences)} sentences"
+          + (f", first token after {first_token['max'] * 1000:.0f} ms" if first_token else ""))
+    checks["the chat manager streams whole sentences"] = (
+        len(sentences) > 1 and " ".join(sentences).split() == args.response.split())
+    checks["the streamed response is signalled and remembered"] = (
+        started == ["Hello?"] and finished == [args.response] and bool(first_token)
+        and chat_manager.history.turns[-1] == {"role": "assistant", "content": args.response})
+
+    # "stop" in the middle of a response ends the sentences and keeps what was said
+    finished.clear()
+    start_time = time.perf_counter()
+    sentences = []
+    for sentence in stream_sentences(chat_manager.stream_prompt("And again?")):
+        sentences.append(sentence)
+        if len(sentences) == 1:
+            chat_manager.cancel_generation()
+    cancelled_ms = (time.perf_counter() - start_time) * 1000
+    deadline = time.perf_counter() + 2
+    while sum(client.scheduler.in_flight.values()) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    partial = finished[0] if finished else ""
+    print(f"Cancelled a chat stream after {len(sentences)} sentences ({cancelled_ms:.0f} ms), kept {len(partial)} chars")
+    checks["cancelling a chat stream stops it mid-response"] = (
+        chat_manager.abandoned_generations == 1 and chat_manager.generation is None
+        and 0 < len(partial) < len(args.response)
+        and chat_manager.history.turns[-1] == {"role": "assistant", "content": partial}
+        and sum(client.scheduler.in_flight.values()) == 0)
+
+    for name, ok in checks.items():
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    passed = all(checks.values())
+    print("Self-test passed" if passed else "Self-test FAILED")
+    client.close()
+    server.shutdown()
+    return 0 if passed else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Ollama server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", default="gemma2:latest")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE, help="the canned response")
+    parser.add_argument("--load-time", type=float, default=2.0, help="seconds to 'load' the model")
+    parser.add_argument("--prompt-ms-per-char", type=float, default=0.2, help="prompt processing cost")
+    parser.add_argument("--token-ms", type=float, default=40, help="delay per generated token")
+    parser.add_argument("--fail-first", type=int, default=0, help="answer the first N requests with a 503")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--self-test", action="store_true", help="check the pooled client and the chat manager against the stub and exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        args.port = 0
+        args.load_time = min(args.load_time, 0.2)
+        args.token_ms = min(args.token_ms, 10)
+        return self_test(args)
+
+    server = start_server(args)
+    print(f"Stub Ollama listening on http://127.0.0.1:{args.port} (model {args.model})")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
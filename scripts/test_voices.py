@@ -9,6 +9,8 @@ import sys
 import termios
 import tty
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
 # Global variables
 tts_model = None
 nltk_initialized = False
@@ -42,6 +44,23 @@ def generate_audio_file(text, speaker):
             f.write(' '.join(text.split()))  # Join the text as it might be a list
         print(f"Audio generated for speaker {speaker}")
 
+def generate_audio_files(speakers):
+    # renders every speaker in parallel, one model per worker process; speakers
+    # that already have a sample are skipped, so an interrupted run can resume
+    from distr.core.batch_render import BatchRenderer
+
+    jobs = []
+    for speaker in speakers:
+        output_file = f"speakers/{speaker}.wav"
+        if os.path.exists(output_file):
+            continue
+        text = generate_random_paragraph()
+        with open(f"speakers/{speaker}.txt", 'w') as f:
+            f.write(' '.join(text.split()))
+        jobs.append((speaker, text, speaker, os.path.abspath(output_file)))
+
+    BatchRenderer("coqui-vits").render(jobs, unit="speakers")
+
 def play_audio_file(speaker):
     output_file = f"speakers/{speaker}.wav"
     process = subprocess.Popen(["afplay", "-r", "1.20", output_file])
@@ -152,15 +171,7 @@ if __name__ == "__main__":
         initialize_nltk()
         initialize_tts_model()
         speakers = list_available_speakers()
-        
-        total_speakers = len(speakers)
-        for i, speaker in enumerate(speakers, 1):
-            progress = (i / total_speakers) * 100
-            progress_bar = create_progress_bar(progress)
-            print(f"\nProcessing speaker {i}/{total_speakers}: {speaker} {progress_bar}")
-            text_to_speak = generate_random_paragraph()
-            generate_audio_file(text_to_speak, speaker)
-            print(f"Completed {i}/{total_speakers} speakers")
+        generate_audio_files(speakers)
     else:
         speakers = [f.split('.')[0] for f in os.listdir('./speakers/') if f.endswith('.wav')]
 